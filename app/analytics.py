@@ -0,0 +1,187 @@
+import os
+from collections import Counter
+from sqlalchemy import BigInteger, Integer, case, event, func, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models
+
+
+ANALYTICS_TOP_DEFAULT = int(os.getenv("ANALYTICS_TOP_DEFAULT", "10"))
+ANALYTICS_TOP_MAX = int(os.getenv("ANALYTICS_TOP_MAX", "1000"))
+
+PERCENTILES = (50, 90, 95, 99)
+
+_summary = models.InvoiceSummary.__table__
+KEY_COLUMNS = ("company_id", "product_id", "status", "lead_hours")
+SUMMARY_COLUMNS = KEY_COLUMNS + ("invoice_count",)
+
+
+def lead_hours(create_date, deliver_date):
+    """Whole hours from creation to delivery, None while not delivered."""
+    if create_date is None or deliver_date is None:
+        return None
+    return max(0, int((deliver_date - create_date).total_seconds() // 3600))
+
+
+def summary_key(company_id, product_id, status, create_date, deliver_date) -> tuple:
+    return (company_id, product_id, status, lead_hours(create_date, deliver_date))
+
+
+_KEY_ATTRIBUTES = ("company_id", "product_id", "status", "create_date", "deliver_date")
+
+
+def _current_key(obj) -> tuple:
+    return summary_key(*(getattr(obj, name) for name in _KEY_ATTRIBUTES))
+
+
+def _committed_key(obj) -> tuple:
+    state = inspect(obj)
+    values = []
+    for name in _KEY_ATTRIBUTES:
+        history = state.attrs[name].history
+        values.append(history.deleted[0] if history.deleted else getattr(obj, name))
+    return summary_key(*values)
+
+
+def apply_deltas(session: Session, deltas: Counter):
+    """Add ``deltas`` (summary key -> change in count) to the summary rows."""
+    # sorted so concurrent writers lock the shared rows in the same order
+    rows = [dict(zip(KEY_COLUMNS, key), invoice_count=n)
+            for key, n in sorted(deltas.items(), key=lambda item: repr(item[0])) if n]
+    if not rows:
+        return
+    stmt = insert(_summary).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[_summary.c[name] for name in KEY_COLUMNS],
+        set_={"invoice_count": _summary.c.invoice_count + stmt.excluded.invoice_count})
+    session.connection().execute(stmt)
+
+
+# Every ORM write of an invoice goes through a flush, sync or async, so the
+# summary moves in the same transaction. Set-based statements must call
+# apply_deltas themselves (see crud.bulk_create_invoices).
+@event.listens_for(Session, "before_flush")
+def _summarize_flush(session, flush_context, instances):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, models.Invoice):
+            deltas[_current_key(obj)] += 1
+    for obj in session.dirty:
+        if isinstance(obj, models.Invoice) and obj not in session.deleted:
+            deltas[_committed_key(obj)] -= 1
+            deltas[_current_key(obj)] += 1
+    for obj in session.deleted:
+        if isinstance(obj, models.Invoice):
+            deltas[_committed_key(obj)] -= 1
+    apply_deltas(session, deltas)
+
+
+def summary_query(company_id: int = None, product_id: int = None):
+    key = [_summary.c[name] for name in KEY_COLUMNS]
+    count = func.sum(_summary.c.invoice_count).cast(BigInteger)
+    # summed because a NULL lead_hours only conflicts where NULLs are not
+    # distinct (Postgres 15+); below zero only comes from deltas on invoices
+    # the summary never counted (written before it was backfilled)
+    stmt = select(*key, count).group_by(*key).having(count > 0)
+    if company_id is not None:
+        stmt = stmt.where(_summary.c.company_id == company_id)
+    if product_id is not None:
+        stmt = stmt.where(_summary.c.product_id == product_id)
+    return stmt
+
+
+def _lead_hours_column(invoices, dialect: str):
+    if dialect == "postgresql":
+        elapsed = func.floor(func.extract(
+            "epoch", invoices.c.deliver_date - invoices.c.create_date) / 3600).cast(Integer)
+    else:
+        elapsed = ((func.julianday(invoices.c.deliver_date) - func.julianday(invoices.c.create_date))
+                   * 24).cast(Integer)
+    # GREATEST would turn the NULL of an undelivered invoice into 0
+    return case((elapsed < 0, 0), else_=elapsed)
+
+
+def refill(conn):
+    """Recompute the summary from the invoices table on ``conn`` (a
+    connection or session), inside the caller's transaction.
+
+    On Postgres writers are blocked until it commits so no delta is lost in
+    between.
+    """
+    invoices = models.Invoice.__table__
+    dialect = conn.get_bind().dialect.name if isinstance(conn, Session) else conn.dialect.name
+    hours = _lead_hours_column(invoices, dialect)
+    if dialect == "postgresql":
+        conn.execute(text(f"LOCK TABLE {invoices.name} IN SHARE MODE"))
+    conn.execute(_summary.delete())
+    conn.execute(insert(_summary).from_select(
+        SUMMARY_COLUMNS,
+        select(invoices.c.company_id, invoices.c.product_id, invoices.c.status, hours, func.count())
+        .group_by(invoices.c.company_id, invoices.c.product_id, invoices.c.status, hours)))
+
+
+def rebuild(db: Session):
+    """Recompute the summary, e.g. after a backfill that bypassed the ORM."""
+    refill(db)
+    db.commit()
+
+
+# numpy and pandas are imported by the functions below: they take about half
+# a second to import and only /analytics/invoices needs them
+
+def _volumes(frame, column: str, top: int) -> list:
+    import pandas as pd
+    by_status = frame.groupby([column, "status"], dropna=False).invoice_count.sum().unstack(fill_value=0)
+    totals = by_status.sum(axis=1)
+    top_keys = totals[totals > 0].nlargest(top).index
+    return [{column: None if pd.isna(key) else int(key),
+             "invoices": int(totals[key]),
+             "by_status": {status: int(n) for status, n in by_status.loc[key].items() if n}}
+            for key in top_keys]
+
+
+def _lead_time(frame) -> dict:
+    import numpy as np
+    delivered = frame[frame.lead_hours.notna() & (frame.invoice_count > 0)]
+    hours = delivered.lead_hours.to_numpy(dtype=np.int64)
+    counts = delivered.invoice_count.to_numpy(dtype=np.int64)
+    order = np.argsort(hours, kind="stable")
+    hours, counts = hours[order], counts[order]
+    cumulative = np.cumsum(counts)
+    total = int(cumulative[-1]) if len(cumulative) else 0
+    stats = {"delivered": total}
+    if not total:
+        return stats | {f"p{q}_hours": None for q in PERCENTILES} | {"max_hours": None}
+    # nearest rank over the per-hour histogram
+    ranks = np.ceil(np.array(PERCENTILES) / 100 * total)
+    indexes = np.searchsorted(cumulative, ranks, side="left")
+    values = hours[np.minimum(indexes, len(hours) - 1)]
+    stats.update({f"p{q}_hours": int(v) for q, v in zip(PERCENTILES, values)})
+    stats["max_hours"] = int(hours[counts > 0][-1])
+    return stats
+
+
+def summarize(rows, top: int = ANALYTICS_TOP_DEFAULT) -> dict:
+    """Aggregate summary ``rows`` (as returned by summary_query)."""
+    import pandas as pd
+    frame = pd.DataFrame.from_records(list(rows), columns=SUMMARY_COLUMNS)
+    for column in ("company_id", "product_id", "lead_hours"):
+        frame[column] = frame[column].astype("Int64")
+    frame["status"] = frame["status"].fillna("unknown")
+    frame["invoice_count"] = frame["invoice_count"].astype("int64")
+    by_status = frame.groupby("status").invoice_count.sum()
+    return {"total": int(frame.invoice_count.sum()),
+            "by_status": {status: int(n) for status, n in by_status.items() if n},
+            "companies": _volumes(frame, "company_id", top),
+            "products": _volumes(frame, "product_id", top),
+            "lead_time": _lead_time(frame)}
+
+
+if __name__ == "__main__":
+    import sys
+    import database
+
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python analytics.py rebuild")
+    with database.SessionLocal() as db:
+        rebuild(db)
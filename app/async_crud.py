@@ -0,0 +1,395 @@
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud
+import models
+import schemas
+import pagination
+import loading
+import search
+import revocations
+from datetime import datetime
+import principals
+
+
+# Async mirror of crud.py for DB_MODE=async. Functions that only exist in
+# crud.py are served through AsyncSession.run_sync, which still drives the
+# asyncpg connection without blocking the event loop.
+def __getattr__(name):
+    fn = getattr(crud, name)
+
+    async def run_sync(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(lambda session: fn(session, *args, **kwargs))
+
+    return run_sync
+
+
+async def _first(db: AsyncSession, stmt):
+    res = await db.execute(stmt)
+    return res.scalars().first()
+
+
+async def _all(db: AsyncSession, stmt):
+    res = await db.execute(stmt)
+    return res.scalars().all()
+
+
+async def get_product_tags(db: AsyncSession, page: schemas.PageParams = None,
+                           filters: schemas.ProductTagFilter = None):
+    if page is None:
+        return await _all(db, select(models.ProductTag))
+    return await _all(db, pagination.page_query(models.ProductTag, page, filters))
+
+
+async def get_product_tag(db: AsyncSession, tag_id: int):
+    return await _first(db, select(models.ProductTag).where(
+        models.ProductTag.id == tag_id))
+
+
+async def get_companies(db: AsyncSession, page: schemas.PageParams = None,
+                        filters: schemas.CompanyFilter = None):
+    if page is None:
+        return await _all(db, select(models.Company))
+    return await _all(db, pagination.page_query(models.Company, page, filters))
+
+
+async def get_company(db: AsyncSession, company_id: int):
+    return await _first(db, select(models.Company).where(
+        models.Company.id == company_id))
+
+
+async def get_users(db: AsyncSession, page: schemas.PageParams = None,
+                    filters: schemas.UserFilter = None, expand: tuple = None):
+    options = loading.load_options(models.User, expand)
+    if page is None:
+        return await _all(db, select(models.User).options(*options))
+    return await _all(db, pagination.page_query(models.User, page, filters).options(*options))
+
+
+async def get_user(db: AsyncSession, user_id: int, expand: tuple = None):
+    return await _first(db, select(models.User).options(
+        *loading.load_options(models.User, expand)).where(models.User.id == user_id))
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await _first(db, select(models.User).where(
+        models.User.user_name == username))
+
+
+async def get_products(db: AsyncSession, page: schemas.PageParams = None,
+                       filters: schemas.ProductFilter = None):
+    if page is None:
+        return await _all(db, select(models.Product))
+    return await _all(db, pagination.page_query(models.Product, page, filters))
+
+
+async def search_products(db: AsyncSession, q: str, match: str, page: schemas.PageParams,
+                          filters: schemas.ProductFilter = None):
+    return await _all(db, pagination.page_query(models.Product, page, filters).where(
+        models.Product.product_name.ilike(search.like_pattern(q, match), escape="\\")))
+
+
+async def get_product(db: AsyncSession, product_id: int):
+    return await _first(db, select(models.Product).where(
+        models.Product.id == product_id))
+
+
+async def get_invoices(db: AsyncSession, page: schemas.PageParams = None,
+                       filters: schemas.InvoiceFilter = None, expand: tuple = None):
+    options = loading.load_options(models.Invoice, expand)
+    if page is None:
+        return await _all(db, select(models.Invoice).options(*options))
+    return await _all(db, pagination.page_query(models.Invoice, page, filters).options(*options))
+
+
+async def get_invoice(db: AsyncSession, invoice_id: int, expand: tuple = None):
+    return await _first(db, select(models.Invoice).options(
+        *loading.load_options(models.Invoice, expand)).where(
+        models.Invoice.id == invoice_id))
+
+
+async def get_bookmarks(db: AsyncSession, page: schemas.PageParams = None,
+                        filters: schemas.UserBookmarkFilter = None, expand: tuple = None):
+    options = loading.load_options(models.UserBookmark, expand)
+    if page is None:
+        return await _all(db, select(models.UserBookmark).options(*options))
+    return await _all(db, pagination.page_query(models.UserBookmark, page, filters).options(*options))
+
+
+async def get_bookmark(db: AsyncSession, user_id: int, expand: tuple = None):
+    return await _all(db, select(models.UserBookmark).options(
+        *loading.load_options(models.UserBookmark, expand)).where(
+        models.UserBookmark.user_id == user_id))
+
+
+async def get_bank_accounts(db: AsyncSession, page: schemas.PageParams = None,
+                            filters: schemas.BankAccountFilter = None):
+    if page is None:
+        return await _all(db, select(models.BankAccount))
+    return await _all(db, pagination.page_query(models.BankAccount, page, filters))
+
+
+async def get_bank_account(db: AsyncSession, user_id: int):
+    return await _first(db, select(models.BankAccount).where(
+        models.BankAccount.user_id == user_id))
+
+
+async def _save(db: AsyncSession, db_obj):
+    db.add(db_obj)
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        exists = crud.as_already_exists(e)
+        if exists:
+            raise exists from e
+        raise
+    await db.refresh(db_obj)
+    return db_obj
+
+
+async def _upsert(db: AsyncSession, stmt):
+    res = await db.scalars(stmt, execution_options={"populate_existing": True})
+    db_obj = res.one()
+    await db.commit()
+    return db_obj
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    user_db_model = models.User()
+    user_db_model.user_name = user.username
+    user_db_model.user_address = user.user_address
+    user_db_model.user_email = user.user_email
+    user_db_model.user_phone = user.user_phone
+    user_db_model.user_identity_code = user.user_identity_code
+    user_db_model.user_password = user.password
+    user_db_model.date_created = datetime.now()
+    return await _save(db, user_db_model)
+
+
+async def update_user(db: AsyncSession, user: schemas.UserUpdate):
+    db_user = await get_user(db, user.id)
+    if not db_user:
+        return None
+    principals.invalidate_on_commit(db, db_user.user_name, user.username)
+    # the password may have changed: tokens issued so far stop working
+    revocations.revoke(db, db_user.id)
+    db_user.last_login_token = None
+    db_user.user_name = user.username
+    db_user.user_password = user.password
+    db_user.user_address = user.user_address
+    db_user.user_email = user.user_email
+    db_user.user_phone = user.user_phone
+    db_user.user_identity_code = user.user_identity_code
+    db_user.date_updated = datetime.now()
+    return await _save(db, db_user)
+
+
+async def update_user_password(db: AsyncSession, user_id: int, hashed_password: str):
+    db_user = await get_user(db, user_id)
+    if not db_user:
+        return None
+    principals.invalidate_on_commit(db, db_user.user_name)
+    db_user.user_password = hashed_password
+    db_user.date_updated = datetime.now()
+    await db.commit()
+    return db_user
+
+
+async def create_product_tag(db: AsyncSession, product_tag: schemas.ProductTag):
+    db_product_tag = models.ProductTag()
+    db_product_tag.tag_name = product_tag.tag_name
+    db_product_tag.create_date = datetime.now()
+    return await _save(db, db_product_tag)
+
+
+async def upsert_product_tag(db: AsyncSession, product_tag: schemas.ProductTag):
+    return await _upsert(db, crud.product_tag_upsert(product_tag))
+
+
+async def update_product_tag(db: AsyncSession, product_tag: schemas.ProductTagUpdate):
+    db_product_tag = await get_product_tag(db, product_tag.id)
+    if not db_product_tag:
+        return None
+    db_product_tag.tag_name = product_tag.tag_name
+    db_product_tag.update_date = datetime.now()
+    return await _save(db, db_product_tag)
+
+
+async def create_product(db: AsyncSession, product: schemas.ProductBase):
+    db_product = models.Product()
+    db_product.product_name = product.product_name
+    db_product.product_price = product.product_price
+    db_product.product_tag_id = product.product_tag_id
+    db_product.company_id = product.company_id
+    db_product.create_date = datetime.now()
+    db_product.update_date = datetime.now()
+    return await _save(db, db_product)
+
+
+async def update_product(db: AsyncSession, product: schemas.ProductUpdate):
+    db_product = await get_product(db, product.id)
+    if not db_product:
+        return None
+    db_product.product_name = product.product_name
+    db_product.product_price = product.product_price
+    db_product.product_tag_id = product.product_tag_id
+    db_product.company_id = product.company_id
+    db_product.update_date = datetime.now()
+    return await _save(db, db_product)
+
+
+async def create_company(db: AsyncSession, company: schemas.CompanyBase):
+    db_company = models.Company()
+    db_company.company_name = company.company_name
+    db_company.user_id = company.user_id
+    db_company.company_address = company.company_address
+    db_company.company_phone = company.company_phone
+    db_company.create_date = datetime.now()
+    db_company.update_date = datetime.now()
+    return await _save(db, db_company)
+
+
+async def upsert_company(db: AsyncSession, company: schemas.CompanyBase):
+    return await _upsert(db, crud.company_upsert(company))
+
+
+async def update_company(db: AsyncSession, company: schemas.CompanyUpdate):
+    db_company = await get_company(db, company.id)
+    if not db_company:
+        return None
+    db_company.company_name = company.company_name
+    db_company.company_address = company.company_address
+    db_company.company_phone = company.company_phone
+    db_company.user_id = company.user_id
+    db_company.update_date = datetime.now()
+    return await _save(db, db_company)
+
+
+async def create_bookmark(db: AsyncSession, user_bookmark: schemas.UserBookMark):
+    db_user_bookmark = models.UserBookmark()
+    db_user_bookmark.create_date = datetime.now()
+    db_user_bookmark.product_id = user_bookmark.product_id
+    db_user_bookmark.user_id = user_bookmark.user_id
+    db_user_bookmark.is_favorite = user_bookmark.is_favorite
+    return await _save(db, db_user_bookmark)
+
+
+async def add_bookmark_to_user(db: AsyncSession, user_bookmark: schemas.UserBookMark):
+    related_user = await get_user(db, user_bookmark.user_id)
+    created_bookmark = await create_bookmark(db=db, user_bookmark=user_bookmark)
+    related_user.user_bookmark_id = created_bookmark.id
+    return await _save(db, related_user)
+
+
+async def create_bank_account(db: AsyncSession, bank_account: schemas.BankAccountBase):
+    db_bank_account = models.BankAccount()
+    db_bank_account.bank_name = bank_account.bank_name
+    db_bank_account.bank_address = bank_account.bank_address
+    db_bank_account.bank_account_no = bank_account.bank_account_no
+    db_bank_account.bank_phone_number = bank_account.bank_phone_number
+    db_bank_account.bank_province = bank_account.bank_province
+    db_bank_account.bank_city = bank_account.bank_city
+    db_bank_account.bank_card_no = bank_account.bank_card_no
+    db_bank_account.user_id = bank_account.user_id
+    db_bank_account.create_date = datetime.now()
+    return await _save(db, db_bank_account)
+
+
+async def upsert_bank_account(db: AsyncSession, bank_account: schemas.BankAccountBase):
+    return await _upsert(db, crud.bank_account_upsert(bank_account))
+
+
+async def update_bank_account(db: AsyncSession, bank_account: schemas.BankAccountUpdate):
+    db_bank_account = await _first(db, select(models.BankAccount).where(
+        models.BankAccount.id == bank_account.id))
+    if not db_bank_account:
+        return None
+    db_bank_account.bank_name = bank_account.bank_name
+    db_bank_account.bank_address = bank_account.bank_address
+    db_bank_account.bank_account_no = bank_account.bank_account_no
+    db_bank_account.bank_phone_number = bank_account.bank_phone_number
+    db_bank_account.bank_province = bank_account.bank_province
+    db_bank_account.bank_city = bank_account.bank_city
+    db_bank_account.bank_card_no = bank_account.bank_card_no
+    db_bank_account.user_id = bank_account.user_id
+    return await _save(db, db_bank_account)
+
+
+async def add_bank_account_to_user(db: AsyncSession, bank_account: schemas.BankAccountBase):
+    related_user = await get_user(db, bank_account.user_id)
+    created_bank_account = await create_bank_account(db=db, bank_account=bank_account)
+    related_user.user_bank_account_id = created_bank_account.id
+    return await _save(db, related_user)
+
+
+async def create_invoice(db: AsyncSession, invoice: schemas.Invoice):
+    db_invoice = models.Invoice()
+    db_invoice.user_id = invoice.user_id
+    db_invoice.product_id = invoice.product_id
+    db_invoice.company_id = invoice.company_id
+    db_invoice.status = invoice.status
+    db_invoice.create_date = datetime.now()
+    return await _save(db, db_invoice)
+
+
+async def update_invoice(db: AsyncSession, invoice: schemas.InvoiceUpdate):
+    db_invoice = await get_invoice(db, invoice.id)
+    if not db_invoice:
+        return None
+    db_invoice.user_id = invoice.user_id
+    db_invoice.product_id = invoice.product_id
+    db_invoice.company_id = invoice.company_id
+    db_invoice.status = invoice.status
+    return await _save(db, db_invoice)
+
+
+async def _delete(db: AsyncSession, db_obj):
+    if db_obj is None:
+        return None
+    await db.delete(db_obj)
+    await db.commit()
+    return db_obj
+
+
+async def delete_user(db: AsyncSession, user_id: int):
+    db_user = await get_user(db, user_id)
+    if not db_user:
+        return None
+    principals.invalidate_on_commit(db, db_user.user_name)
+    revocations.revoke(db, db_user.id)
+    return await _delete(db, db_user)
+
+
+async def delete_product(db: AsyncSession, product_id: int):
+    return await _delete(db, await get_product(db, product_id))
+
+
+async def delete_company(db: AsyncSession, company_id: int):
+    return await _delete(db, await get_company(db, company_id))
+
+
+async def delete_product_tag(db: AsyncSession, tag_id: int):
+    return await _delete(db, await get_product_tag(db, tag_id))
+
+
+async def delete_bookmark(db: AsyncSession, bookmark_id: int):
+    return await _delete(db, await _first(db, select(models.UserBookmark).where(
+        models.UserBookmark.id == bookmark_id)))
+
+
+async def delete_bookmarks(db: AsyncSession, user_id: int):
+    db_bookmarks = await _all(db, select(models.UserBookmark).where(models.UserBookmark.user_id == user_id))
+    for db_bookmark in db_bookmarks:
+        await db.delete(db_bookmark)
+    await db.commit()
+    return db_bookmarks
+
+
+async def delete_bank_account(db: AsyncSession, bank_account_id: int):
+    return await _delete(db, await _first(db, select(models.BankAccount).where(
+        models.BankAccount.id == bank_account_id)))
+
+
+async def delete_invoice(db: AsyncSession, invoice_id: int):
+    return await _delete(db, await get_invoice(db, invoice_id))
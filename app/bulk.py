@@ -0,0 +1,107 @@
+import io
+import os
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_CHUNK_MAX = int(os.getenv("BULK_CHUNK_MAX", "10000"))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "100000"))
+# Operations per /batch request; each runs through its route's handler
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "100"))
+# Payloads at least this large are loaded with COPY when the driver allows it
+BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "20000"))
+
+
+def validate_rows(schema, rows: list):
+    """Validate each raw row on its own so one bad row doesn't reject the rest.
+
+    Returns ``(valid, errors)`` where ``valid`` is a list of ``(index, obj)``.
+    """
+    valid, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, schema.model_validate(row)))
+        except ValidationError as e:
+            errors.append({"index": index, "detail": e.errors(include_url=False)})
+    return valid, errors
+
+
+def _error_detail(e: DBAPIError) -> str:
+    return str(e.orig).strip().splitlines()[0]
+
+
+def _insert_chunk(db: Session, model, chunk):
+    stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+    return db.scalars(stmt, [values for _, values in chunk]).all()
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t") \
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_chunk(db: Session, model, chunk):
+    # COPY into a temp staging table, then one INSERT ... SELECT ... RETURNING
+    # so the ids still come back in input order.
+    table = model.__table__
+    columns = list(chunk[0][1])
+    names = ", ".join(table.c[c].name for c in columns)
+    staging = f"_bulk_{table.name}"
+    buf = io.StringIO()
+    for ordinal, (_, values) in enumerate(chunk):
+        buf.write("\t".join([str(ordinal)] + [_copy_value(values[c]) for c in columns]) + "\n")
+    buf.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DROP AS "
+                       f"SELECT 0 AS _ord, {names} FROM {table.name} WITH NO DATA")
+        cursor.execute(f"TRUNCATE {staging}")
+        cursor.copy_expert(f"COPY {staging} (_ord, {names}) FROM STDIN", buf)
+        cursor.execute(f"INSERT INTO {table.name} ({names}) SELECT {names} FROM {staging} "
+                       f"ORDER BY _ord RETURNING id")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def bulk_insert(db: Session, model, rows: list, chunk_size: int = BULK_CHUNK_SIZE,
+                before_commit=None):
+    """Insert ``rows`` (``(index, values)`` pairs) in chunks and commit.
+
+    Each chunk is one multi-row INSERT ... RETURNING (or COPY for large
+    payloads on psycopg2) inside a savepoint. A chunk that fails is retried
+    row by row so only the offending rows are reported. ``before_commit``,
+    if given, is called with the created entries inside the transaction.
+    Returns ``(created, errors)``.
+    """
+    dialect = db.get_bind().dialect
+    use_copy = len(rows) >= BULK_COPY_THRESHOLD and dialect.driver == "psycopg2"
+    # COPY talks to the raw cursor, whose errors are not wrapped by SQLAlchemy
+    db_errors = (DBAPIError, dialect.loaded_dbapi.Error)
+    created, errors = [], []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            with db.begin_nested():
+                ids = _copy_chunk(db, model, chunk) if use_copy else _insert_chunk(db, model, chunk)
+            created.extend({"index": index, "id": id_} for (index, _), id_ in zip(chunk, ids))
+            continue
+        except db_errors:
+            pass
+        for index, values in chunk:
+            try:
+                with db.begin_nested():
+                    id_ = _insert_chunk(db, model, [(index, values)])[0]
+                created.append({"index": index, "id": id_})
+            except DBAPIError as e:
+                errors.append({"index": index, "detail": _error_detail(e)})
+    if before_commit is not None:
+        before_commit(created)
+    db.commit()
+    return created, errors
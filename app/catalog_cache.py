@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+import db_pool
+import models
+import schemas
+
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "10000"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+CATALOG_CACHE_NEGATIVE_TTL = float(os.getenv("CATALOG_CACHE_NEGATIVE_TTL", "5"))
+# "local" keeps invalidations inside this process; "postgres" also relays
+# them to every other worker and replica with LISTEN/NOTIFY
+CATALOG_CACHE_BUS = os.getenv("CATALOG_CACHE_BUS", "local")
+CATALOG_CACHE_CHANNEL = "catalog_cache"
+
+logger = logging.getLogger(__name__)
+
+# Cached marker for "no such row"
+MISSING = object()
+
+
+class LocalBackend:
+    """Bounded LRU with per-entry expiry, private to this process."""
+
+    def __init__(self, maxsize: int = CATALOG_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalBus:
+    """In-process pub/sub; stands in for a shared broker with one worker."""
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, namespace: str, callback):
+        self._subscribers[namespace] = callback
+
+    def deliver(self, namespace: str, keys):
+        callback = self._subscribers.get(namespace)
+        if callback:
+            callback(keys)
+
+    def publish(self, namespace: str, keys):
+        """``keys`` is a list of ids, or None to drop the whole namespace."""
+        self.deliver(namespace, keys)
+
+    def start(self):
+        """Start relaying; called once the app starts serving."""
+        if db_pool.WEB_CONCURRENCY > 1 or db_pool.APP_REPLICAS > 1:
+            logger.warning("catalog cache: CATALOG_CACHE_BUS=local with several workers; their caches "
+                           "only catch up with each other's writes by the table versions")
+
+    def after_fork(self):
+        """Called in a worker forked from a process that imported the app."""
+
+
+class PostgresBus(LocalBus):
+    """Relays invalidations between processes through Postgres NOTIFY.
+
+    Local subscribers are called right away; a background thread LISTENs on
+    a dedicated connection and applies what other processes publish.
+    """
+
+    def __init__(self, channel: str = CATALOG_CACHE_CHANNEL):
+        super().__init__()
+        self.channel = channel
+        self._listener = None
+        # NOTIFY is sent off the caller's thread, which may be the event loop
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-cache-notify")
+
+    def start(self):
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen, name="catalog-cache-listener",
+                                              daemon=True)
+            self._listener.start()
+
+    def after_fork(self):
+        # threads are not copied by fork(); start() runs again in the worker
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-cache-notify")
+        self._listener = None
+
+    def publish(self, namespace: str, keys):
+        self.deliver(namespace, keys)
+        self._sender.submit(self._notify, json.dumps({"ns": namespace, "keys": keys}))
+
+    def _notify(self, payload: str):
+        import database
+        try:
+            with database.engine.connect() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                             {"channel": self.channel, "payload": payload})
+                conn.commit()
+        except Exception:
+            # the other workers fall back to the TTL
+            logger.exception("catalog cache: failed to publish invalidation")
+
+    def _listen(self):
+        import database
+        while True:
+            try:
+                # a dedicated connection, taken out of the pool for good
+                fairy = database.engine.raw_connection()
+                conn = fairy.driver_connection
+                fairy.detach()
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {self.channel}")
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        message = json.loads(conn.notifies.pop(0).payload)
+                        self.deliver(message["ns"], message["keys"])
+            except Exception:
+                logger.exception("catalog cache: listener failed, reconnecting")
+                time.sleep(1)
+
+
+BUSES = {"local": LocalBus, "postgres": PostgresBus}
+
+
+class ReadThroughCache:
+    """Cache of detached snapshots in front of one by-id getter.
+
+    Misses are cached too (for ``negative_ttl``). A value loaded while an
+    invalidation happened is not stored, so a reader racing a writer can't
+    put the old row back.
+
+    Each entry remembers the table version (etags.py) current when it was
+    read; a lookup with a newer version misses. A write in another worker
+    bumps the version, so a response never pairs a new ETag with an old
+    body, even if the invalidation itself never arrives.
+    """
+
+    def __init__(self, namespace: str, bus, backend=None,
+                 ttl: float = CATALOG_CACHE_TTL, negative_ttl: float = CATALOG_CACHE_NEGATIVE_TTL):
+        self.namespace = namespace
+        self.backend = backend if backend is not None else LocalBackend()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.generation = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.bus = bus
+        bus.subscribe(namespace, self._apply)
+
+    def lookup(self, key, version: int = 0):
+        """Return ``(found, value, generation)``; pass ``generation`` to store."""
+        entry = self.backend.get(key)
+        if entry is None or entry[1] < version:
+            self.misses += 1
+            return False, None, self.generation
+        value = entry[0]
+        if value is MISSING:
+            self.negative_hits += 1
+            return True, None, self.generation
+        self.hits += 1
+        return True, value, self.generation
+
+    def store(self, key, value, generation: int, version: int = 0):
+        """Cache ``value`` as read at table ``version``."""
+        if generation != self.generation:
+            return
+        if value is None:
+            self.backend.set(key, (MISSING, version), self.negative_ttl)
+        else:
+            self.backend.set(key, (value, version), self.ttl)
+
+    def invalidate(self, keys=None):
+        """Drop ``keys`` (or everything) here and in every subscribed worker."""
+        self.bus.publish(self.namespace, list(keys) if keys is not None else None)
+
+    def _apply(self, keys):
+        self.generation += 1
+        self.invalidations += 1
+        if keys is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(keys)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {"size": len(self.backend),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0}
+
+
+bus = BUSES[CATALOG_CACHE_BUS]()
+products = ReadThroughCache("products", bus)
+product_tags = ReadThroughCache("product_tags", bus)
+
+# table -> (cache, snapshot schema)
+CACHES = {
+    models.Product.__tablename__: (products, schemas.ProductOut),
+    models.ProductTag.__tablename__: (product_tags, schemas.ProductTagOut),
+}
+
+
+def snapshot(table: str, obj):
+    """Detached, immutable copy of ``obj`` that is safe to share across requests."""
+    return None if obj is None else CACHES[table][1].model_validate(obj)
+
+
+def mark_changed(session: Session, table: str, ids=None):
+    """Invalidate ``ids`` of ``table`` (all of it if None) once ``session`` commits."""
+    changed = session.info.setdefault("catalog_cache_changed", {})
+    if ids is None:
+        changed[table] = None
+    elif changed.get(table, ()) is not None:
+        changed.setdefault(table, set()).update(ids)
+
+
+# Invalidation runs after commit, for every write path in crud.py and
+# async_crud.py: flushed objects by id, set-based statements (bulk inserts,
+# upserts) by dropping the table's whole cache.
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = obj.__table__.name
+        if table in CACHES:
+            mark_changed(session, table, [obj.id])
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed(orm_execute_state):
+    state = orm_execute_state
+    if not (state.is_insert or state.is_update or state.is_delete) or state.bind_mapper is None:
+        return
+    table = state.bind_mapper.local_table.name
+    if table in CACHES:
+        mark_changed(state.session, table)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    for table, ids in session.info.pop("catalog_cache_changed", {}).items():
+        CACHES[table][0].invalidate(ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("catalog_cache_changed", None)
@@ -1,12 +1,82 @@
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 import models
 import schemas
+import pagination
+import loading
+import analytics
+import bulk
+import etags
+import catalog_cache
+import search
+import revocations
+import refresh_tokens
+from collections import Counter
 from datetime import datetime
+import principals
 
 
-def get_product_tags(db: Session):
-    res = db.query(models.ProductTag).all()
-    return res
+UNIQUE_VIOLATION = "23505"
+
+# status an invoice must have to move to the key status
+INVOICE_PREVIOUS_STATUS = {"shipped": "approved", "delivered": "shipped"}
+
+
+class AlreadyExistsError(Exception):
+    def __init__(self, constraint: str = None):
+        super().__init__(constraint)
+        self.constraint = constraint
+
+
+def as_already_exists(e: IntegrityError):
+    """Return an AlreadyExistsError if ``e`` is a unique violation, else None."""
+    orig = e.orig
+    code = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+    if code != UNIQUE_VIOLATION:
+        return None
+    # psycopg2 reports the constraint on orig.diag; asyncpg on the error
+    # SQLAlchemy's adapter re-raised from
+    diag = getattr(orig, "diag", None)
+    return AlreadyExistsError(getattr(diag, "constraint_name", None)
+                              or getattr(orig.__cause__, "constraint_name", None))
+
+
+def commit_unique(db: Session):
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        exists = as_already_exists(e)
+        if exists:
+            raise exists from e
+        raise
+
+
+def end_batch(db: Session, commit: bool):
+    """Commit or roll back what a /batch request left in the session."""
+    db.info.pop("defer_commit", None)
+    if commit:
+        db.commit()
+    else:
+        db.rollback()
+
+
+def get_invoice_summary(db: Session, company_id: int = None, product_id: int = None):
+    return db.execute(analytics.summary_query(company_id, product_id)).all()
+
+
+def get_table_versions(db: Session):
+    return dict(db.execute(select(models.TableVersion.name, models.TableVersion.version)).all())
+
+
+def get_product_tags(db: Session, page: schemas.PageParams = None,
+                     filters: schemas.ProductTagFilter = None):
+    if page is None:
+        return db.query(models.ProductTag).all()
+    stmt = pagination.page_query(models.ProductTag, page, filters)
+    return db.execute(stmt).scalars().all()
 
 
 def get_product_tag(db: Session, tag_id: int):
@@ -15,9 +85,12 @@ def get_product_tag(db: Session, tag_id: int):
     return res
 
 
-def get_companies(db: Session):
-    res = db.query(models.Company).all()
-    return res
+def get_companies(db: Session, page: schemas.PageParams = None,
+                  filters: schemas.CompanyFilter = None):
+    if page is None:
+        return db.query(models.Company).all()
+    stmt = pagination.page_query(models.Company, page, filters)
+    return db.execute(stmt).scalars().all()
 
 
 def get_company(db: Session, company_id: int):
@@ -26,57 +99,94 @@ def get_company(db: Session, company_id: int):
     return res
 
 
-def get_users(db: Session):
-    res = db.query(models.User).all()
-    return res
+def get_users(db: Session, page: schemas.PageParams = None,
+              filters: schemas.UserFilter = None, expand: tuple = None):
+    options = loading.load_options(models.User, expand)
+    if page is None:
+        return db.query(models.User).options(*options).all()
+    stmt = pagination.page_query(models.User, page, filters).options(*options)
+    return db.execute(stmt).scalars().all()
 
 
-def get_user(db: Session, user_id: int):
-    res = db.query(models.User).filter(models.User.id == user_id).first()
+def get_user(db: Session, user_id: int, expand: tuple = None):
+    res = db.query(models.User).options(*loading.load_options(models.User, expand)).filter(
+        models.User.id == user_id).first()
     return res
 
 
-def get_products(db: Session):
-    res = db.query(models.Product).all()
+def get_user_by_username(db: Session, username: str):
+    res = db.query(models.User).filter(
+        models.User.user_name == username).first()
     return res
 
 
+def get_products(db: Session, page: schemas.PageParams = None,
+                 filters: schemas.ProductFilter = None):
+    if page is None:
+        return db.query(models.Product).all()
+    stmt = pagination.page_query(models.Product, page, filters)
+    return db.execute(stmt).scalars().all()
+
+
+def search_products(db: Session, q: str, match: str, page: schemas.PageParams,
+                    filters: schemas.ProductFilter = None):
+    stmt = pagination.page_query(models.Product, page, filters).where(
+        models.Product.product_name.ilike(search.like_pattern(q, match), escape="\\"))
+    return db.execute(stmt).scalars().all()
+
+
+def get_product_index_rows(db: Session):
+    return db.execute(select(models.Product.id, models.Product.product_name,
+                             models.Product.product_tag_id, models.Product.company_id)).all()
+
+
 def get_product(db: Session, product_id: int):
     res = db.query(models.Product).filter(
         models.Product.id == product_id).first()
     return res
 
 
-def get_invoices(db: Session):
-    res = db.query(models.Invoice).all()
-    return res
+def get_invoices(db: Session, page: schemas.PageParams = None,
+                 filters: schemas.InvoiceFilter = None, expand: tuple = None):
+    options = loading.load_options(models.Invoice, expand)
+    if page is None:
+        return db.query(models.Invoice).options(*options).all()
+    stmt = pagination.page_query(models.Invoice, page, filters).options(*options)
+    return db.execute(stmt).scalars().all()
 
 
-def get_invoice(db: Session, invoice_id: int):
-    res = db.query(models.Invoice).filter(
+def get_invoice(db: Session, invoice_id: int, expand: tuple = None):
+    res = db.query(models.Invoice).options(*loading.load_options(models.Invoice, expand)).filter(
         models.Invoice.id == invoice_id).first()
     return res
 
 
-def get_bookmarks(db: Session):
-    res = db.query(models.UserBookmark).all()
-    return res
+def get_bookmarks(db: Session, page: schemas.PageParams = None,
+                  filters: schemas.UserBookmarkFilter = None, expand: tuple = None):
+    options = loading.load_options(models.UserBookmark, expand)
+    if page is None:
+        return db.query(models.UserBookmark).options(*options).all()
+    stmt = pagination.page_query(models.UserBookmark, page, filters).options(*options)
+    return db.execute(stmt).scalars().all()
 
 
-def get_bookmark(db: Session, user_id: int):
-    res = db.query(models.UserBookmark).filter(
+def get_bookmark(db: Session, user_id: int, expand: tuple = None):
+    res = db.query(models.UserBookmark).options(*loading.load_options(models.UserBookmark, expand)).filter(
         models.UserBookmark.user_id == user_id).all()
     return res
 
 
-def get_bank_accounts(db: Session):
-    res = db.query(models.BankAccount).all()
-    return res
+def get_bank_accounts(db: Session, page: schemas.PageParams = None,
+                      filters: schemas.BankAccountFilter = None):
+    if page is None:
+        return db.query(models.BankAccount).all()
+    stmt = pagination.page_query(models.BankAccount, page, filters)
+    return db.execute(stmt).scalars().all()
 
 
 def get_bank_account(db: Session, user_id: int):
     res = db.query(models.BankAccount).filter(
-        models.UserBookmark.user_id == user_id).first()
+        models.BankAccount.user_id == user_id).first()
     return res
 
 
@@ -90,7 +200,7 @@ def create_user(db: Session, user: schemas.UserCreate):
     user_db_model.user_password = user.password
     user_db_model.date_created = datetime.now()
     db.add(user_db_model)
-    db.commit()
+    commit_unique(db)
     db.refresh(user_db_model)
     return user_db_model
 
@@ -99,6 +209,10 @@ def update_user(db: Session, user: schemas.UserUpdate):
     db_user = db.query(models.User).filter(models.User.id == user.id).first()
     if not db_user:
         return None
+    principals.invalidate_on_commit(db, db_user.user_name, user.username)
+    # the password may have changed: tokens issued so far stop working
+    revocations.revoke(db, db_user.id)
+    db_user.last_login_token = None
     db_user.user_name = user.username
     db_user.user_password = user.password
     db_user.user_address = user.user_address
@@ -106,17 +220,97 @@ def update_user(db: Session, user: schemas.UserUpdate):
     db_user.user_phone = user.user_phone
     db_user.user_identity_code = user.user_identity_code
     db_user.date_updated = datetime.now()
-    db.commit()
+    commit_unique(db)
     db.refresh(db_user)
     return db_user
 
 
+def update_user_password(db: Session, user_id: int, hashed_password: str):
+    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not db_user:
+        return None
+    principals.invalidate_on_commit(db, db_user.user_name)
+    db_user.user_password = hashed_password
+    db_user.date_updated = datetime.now()
+    db.commit()
+    return db_user
+
+
+def start_refresh_family(db: Session, user_id: int, stored: str):
+    """Store a login's first refresh token, replacing the previous login's."""
+    db.execute(update(models.User).where(models.User.id == user_id)
+               .values(last_login_token=stored, last_login=datetime.now()))
+    db.commit()
+
+
+def rotate_refresh_token(db: Session, user_id: int, family: str, old: str, new: str):
+    """Replace the stored refresh token ``old`` with ``new`` and return the
+    username, or None if ``old`` is not the current token.
+
+    A token of the current family that is not the current token was already
+    rotated, so it has leaked: the family and the user's access tokens are
+    revoked.
+    """
+    user = models.User
+    username = db.execute(update(user).where(user.id == user_id, user.last_login_token == old)
+                          .values(last_login_token=new, last_login=datetime.now())
+                          .returning(user.user_name)).scalar()
+    if username is None:
+        stored = db.execute(select(user.last_login_token).where(user.id == user_id)
+                            .with_for_update()).scalar()
+        if refresh_tokens.same_family(stored, family):
+            db.execute(update(user).where(user.id == user_id).values(last_login_token=None))
+            revocations.revoke(db, user_id)
+    db.commit()
+    return username
+
+
+def end_session(db: Session, user_id: int, jti: str = None, expires_at: float = None):
+    """Logout: revoke the access token and the refresh token family."""
+    db.execute(update(models.User).where(models.User.id == user_id).values(last_login_token=None))
+    revocations.revoke(db, user_id, jti=jti, expires_at=expires_at)
+    db.commit()
+
+
+def get_token_revocations(db: Session, since: float = None, now: float = None):
+    table = models.TokenRevocation
+    stmt = select(table.user_id, table.jti, table.revoked_at, table.expires_at)
+    if since is not None:
+        stmt = stmt.where(table.revoked_at > since)
+    if now is not None:
+        stmt = stmt.where(table.expires_at > now)
+    return db.execute(stmt).all()
+
+
+def purge_token_revocations(db: Session, now: float):
+    db.execute(delete(models.TokenRevocation).where(models.TokenRevocation.expires_at <= now))
+    db.commit()
+
+
 def create_product_tag(db: Session, product_tag: schemas.ProductTag):
     db_product_tag = models.ProductTag()
     db_product_tag.tag_name = product_tag.tag_name
     db_product_tag.create_date = datetime.now()
 
     db.add(db_product_tag)
+    commit_unique(db)
+    db.refresh(db_product_tag)
+    return db_product_tag
+
+
+def product_tag_upsert(product_tag: schemas.ProductTag):
+    now = datetime.now()
+    stmt = insert(models.ProductTag).values(
+        tag_name=product_tag.tag_name, create_date=now, update_date=now)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.ProductTag.tag_name],
+        set_={"update_date": stmt.excluded.update_date},
+    ).returning(models.ProductTag)
+
+
+def upsert_product_tag(db: Session, product_tag: schemas.ProductTag):
+    db_product_tag = db.scalars(product_tag_upsert(product_tag),
+                                execution_options={"populate_existing": True}).one()
     db.commit()
     db.refresh(db_product_tag)
     return db_product_tag
@@ -125,10 +319,12 @@ def create_product_tag(db: Session, product_tag: schemas.ProductTag):
 def update_product_tag(db: Session, product_tag: schemas.ProductTagUpdate):
     db_product_tag = db.query(models.ProductTag).filter(
         models.ProductTag.id == product_tag.id).first()
+    if not db_product_tag:
+        return None
     db_product_tag.tag_name = product_tag.tag_name
     db_product_tag.update_date = datetime.now()
 
-    db.commit()
+    commit_unique(db)
     db.refresh(db_product_tag)
     return db_product_tag
 
@@ -138,6 +334,7 @@ def create_product(db: Session, product: schemas.ProductBase):
     db_product.product_name = product.product_name
     db_product.product_price = product.product_price
     db_product.product_tag_id = product.product_tag_id
+    db_product.company_id = product.company_id
     db_product.create_date = datetime.now()
     db_product.update_date = datetime.now()
     db.add(db_product)
@@ -146,12 +343,31 @@ def create_product(db: Session, product: schemas.ProductBase):
     return db_product
 
 
+def bulk_create_products(db: Session, products: list, chunk_size: int = bulk.BULK_CHUNK_SIZE):
+    now = datetime.now()
+    rows = [(index, {"product_name": product.product_name,
+                     "product_price": product.product_price,
+                     "product_tag_id": product.product_tag_id,
+                     "company_id": product.company_id,
+                     "create_date": now,
+                     "update_date": now})
+            for index, product in products]
+    # the COPY path bypasses the ORM events
+    etags.bump(db, models.Product.__tablename__)
+    catalog_cache.mark_changed(db, models.Product.__tablename__)
+    search.mark_reload(db)
+    return bulk.bulk_insert(db, models.Product, rows, chunk_size)
+
+
 def update_product(db: Session, product: schemas.ProductUpdate):
     db_product = db.query(models.Product).filter(
         models.Product.id == product.id).first()
+    if not db_product:
+        return None
     db_product.product_name = product.product_name
     db_product.product_price = product.product_price
     db_product.product_tag_id = product.product_tag_id
+    db_product.company_id = product.company_id
     db_product.update_date = datetime.now()
     db.commit()
     db.refresh(db_product)
@@ -167,6 +383,30 @@ def create_company(db: Session, company: schemas.CompanyBase):
     db_company.create_date = datetime.now()
     db_company.update_date = datetime.now()
     db.add(db_company)
+    commit_unique(db)
+    db.refresh(db_company)
+    return db_company
+
+
+def company_upsert(company: schemas.CompanyBase):
+    now = datetime.now()
+    stmt = insert(models.Company).values(
+        company_name=company.company_name,
+        company_address=company.company_address,
+        company_phone=company.company_phone,
+        user_id=company.user_id,
+        create_date=now,
+        update_date=now)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Company.company_name],
+        set_={name: stmt.excluded[name] for name in
+              ("company_address", "company_phone", "user_id", "update_date")},
+    ).returning(models.Company)
+
+
+def upsert_company(db: Session, company: schemas.CompanyBase):
+    db_company = db.scalars(company_upsert(company),
+                            execution_options={"populate_existing": True}).one()
     db.commit()
     db.refresh(db_company)
     return db_company
@@ -175,12 +415,14 @@ def create_company(db: Session, company: schemas.CompanyBase):
 def update_company(db: Session, company: schemas.CompanyUpdate):
     db_company = db.query(models.Company).filter(
         models.Company.id == company.id).first()
+    if not db_company:
+        return None
     db_company.company_name = company.company_name
     db_company.company_address = company.company_address
     db_company.company_phone = company.company_phone
     db_company.user_id = company.user_id
     db_company.update_date = datetime.now()
-    db.commit()
+    commit_unique(db)
     db.refresh(db_company)
     return db_company
 
@@ -192,7 +434,7 @@ def create_bookmark(db: Session, user_bookmark: schemas.UserBookMark):
     db_user_bookmark.user_id = user_bookmark.user_id
     db_user_bookmark.is_favorite = user_bookmark.is_favorite
     db.add(db_user_bookmark)
-    db.commit()
+    commit_unique(db)
     db.refresh(db_user_bookmark)
     return db_user_bookmark
 
@@ -217,7 +459,27 @@ def create_bank_account(db: Session, bank_account: schemas.BankAccountBase):
     db_bank_account.bank_city = bank_account.bank_city
     db_bank_account.bank_card_no = bank_account.bank_card_no
     db_bank_account.user_id = bank_account.user_id
+    db_bank_account.create_date = datetime.now()
     db.add(db_bank_account)
+    commit_unique(db)
+    db.refresh(db_bank_account)
+    return db_bank_account
+
+
+def bank_account_upsert(bank_account: schemas.BankAccountBase):
+    now = datetime.now()
+    values = bank_account.model_dump()
+    stmt = insert(models.BankAccount).values(**values, create_date=now, update_date=now)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.BankAccount.bank_account_no],
+        set_={name: stmt.excluded[name] for name in values
+              if name != "bank_account_no"} | {"update_date": stmt.excluded.update_date},
+    ).returning(models.BankAccount)
+
+
+def upsert_bank_account(db: Session, bank_account: schemas.BankAccountBase):
+    db_bank_account = db.scalars(bank_account_upsert(bank_account),
+                                 execution_options={"populate_existing": True}).one()
     db.commit()
     db.refresh(db_bank_account)
     return db_bank_account
@@ -226,6 +488,8 @@ def create_bank_account(db: Session, bank_account: schemas.BankAccountBase):
 def update_bank_account(db: Session, bank_account: schemas.BankAccountUpdate):
     db_bank_account = db.query(models.BankAccount).filter(
         models.BankAccount.id == bank_account.id).first()
+    if not db_bank_account:
+        return None
     db_bank_account.bank_name = bank_account.bank_name
     db_bank_account.bank_address = bank_account.bank_address
     db_bank_account.bank_account_no = bank_account.bank_account_no
@@ -234,7 +498,7 @@ def update_bank_account(db: Session, bank_account: schemas.BankAccountUpdate):
     db_bank_account.bank_city = bank_account.bank_city
     db_bank_account.bank_card_no = bank_account.bank_card_no
     db_bank_account.user_id = bank_account.user_id
-    db.commit()
+    commit_unique(db)
     db.refresh(db_bank_account)
     return db_bank_account
 
@@ -254,14 +518,88 @@ def create_invoice(db: Session, invoice = schemas.Invoice):
     db_invoice.product_id = invoice.product_id
     db_invoice.company_id = invoice.company_id
     db_invoice.status = invoice.status
+    db_invoice.create_date = datetime.now()
     db.add(db_invoice)
     db.commit()
     db.refresh(db_invoice)
     return db_invoice
 
 
+def bulk_create_invoices(db: Session, invoices: list, chunk_size: int = bulk.BULK_CHUNK_SIZE):
+    now = datetime.now()
+    rows = [(index, {"product_id": invoice.product_id,
+                     "user_id": invoice.user_id,
+                     "company_id": invoice.company_id,
+                     "status": invoice.status,
+                     "create_date": now})
+            for index, invoice in invoices]
+
+    # set-based inserts skip the flush that maintains the summary
+    def summarize(created):
+        values = dict(rows)
+        analytics.apply_deltas(db, Counter(
+            analytics.summary_key(v["company_id"], v["product_id"], v["status"], v["create_date"], None)
+            for v in (values[c["index"]] for c in created)))
+
+    return bulk.bulk_insert(db, models.Invoice, rows, chunk_size, before_commit=summarize)
+
+
+def _transition_chunk(db: Session, ids: list, target: str, now: datetime):
+    invoices = models.Invoice.__table__
+    # the old deliver_date comes back through the locked self-join, since
+    # RETURNING only sees the new row
+    old = select(invoices.c.id, invoices.c.deliver_date.label("old_deliver_date")).where(
+        invoices.c.id.in_(ids), invoices.c.status == INVOICE_PREVIOUS_STATUS[target]
+    ).with_for_update().subquery()
+    values = {"status": target}
+    if target == "delivered":
+        values["deliver_date"] = now
+    new = (invoices.c.id, invoices.c.company_id, invoices.c.product_id,
+           invoices.c.create_date, invoices.c.deliver_date)
+    if db.get_bind().dialect.name != "postgresql":
+        # SQLite's RETURNING cannot see the FROM list; read the old dates first
+        old_dates = dict(db.execute(select(old)).all())
+        stmt = update(invoices).where(invoices.c.id.in_(old_dates)).values(values).returning(*new)
+        return [(*row, old_dates[row[0]]) for row in db.execute(stmt)]
+    stmt = update(invoices).where(invoices.c.id == old.c.id).values(values).returning(
+        *new, old.c.old_deliver_date)
+    return db.execute(stmt).all()
+
+
+def transition_invoices(db: Session, ids: list, target: str, chunk_size: int = bulk.BULK_CHUNK_SIZE):
+    """Move every invoice in ``ids`` one step forward to ``target`` and commit.
+
+    Each chunk is a single UPDATE ... RETURNING that only matches invoices in
+    the previous status. Returns ``(updated, skipped)``.
+    """
+    ids = list(dict.fromkeys(ids))
+    previous = INVOICE_PREVIOUS_STATUS[target]
+    now = datetime.now()
+    updated, skipped, deltas = [], [], Counter()
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        rows = _transition_chunk(db, chunk, target, now)
+        for id_, company_id, product_id, create_date, deliver_date, old_deliver_date in rows:
+            updated.append(id_)
+            deltas[analytics.summary_key(company_id, product_id, previous, create_date, old_deliver_date)] -= 1
+            deltas[analytics.summary_key(company_id, product_id, target, create_date, deliver_date)] += 1
+        missed = set(chunk).difference(row[0] for row in rows)
+        if missed:
+            current = dict(db.execute(select(models.Invoice.id, models.Invoice.status).where(
+                models.Invoice.id.in_(missed))).all())
+            skipped.extend({"id": id_, "detail": f"Invoice is {current[id_]}, not {previous}"
+                            if id_ in current else "Invoice not found"}
+                           for id_ in chunk if id_ in missed)
+    # set-based updates skip the flush that maintains the summary
+    analytics.apply_deltas(db, deltas)
+    db.commit()
+    return updated, skipped
+
+
 def update_invoice(db: Session, invoice = schemas.InvoiceUpdate):
     db_invoice = db.query(models.Invoice).filter(models.Invoice.id==invoice.id).first()
+    if not db_invoice:
+        return None
     db_invoice.user_id = invoice.user_id
     db_invoice.product_id = invoice.product_id
     db_invoice.company_id = invoice.company_id
@@ -274,6 +612,10 @@ def update_invoice(db: Session, invoice = schemas.InvoiceUpdate):
 
 def delete_user(db:Session, user_id:int):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not db_user:
+        return None
+    principals.invalidate_on_commit(db, db_user.user_name)
+    revocations.revoke(db, db_user.id)
     db.delete(db_user)
     db.commit()
     return db_user
@@ -282,6 +624,8 @@ def delete_user(db:Session, user_id:int):
 
 def delete_product(db:Session, product_id:int):
     db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    if not db_product:
+        return None
     db.delete(db_product)
     db.commit()
     return db_product
@@ -289,6 +633,8 @@ def delete_product(db:Session, product_id:int):
 
 def delete_company(db:Session, company_id:int):
     db_company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    if not db_company:
+        return None
     db.delete(db_company)
     db.commit()
     return db_company
@@ -296,6 +642,8 @@ def delete_company(db:Session, company_id:int):
 
 def delete_product_tag(db:Session, tag_id:int):
     db_tag = db.query(models.ProductTag).filter(models.ProductTag.id == tag_id).first()
+    if not db_tag:
+        return None
     db.delete(db_tag)
     db.commit()
     return db_tag
@@ -304,11 +652,21 @@ def delete_product_tag(db:Session, tag_id:int):
 
 def delete_bookmark(db:Session, bookmark_id:int):
     db_bookmark = db.query(models.UserBookmark).filter(models.UserBookmark.id == bookmark_id).first()
+    if not db_bookmark:
+        return None
     db.delete(db_bookmark)
     db.commit()
     return db_bookmark
 
 
+def delete_bookmarks(db: Session, user_id: int):
+    db_bookmarks = db.query(models.UserBookmark).filter(models.UserBookmark.user_id == user_id).all()
+    for db_bookmark in db_bookmarks:
+        db.delete(db_bookmark)
+    db.commit()
+    return db_bookmarks
+
+
 
 def delete_bank_account(db:Session, bank_account_id:int):
     db_bank_account = db.query(models.BankAccount).filter(models.BankAccount.id == bank_account_id).first()
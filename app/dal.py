@@ -0,0 +1,52 @@
+from functools import cache
+from starlette.concurrency import run_in_threadpool
+import async_crud
+import catalog_cache
+import crud
+import etags
+from database import DB_MODE
+
+
+# Awaitable entry point to the data layer for the async handlers in main.py.
+# In async mode this is async_crud; in sync mode each crud function runs in
+# the threadpool so a query never blocks the event loop.
+@cache
+def __getattr__(name):
+    if DB_MODE == "async":
+        return getattr(async_crud, name)
+    fn = getattr(crud, name)
+
+    async def call(*args, **kwargs):
+        return await run_in_threadpool(fn, *args, **kwargs)
+
+    return call
+
+
+async def _cached(table: str, getter: str, key: int, **kwargs):
+    read_through = catalog_cache.CACHES[table][0]
+    # the version conditional_get built this response's ETag from
+    version = etags.table_versions.get(table)
+    found, value, generation = read_through.lookup(key, version)
+    if not found:
+        # fill from the primary: a lagging replica could put back the row an
+        # invalidation just dropped, for a whole TTL
+        info = kwargs["db"].info
+        replica = info.pop("replica", None)
+        try:
+            value = catalog_cache.snapshot(table, await __getattr__(getter)(**kwargs))
+        finally:
+            if replica is not None:
+                info["replica"] = replica
+        # inside a /batch transaction the row may be rolled back yet
+        if not info.get("defer_commit"):
+            read_through.store(key, value, generation, version)
+    return value
+
+
+# Read-through: these return detached schemas.*Out snapshots, not ORM objects
+async def get_product(db, product_id: int):
+    return await _cached("products", "get_product", product_id, db=db, product_id=product_id)
+
+
+async def get_product_tag(db, tag_id: int):
+    return await _cached("product_tags", "get_product_tag", tag_id, db=db, tag_id=tag_id)
@@ -1,21 +1,80 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Delete, Insert, Update, create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import os
+import db_pool
 
 POSTGRES_USER = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_DB = os.getenv("POSTGRES_DB")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT")
+# Streaming replicas as "host[:port]" separated by commas; same user and
+# database as the primary
+POSTGRES_REPLICA_HOSTS = [h.strip() for h in os.getenv("POSTGRES_REPLICA_HOSTS", "").split(",") if h.strip()]
 
+# "sync" runs crud.py in a threadpool, "async" runs async_crud.py on asyncpg
+DB_MODE = os.getenv("DB_MODE", "sync")
 
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
+
+class RoutingSession(Session):
+    """Session that reads from ``info["replica"]`` when the request picked one.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    While ``info["defer_commit"]`` is set, commit() only flushes, so several
+    crud calls share one transaction (see /batch).
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is None or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            return super().get_bind(mapper, clause=clause, **kw)
+        return replica
+
+    def commit(self):
+        if self.info.get("defer_commit"):
+            self.flush()
+            return
+        super().commit()
+
+
+def replica_url(host: str, driver: str = "postgresql") -> str:
+    host, _, port = host.partition(":")
+    return f"{driver}://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{host}:{port or POSTGRES_PORT}/{POSTGRES_DB}"
+
+
+# in async mode the sync engines only serve background work (db_pool.py)
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={}
+    SQLALCHEMY_DATABASE_URL, **db_pool.engine_options(fixed=DB_MODE == "async")
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+pool_stats = db_pool.instrument(engine)
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+replica_engines = [create_engine(replica_url(host), **db_pool.engine_options(fixed=DB_MODE == "async"))
+                   for host in POSTGRES_REPLICA_HOSTS]
+replica_pool_stats = [db_pool.instrument(e) for e in replica_engines]
+
+async_engine = None
+async_pool_stats = None
+AsyncSessionLocal = None
+async_replica_engines = []
+async_replica_pool_stats = []
+if DB_MODE == "async":
+    async_engine = create_async_engine(
+        SQLALCHEMY_ASYNC_DATABASE_URL, **db_pool.engine_options(is_async=True))
+    async_pool_stats = db_pool.instrument(async_engine.sync_engine)
+    # expire_on_commit=False: attribute access after commit must not do IO
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, sync_session_class=RoutingSession,
+        autocommit=False, autoflush=False, expire_on_commit=False)
+    async_replica_engines = [
+        create_async_engine(replica_url(host, "postgresql+asyncpg"), **db_pool.engine_options(is_async=True))
+        for host in POSTGRES_REPLICA_HOSTS]
+    async_replica_pool_stats = [db_pool.instrument(e.sync_engine) for e in async_replica_engines]
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+# Sizing inputs: the server's connection budget is shared by every worker
+# of every replica, so each worker's pool gets an equal slice of it.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "10"))
+APP_REPLICAS = int(os.getenv("APP_REPLICAS", "1"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# read here too: database.py and catalog_cache.py import this module
+_DB_MODE = os.getenv("DB_MODE", "sync")
+_CATALOG_CACHE_BUS = os.getenv("CATALOG_CACHE_BUS", "local")
+
+# With DB_MODE=async requests use the async engines and the sync ones only
+# serve exports, background reloads and health checks, so they get this
+# fixed pool (no overflow) instead of a share of the budget.
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", "2"))
+
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+
+def fixed_connections(mode: str = _DB_MODE, bus: str = _CATALOG_CACHE_BUS,
+                      sync_pool_size: int = DB_SYNC_POOL_SIZE) -> int:
+    """Connections a worker holds on the primary besides its request pool:
+    the sync engine's fixed pool in async mode and the cache bus' LISTEN."""
+    return (sync_pool_size if mode == "async" else 0) + (1 if bus == "postgres" else 0)
+
+
+FIXED_CONNECTIONS = fixed_connections()
+
+
+def connections_per_worker(max_connections: int = DB_MAX_CONNECTIONS,
+                           reserved: int = DB_RESERVED_CONNECTIONS,
+                           replicas: int = APP_REPLICAS,
+                           workers: int = WEB_CONCURRENCY,
+                           fixed: int = FIXED_CONNECTIONS) -> int:
+    """The request pool's budget: the worker's slice of the server less
+    ``fixed``. A read replica holds the same pools minus the LISTEN, so the
+    primary is the one that runs out."""
+    return max(1, (max_connections - reserved) // max(1, replicas * workers) - fixed)
+
+
+def pool_size_for(budget: int):
+    """Split a worker's connection budget into ``(pool_size, max_overflow)``.
+
+    Three quarters stay open; the rest is burst capacity that is closed again
+    once returned.
+    """
+    pool_size = max(1, budget * 3 // 4)
+    return pool_size, max(0, budget - pool_size)
+
+
+def max_replicas(pool_size: int, max_overflow: int,
+                 max_connections: int = DB_MAX_CONNECTIONS,
+                 reserved: int = DB_RESERVED_CONNECTIONS,
+                 workers: int = WEB_CONCURRENCY,
+                 fixed: int = FIXED_CONNECTIONS) -> int:
+    """How many replicas fit the server if every pool bursts to its limit."""
+    return max(0, (max_connections - reserved) // max(1, workers * (pool_size + max_overflow + fixed)))
+
+
+_default_size, _default_overflow = pool_size_for(connections_per_worker())
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(_default_size)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(_default_overflow)))
+
+
+class PoolStats:
+    def __init__(self):
+        self.pool = None
+        self.checkouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_wait_max = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, waited: float):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_seconds += waited
+            if waited > self.checkout_wait_max:
+                self.checkout_wait_max = waited
+
+    def snapshot(self) -> dict:
+        pool = self.pool
+        return {"size": pool.size() if pool else 0,
+                "in_use": pool.checkedout() if pool else 0,
+                "idle": pool.checkedin() if pool else 0,
+                "overflow": max(0, pool.overflow()) if pool else 0,
+                "checkouts": self.checkouts,
+                "checkout_wait_seconds": round(self.checkout_wait_seconds, 6),
+                "checkout_wait_max_seconds": round(self.checkout_wait_max, 6),
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations}
+
+
+def _instrumented(base):
+    class InstrumentedPool(base):
+        stats: PoolStats = None
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except exc.TimeoutError:
+                self.stats.timeouts += 1
+                raise
+            self.stats.record_checkout(time.perf_counter() - started)
+            return conn
+
+    InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+    return InstrumentedPool
+
+
+InstrumentedQueuePool = _instrumented(QueuePool)
+InstrumentedAsyncQueuePool = _instrumented(AsyncAdaptedQueuePool)
+
+
+def engine_options(is_async: bool = False, fixed: bool = False) -> dict:
+    """Keyword arguments for create_engine/create_async_engine.
+
+    ``fixed`` gives the engine the DB_SYNC_POOL_SIZE pool instead of the
+    request pool's size and overflow.
+    """
+    stats = PoolStats()
+    base = InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        else:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return {"poolclass": type(base.__name__, (base,), {"stats": stats}),
+            "pool_size": DB_SYNC_POOL_SIZE if fixed else DB_POOL_SIZE,
+            "max_overflow": 0 if fixed else DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+            "connect_args": connect_args}
+
+
+def instrument(engine) -> PoolStats:
+    """Hook pool events of ``engine`` (a sync Engine) into its PoolStats."""
+    stats = engine.pool.stats
+    stats.pool = engine.pool
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        stats.invalidations += 1
+
+    # dispose() swaps in a fresh pool of the same class
+    @event.listens_for(engine, "engine_disposed")
+    def on_disposed(engine_):
+        stats.pool = engine_.pool
+
+    return stats
+
+
+def pool_report(*stats: PoolStats) -> dict:
+    return {"pools": [s.snapshot() for s in stats],
+            "config": {"pool_size": DB_POOL_SIZE,
+                       "max_overflow": DB_MAX_OVERFLOW,
+                       "sync_pool_size": DB_SYNC_POOL_SIZE if _DB_MODE == "async" else None,
+                       "pool_timeout": DB_POOL_TIMEOUT,
+                       "pool_recycle": DB_POOL_RECYCLE,
+                       "pool_pre_ping": DB_POOL_PRE_PING,
+                       "statement_timeout_ms": DB_STATEMENT_TIMEOUT_MS,
+                       "workers": WEB_CONCURRENCY},
+            "sizing": {"db_max_connections": DB_MAX_CONNECTIONS,
+                       "reserved_connections": DB_RESERVED_CONNECTIONS,
+                       "replicas": APP_REPLICAS,
+                       "listen_connections": 1 if _CATALOG_CACHE_BUS == "postgres" else 0,
+                       # on the primary, at full burst
+                       "connections_per_worker": DB_POOL_SIZE + DB_MAX_OVERFLOW + FIXED_CONNECTIONS,
+                       "max_replicas": max_replicas(DB_POOL_SIZE, DB_MAX_OVERFLOW)}}
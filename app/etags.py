@@ -0,0 +1,105 @@
+import os
+import time
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models
+
+
+# Catalog tables whose GET endpoints answer conditional requests
+VERSIONED_TABLES = ("products", "product_tags", "companies")
+
+# How old a worker's copy of the version counters may get before it is
+# re-read; a client can see a stale 304 for at most this long after another
+# worker's write.
+ETAG_VERSION_POLL = float(os.getenv("ETAG_VERSION_POLL", "1"))
+
+CACHE_CONTROL = {
+    "products": os.getenv("CACHE_CONTROL_PRODUCTS", "private, no-cache"),
+    "product_tags": os.getenv("CACHE_CONTROL_PRODUCT_TAGS", "private, no-cache"),
+    "companies": os.getenv("CACHE_CONTROL_COMPANIES", "private, no-cache"),
+}
+
+_versions = models.TableVersion.__table__
+
+
+class TableVersions:
+    """This worker's snapshot of the table_versions rows."""
+
+    def __init__(self, poll: float = ETAG_VERSION_POLL):
+        self.poll = poll
+        self.versions = {}
+        self.fetched = float("-inf")
+
+    def stale(self) -> bool:
+        return time.monotonic() - self.fetched >= self.poll
+
+    def update(self, versions: dict):
+        self.versions = versions
+        self.fetched = time.monotonic()
+
+    def expire(self):
+        self.fetched = float("-inf")
+
+    def get(self, table: str) -> int:
+        return self.versions.get(table, 0)
+
+
+table_versions = TableVersions()
+
+
+def make_etag(table: str, version: int) -> str:
+    return f'"{table}-{version}"'
+
+
+def if_none_match(header: str, etag: str) -> bool:
+    """Weak comparison, as RFC 9110 requires for If-None-Match."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def bump(session: Session, table: str):
+    """Increment ``table``'s version inside the session's transaction, once."""
+    bumped = session.info.setdefault("bumped_tables", set())
+    if table in bumped:
+        return
+    bumped.add(table)
+    stmt = insert(_versions).values(name=table, version=1).on_conflict_do_update(
+        index_elements=[_versions.c.name], set_={"version": _versions.c.version + 1})
+    session.connection().execute(stmt)
+
+
+# Every write goes through a flush or an ORM-enabled insert/update/delete
+# (bulk inserts, upserts), so the versions can't be forgotten by a new crud
+# function. AsyncSession drives the same Session class.
+@event.listens_for(Session, "after_flush")
+def _bump_flushed(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = obj.__table__.name
+        if table in VERSIONED_TABLES:
+            bump(session, table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bump_executed(orm_execute_state):
+    state = orm_execute_state
+    if not (state.is_insert or state.is_update or state.is_delete) or state.bind_mapper is None:
+        return
+    table = state.bind_mapper.local_table.name
+    if table in VERSIONED_TABLES:
+        bump(state.session, table)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("bumped_tables", None):
+        # see our own writes right away instead of after the next poll
+        table_versions.expire()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("bumped_tables", None)
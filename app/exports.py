@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+import database
+import models
+import pagination
+
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+INVOICE_EXPORT_COLUMNS = (
+    models.Invoice.id,
+    models.Invoice.product_id,
+    models.Invoice.user_id,
+    models.Invoice.company_id,
+    models.Invoice.status,
+    models.Invoice.create_date,
+    models.Invoice.deliver_date,
+)
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def invoice_export_query(filters=None):
+    # Plain column rows, no ORM hydration; yield_per makes the driver use a
+    # server-side cursor so only one batch is held in memory at a time.
+    stmt = select(*INVOICE_EXPORT_COLUMNS)
+    stmt = pagination.apply_filters(stmt, models.Invoice, filters)
+    return stmt.order_by(models.Invoice.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _ndjson(header, rows) -> str:
+    return "".join(json.dumps(dict(zip(header, map(_value, row))), separators=(",", ":")) + "\n"
+                   for row in rows)
+
+
+def _csv(rows) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerows([_value(v) for v in row] for row in rows)
+    return buf.getvalue()
+
+
+class _Encoder:
+    def __init__(self, fmt: str, gzip: bool):
+        self.fmt = fmt
+        self.header = [c.key for c in INVOICE_EXPORT_COLUMNS]
+        self.compressor = zlib.compressobj(wbits=31) if gzip else None
+
+    def _out(self, text: str) -> bytes:
+        data = text.encode()
+        return self.compressor.compress(data) if self.compressor else data
+
+    def start(self) -> bytes:
+        return self._out(_csv([self.header]) if self.fmt == "csv" else "")
+
+    def batch(self, rows) -> bytes:
+        return self._out(_csv(rows) if self.fmt == "csv" else _ndjson(self.header, rows))
+
+    def finish(self) -> bytes:
+        return self.compressor.flush() if self.compressor else b""
+
+
+# The request's session is closed before the body is streamed, so each
+# generator opens and owns its own session.
+def _iter_sync(stmt, encoder: _Encoder, replica=None):
+    db = database.SessionLocal(info={"replica": replica})
+    try:
+        yield encoder.start()
+        for rows in db.execute(stmt).partitions():
+            yield encoder.batch(rows)
+        yield encoder.finish()
+    finally:
+        db.close()
+
+
+async def _iter_async(stmt, encoder: _Encoder, replica=None):
+    async with database.AsyncSessionLocal(info={"replica": replica}) as db:
+        yield encoder.start()
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            yield encoder.batch(rows)
+        yield encoder.finish()
+
+
+def invoice_export_response(filters=None, fmt: str = "ndjson", gzip: bool = False, replica=None):
+    stmt = invoice_export_query(filters)
+    encoder = _Encoder(fmt, gzip)
+    iterate = _iter_async if database.DB_MODE == "async" else _iter_sync
+    body = iterate(stmt, encoder, replica)
+    headers = {"Content-Disposition": f'attachment; filename="invoices.{fmt}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt], headers=headers)
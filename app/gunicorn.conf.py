@@ -0,0 +1,64 @@
+import os
+import sys
+
+
+# Multi-worker launch: gunicorn -c app/gunicorn.conf.py main:app
+# Every worker must share the JWT keys (JWT_KEYS / JWT_KEYS_FILE /
+# JWT_SECRET_KEY), or tokens minted by one are rejected by the others.
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = f"0.0.0.0:{os.getenv('APP_PORT', '9090')}"
+# Same variable the pool sizing in db_pool.py divides connections by
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn_worker.UvicornWorker"
+# Import the app once in the master so workers fork with it loaded; code
+# changes then need a full restart instead of a HUP
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+# Seconds a worker gets to finish in-flight requests on HUP/TERM
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Recycle workers after this many requests (0 disables); the jitter keeps
+# them from restarting together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    # The uvicorn worker otherwise waits on in-flight requests until the
+    # master kills it at graceful_timeout, skipping the app's shutdown that
+    # closes the database connections; leave that shutdown a few seconds.
+    worker.config.timeout_graceful_shutdown = max(1, graceful_timeout - 5)
+
+
+def post_fork(server, worker):
+    # With preload_app the worker inherits the master's engines and the
+    # cache bus; pooled connections must not be shared between processes and
+    # threads do not survive fork().
+    if "database" not in sys.modules:
+        return
+    import catalog_cache
+    import database
+
+    engines = [database.engine, *database.replica_engines]
+    if database.async_engine is not None:
+        engines += [e.sync_engine for e in (database.async_engine, *database.async_replica_engines)]
+    for engine in engines:
+        engine.dispose(close=False)
+    catalog_cache.bus.after_fork()
+
+
+def on_starting(server):
+    # METRICS_DIR may survive a container restart; drop the old workers' files
+    directory = os.getenv("METRICS_DIR")
+    if directory:
+        import glob
+        for path in glob.glob(os.path.join(directory, "*.prom")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    # a worker that crashed or was killed never removed its own file
+    if os.getenv("METRICS_DIR"):
+        import metrics
+        metrics.remove_worker(metrics.METRICS_DIR, worker.pid)
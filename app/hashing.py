@@ -0,0 +1,129 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from db_pool import WEB_CONCURRENCY
+
+
+def cpu_quota(root: str = "/sys/fs/cgroup") -> float | None:
+    """CPUs the container's cgroup may use, or None when it is not limited."""
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()
+    except OSError:
+        try:
+            # cgroup v1
+            with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+                quota = f.read().strip()
+            with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    return int(quota) / int(period)
+
+
+def default_workers(web_concurrency: int = WEB_CONCURRENCY) -> int:
+    """The container's CPU limit shared by the gunicorn workers, else one.
+
+    Each worker has its own pool, so a CPU count per worker would put
+    ``WEB_CONCURRENCY`` times as many bcrypt processes on the node's cores.
+    """
+    quota = cpu_quota()
+    if quota is None:
+        return 1
+    return max(1, int(quota // web_concurrency))
+
+
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS") or default_workers())
+HASH_QUEUE_DEPTH = int(os.getenv("HASH_QUEUE_DEPTH", "32"))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", "1"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashes below BCRYPT_ROUNDS or using a deprecated scheme report needs_update
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=BCRYPT_ROUNDS,
+                           bcrypt__min_rounds=BCRYPT_ROUNDS)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str):
+    if not pwd_context.verify(password, hashed_password):
+        return False, None
+    if pwd_context.needs_update(hashed_password):
+        return True, pwd_context.hash(password)
+    return True, None
+
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop in a bounded process pool.
+
+    At most ``workers + queue_depth`` calls may be in flight; anything beyond
+    that is rejected with 503 and a Retry-After header instead of queueing.
+    ``workers=0`` uses the loop's default thread pool (handy for tests).
+    """
+
+    def __init__(self, workers: int = HASH_POOL_WORKERS, queue_depth: int = HASH_QUEUE_DEPTH,
+                 retry_after: int = HASH_RETRY_AFTER):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = None
+
+    @property
+    def capacity(self) -> int:
+        return max(self.workers, 1) + self.queue_depth
+
+    def _get_executor(self):
+        if self._executor is None and self.workers > 0:
+            # fork() would copy the worker's engines, threads and event loop
+            # into the pool; the forkserver only imports this module
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password hashing is saturated, try again later",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), partial(fn, *args))
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify(self, password: str, hashed_password: str):
+        """Return ``(verified, new_hash)``; ``new_hash`` is set when the stored
+        hash should be replaced with a stronger one."""
+        return await self._submit(_verify, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight,
+                "capacity": self.capacity,
+                "rejected": self.rejected}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+import database
+import db_pool
+import migrations
+import search
+
+
+# Connections each pool opens before the worker reports ready, so the first
+# requests after a rollout don't pay for connection setup
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", str(db_pool.DB_POOL_SIZE)))
+# /readyz fails when the database does not answer within this many seconds
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "2"))
+READINESS_WARM_RETRY = 2
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """Whether this worker should get traffic.
+
+    Starting up, it opens ``warm`` connections in the pool requests use,
+    reads the schema version and loads the product index, retrying until all
+    three succeed.
+    After that a probe only pings the database.
+    """
+
+    def __init__(self, engine, async_engine=None, index=None, fetch=None, warm: int = DB_POOL_WARM):
+        self.engine = engine
+        self.async_engine = async_engine
+        self.index = index
+        self.fetch = fetch
+        self.warm = warm
+        self.warmed = False
+        self.schema_version = None
+        self._task = None
+
+    def _warm_sync(self):
+        connections = []
+        try:
+            # in async mode requests use the async pool; this one only
+            # serves background work
+            count = 1 if self.async_engine is not None else min(self.warm, self.engine.pool.size())
+            for _ in range(max(1, count)):
+                connections.append(self.engine.connect())
+            self.schema_version = migrations.current_version(connections[0])
+        finally:
+            for conn in connections:
+                conn.close()
+        if self.index is not None:
+            self.index.reload(self.fetch)
+
+    async def _warm_async(self):
+        count = max(1, min(self.warm, self.async_engine.pool.size()))
+        connections = await asyncio.gather(*(self.async_engine.connect().start() for _ in range(count)))
+        for conn in connections:
+            await conn.close()
+
+    async def run(self):
+        while not self.warmed:
+            try:
+                if self.async_engine is not None:
+                    await self._warm_async()
+                await run_in_threadpool(self._warm_sync)
+                self.warmed = True
+            except Exception:
+                logger.warning("readiness: warm-up failed, retrying", exc_info=True)
+                await asyncio.sleep(READINESS_WARM_RETRY)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _ping_sync(self):
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    async def _ping_async(self):
+        async with self.async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def _ping(self) -> bool:
+        try:
+            if self.async_engine is not None:
+                await asyncio.wait_for(self._ping_async(), READINESS_TIMEOUT)
+            else:
+                await asyncio.wait_for(run_in_threadpool(self._ping_sync), READINESS_TIMEOUT)
+            return True
+        except Exception:
+            logger.warning("readiness: database ping failed", exc_info=True)
+            return False
+
+    async def check(self) -> dict:
+        """Each check by name; the worker is ready when all of them pass."""
+        checks = {
+            "warm": self.warmed,
+            # a newer schema is fine: migrations stay compatible with the
+            # code they replace for the length of a rollout
+            "schema": self.schema_version is not None and self.schema_version >= migrations.HEAD,
+            "product_index": self.index is None or self.index.loaded,
+        }
+        checks["database"] = await self._ping() if self.warmed else False
+        return checks
+
+
+readiness = Readiness(database.engine, database.async_engine, search.product_index, search.fetch_products)
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import jwt
+from jwt.exceptions import InvalidTokenError
+
+
+JWT_ALGORITHM = "HS256"
+# Keys as JSON: {"keys": [{"kid": "k1", "secret": "...", "not_before": "<ISO 8601>",
+# "not_after": null}]}, inline and/or in a file (e.g. a mounted secret) that
+# is re-read when it changes. JWT_SECRET_KEY adds one key that never expires.
+JWT_KEYS = os.getenv("JWT_KEYS", "")
+JWT_KEYS_FILE = os.getenv("JWT_KEYS_FILE", "")
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
+JWT_KEYS_RELOAD_INTERVAL = float(os.getenv("JWT_KEYS_RELOAD_INTERVAL", "30"))
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+# kid of the key built from JWT_SECRET_KEY; also assumed for tokens without one
+LEGACY_KID = "default"
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    # fromisoformat() only accepts a "Z" suffix from Python 3.11
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class Key:
+    kid: str
+    secret: str
+    not_before: datetime = None
+    not_after: datetime = None
+
+    def signs(self, now: datetime) -> bool:
+        return (self.not_before is None or self.not_before <= now) and self.verifies(now)
+
+    def verifies(self, now: datetime) -> bool:
+        return self.not_after is None or now < self.not_after
+
+    def to_dict(self) -> dict:
+        return {"kid": self.kid, "secret": self.secret,
+                "not_before": self.not_before.isoformat() if self.not_before else None,
+                "not_after": self.not_after.isoformat() if self.not_after else None}
+
+
+def parse_keys(text: str) -> list:
+    data = json.loads(text)
+    return [Key(kid=k["kid"], secret=k["secret"], not_before=_parse_time(k.get("not_before")),
+                not_after=_parse_time(k.get("not_after")))
+            for k in data["keys"]]
+
+
+class KeyRing:
+    """Every key this process signs or verifies with.
+
+    Tokens are signed with the newest key whose ``not_before`` has passed
+    and carry its ``kid``; any key not past its ``not_after`` verifies. A
+    rotation is scheduled by adding the next key with a future
+    ``not_before`` (see ``rotate``), so every worker and replica switches at
+    the same moment without talking to each other.
+    """
+
+    def __init__(self, inline: str = JWT_KEYS, path: str = JWT_KEYS_FILE,
+                 legacy_secret: str = JWT_SECRET_KEY,
+                 reload_interval: float = JWT_KEYS_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._static = parse_keys(inline) if inline else []
+        if legacy_secret:
+            self._static.append(Key(kid=LEGACY_KID, secret=legacy_secret))
+        self._file_keys = []
+        self._mtime = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+        self.keys = {}
+        self._reload(force=True)
+        if not self.keys:
+            # only valid inside this process (and its forks, with preload)
+            logger.warning("jwt keys: none configured, tokens are signed with a random key")
+            self._static.append(Key(kid=f"ephemeral-{secrets.token_hex(4)}", secret=secrets.token_hex(32)))
+            self._rebuild()
+
+    def _rebuild(self):
+        self.keys = {key.kid: key for key in (*self._static, *self._file_keys)}
+
+    def _reload(self, force: bool = False):
+        if not self.path:
+            if force:
+                self._rebuild()
+            return
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime == self._mtime and not force:
+                    return
+                with open(self.path) as f:
+                    self._file_keys = parse_keys(f.read())
+                self._mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                # keep serving with the keys we have
+                logger.error("jwt keys: cannot load %s: %s", self.path, e)
+                if not force:
+                    return
+            self._rebuild()
+
+    def signing_key(self, now: datetime = None) -> Key:
+        self._reload()
+        now = now or datetime.now(timezone.utc)
+        active = [key for key in self.keys.values() if key.signs(now)]
+        if not active:
+            raise RuntimeError("no active JWT signing key")
+        return max(active, key=lambda key: key.not_before or datetime.min.replace(tzinfo=timezone.utc))
+
+    def verification_key(self, kid: str, now: datetime = None):
+        self._reload()
+        # the header is attacker-controlled; a list or object kid must not
+        # reach the dict lookup
+        if kid is not None and not isinstance(kid, str):
+            return None
+        key = self.keys.get(kid or LEGACY_KID)
+        if key is None or not key.verifies(now or datetime.now(timezone.utc)):
+            return None
+        return key
+
+
+key_ring = KeyRing()
+
+
+def encode(claims: dict) -> str:
+    key = key_ring.signing_key()
+    return jwt.encode(claims, key.secret, algorithm=JWT_ALGORITHM, headers={"kid": key.kid})
+
+
+def decode(token: str, audience: str = None) -> dict:
+    """Verify ``token`` with the key named by its ``kid``; raises InvalidTokenError.
+
+    Tokens with an ``aud`` claim only pass when ``audience`` matches it.
+    """
+    kid = jwt.get_unverified_header(token).get("kid")
+    key = key_ring.verification_key(kid)
+    if key is None:
+        raise InvalidTokenError(f"unknown or retired key {kid!r}")
+    return jwt.decode(token, key.secret, algorithms=[JWT_ALGORITHM], audience=audience)
+
+
+def rotate(keys: list, now: datetime, activate_in: timedelta, retire_after: timedelta) -> list:
+    """Schedule a new signing key ``activate_in`` from ``now``.
+
+    Keys without an end get one ``retire_after`` past the switch, long enough
+    for tokens they signed to expire; keys already past their end are dropped.
+    """
+    switch = now + activate_in
+    kept = [key if key.not_after else Key(key.kid, key.secret, key.not_before, switch + retire_after)
+            for key in keys if key.verifies(now)]
+    kid = "k" + switch.strftime("%Y%m%d%H%M%S")
+    return kept + [Key(kid=kid, secret=secrets.token_urlsafe(48), not_before=switch)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Schedule a JWT key rotation in a keys file.")
+    parser.add_argument("command", choices=["rotate"])
+    parser.add_argument("path", help="JSON keys file (created if missing)")
+    parser.add_argument("--activate-in", type=float, default=300,
+                        help="seconds until the new key signs; give every worker time to load it")
+    parser.add_argument("--retire-after", type=float, default=3600,
+                        help="seconds the old keys keep verifying after the switch")
+    args = parser.parse_args()
+
+    current = []
+    if os.path.exists(args.path):
+        with open(args.path) as f:
+            current = parse_keys(f.read())
+    rotated = rotate(current, datetime.now(timezone.utc), timedelta(seconds=args.activate_in),
+                     timedelta(seconds=args.retire_after))
+    tmp = f"{args.path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"keys": [key.to_dict() for key in rotated]}, f, indent=2)
+    os.replace(tmp, args.path)
+    print(f"{rotated[-1].kid} signs from {rotated[-1].not_before.isoformat()}")
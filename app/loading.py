@@ -0,0 +1,68 @@
+from fastapi import HTTPException, Query, status
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+import models
+
+
+# Relationships a client may ask for with ?expand=, and how each is loaded.
+# Many-to-one rides along in the main query as a JOIN; collections cost one
+# extra SELECT ... WHERE ... IN (...) for the whole page.
+EXPANDABLE = {
+    models.Invoice: {"product": joinedload, "user": joinedload, "company": joinedload},
+    models.UserBookmark: {"product": joinedload, "user": joinedload},
+    models.User: {"company": joinedload, "user_bank_account": joinedload,
+                  "bookmarks": selectinload},
+}
+
+# Named loading profiles, usable in ?expand= like a relationship name
+PROFILES = {
+    models.Invoice: {"summary": ("product", "company"),
+                     "full": ("product", "user", "company")},
+    models.UserBookmark: {"full": ("product", "user")},
+    models.User: {"full": ("company", "user_bank_account", "bookmarks")},
+}
+
+
+def parse_expand(model, expand: str = None) -> tuple:
+    """Resolve a comma separated ``expand`` value into relationship names."""
+    names = []
+    for name in filter(None, (part.strip() for part in (expand or "").split(","))):
+        if name in PROFILES.get(model, {}):
+            names.extend(PROFILES[model][name])
+        elif name in EXPANDABLE.get(model, {}):
+            names.append(name)
+        else:
+            allowed = sorted({*EXPANDABLE.get(model, {}), *PROFILES.get(model, {})})
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Cannot expand {name!r}; expected one of {', '.join(allowed) or 'nothing'}"
+            )
+    return tuple(dict.fromkeys(names))
+
+
+def load_options(model, expand=None) -> list:
+    """Loader options for ``expand``; every other relationship raises instead
+    of lazy loading, so a request runs at most ``query_budget`` statements.
+
+    ``None`` (internal callers such as updates and deletes) keeps the mapper's
+    lazy loading.
+    """
+    if expand is None:
+        return []
+    options = [EXPANDABLE[model][name](getattr(model, name)).raiseload("*", sql_only=True)
+               for name in expand]
+    options.append(raiseload("*", sql_only=True))
+    return options
+
+
+def query_budget(model, expand=()) -> int:
+    return 1 + sum(EXPANDABLE[model][name] is selectinload for name in expand)
+
+
+def expand_param(model):
+    """Dependency parsing ``?expand=`` for ``model``'s endpoints."""
+    choices = ", ".join([*EXPANDABLE[model], *PROFILES.get(model, {})])
+
+    def dependency(expand: str = Query(None, description=f"Comma separated: {choices}")) -> tuple:
+        return parse_expand(model, expand)
+
+    return dependency
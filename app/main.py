@@ -1,121 +1,247 @@
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import APIRouter, Body, Depends, FastAPI, Form, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-import crud
+from starlette.concurrency import run_in_threadpool
+import analytics
+import bulk
+import catalog_cache
+import dal
+import database
+import db_pool
+import etags
+import health
+import metrics
+import exports
+import loading
 import models
+import pagination
+import refresh_tokens
+import replicas
+import revocations
 import schemas
+import search
+import throttling
 from database import SessionLocal, engine
-import uvicorn
+import inspect
+import logging
 import os
-from typing import Annotated
+from contextlib import asynccontextmanager
+from typing import Annotated, Literal
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from datetime import date, datetime, timedelta, timezone
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-import jwt
 from jwt.exceptions import InvalidTokenError
-from passlib.context import CryptContext
+import jwt_keys
 import secrets
+from principals import principal_cache
+from crud import AlreadyExistsError
+from hashing import password_hasher
 
 
-JWT_SECRET_KEY = secrets.token_hex(32)
-if not os.environ["JWT_SECRET_KEY"]:
-    os.environ["JWT_SECRET_KEY"] = JWT_SECRET_KEY
+ACCESS_TOKEN_EXPIRE_MINUTES = jwt_keys.ACCESS_TOKEN_EXPIRE_MINUTES
+APP_PORT = int(os.getenv("APP_PORT", "9090"))
+# Seconds in-flight requests get to finish after SIGTERM before they are
+# cancelled and the shutdown below runs (standalone uvicorn; gunicorn.conf.py
+# derives its own from GUNICORN_GRACEFUL_TIMEOUT)
+SHUTDOWN_TIMEOUT = int(os.getenv("SHUTDOWN_TIMEOUT", "25"))
 
-
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-APP_PORT = int(os.getenv("APP_PORT"))
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI()
-
-origins = ["*"]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+metrics.instrument_engine(engine)
+if database.async_engine is not None:
+    metrics.instrument_engine(database.async_engine.sync_engine)
+
+
+# Importing this module does no I/O: the schema is migrated beforehand
+# ("python migrations.py upgrade") and background work starts with the app.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics.registry.bind(app)
+    catalog_cache.bus.start()
+    replicas.replica_set.start()
+    revocations.revocation_list.start()
+    health.readiness.start()
+    if worker_metrics is not None:
+        worker_metrics.start()
+    yield
+    # SIGTERM: the server has stopped accepting connections and drained the
+    # in-flight requests before this runs
+    await health.readiness.stop()
+    await replicas.replica_set.stop()
+    await revocations.revocation_list.stop()
+    if worker_metrics is not None:
+        await worker_metrics.stop()
+    password_hasher.shutdown()
+    if database.async_engine is not None:
+        for async_engine in (database.async_engine, *database.async_replica_engines):
+            await async_engine.dispose()
+    for sync_engine in (engine, *database.replica_engines):
+        sync_engine.dispose()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(router)
+    return app
 
 
 # Dependency
-def get_db():
+def route_session(db, request: Request, response: Response):
+    replica = replicas.read_replica(request)
+    if replica is not None:
+        db.info["replica"] = replica
+    elif request.method not in replicas.READ_METHODS:
+        replicas.start_read_your_writes(response)
+
+
+async def get_db(request: Request, response: Response):
+    if database.DB_MODE == "async":
+        async with database.AsyncSessionLocal() as db:
+            route_session(db, request, response)
+            yield db
+        return
     db = SessionLocal()
+    route_session(db, request, response)
     try:
         yield db
     finally:
         db.close()
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def get_page_params(limit: Annotated[int, Query(ge=1, le=pagination.PAGE_SIZE_MAX)] = pagination.PAGE_SIZE_DEFAULT,
+                    cursor: str | None = None,
+                    sort: Literal["id", "-id", "create_date", "-create_date"] = "id"):
+    return schemas.PageParams(limit=limit, cursor=cursor, sort=sort)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def set_next_cursor(response: Response, model, page: schemas.PageParams, items):
+    cursor = pagination.next_cursor(model, page, items)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
 
 
-def get_user(username: str, db: Session = Depends(get_db)):
-    all_users = crud.get_users(db=db)
-    all_user_names = [user.user_name for user in all_users]
-    if username in all_user_names:
-        user_idx = all_user_names.index(username)
-        return all_users[user_idx]
+async def get_user_by_username(username: str, db: Session = Depends(get_db)):
+    user = principal_cache.get(username)
+    if user is not None:
+        return user
+    user = await dal.get_user_by_username(db=db, username=username)
+    if user is not None:
+        # Detach so later commits in this session can't expire the shared copy
+        db.expunge(user)
+        principal_cache.set(username, user)
+    return user
 
 
-def authenticate_user(username: str, password: str, db: Session = Depends(get_db)):
-    user = get_user(db=db, username=username)
+async def authenticate_user(username: str, password: str, db: Session = Depends(get_db)):
+    user = await get_user_by_username(db=db, username=username)
     if not user:
         return False
-    if not verify_password(password, user.user_password):
+    verified, new_hash = await password_hasher.verify(password, user.user_password)
+    if not verified:
         return False
+    if new_hash:
+        await dal.update_user_password(db=db, user_id=user.id, hashed_password=new_hash)
     return user
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
+    now = datetime.now(timezone.utc)
     if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+        expire = now + timedelta(minutes=15)
+    # iat keeps its fraction so a token issued right after a revocation
+    # is not covered by it
+    to_encode.update({"exp": expire, "iat": now.timestamp(), "jti": secrets.token_urlsafe(12)})
+    return jwt_keys.encode(to_encode)
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """Who the token belongs to. In stateless mode only the revocation list
+    is consulted; the user is loaded for tokens without a user id, in lookup
+    mode, and while the revocation list is not synced."""
     try:
-        payload = jwt.decode(token, os.getenv(
-            "JWT_SECRET_KEY"), algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(username=username)
+        payload = jwt_keys.decode(token)
     except InvalidTokenError:
-        raise credentials_exception
-    user = get_user(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
+        raise credentials_exception()
+    username, user_id = payload.get("sub"), payload.get("uid")
+    if username is None:
+        raise credentials_exception()
+    revocation_list = revocations.revocation_list
+    if user_id is None or revocations.AUTH_MODE != "stateless" or not revocation_list.fresh:
+        user = await get_user_by_username(db=db, username=username)
+        if user is None or user_id not in (None, user.id):
+            raise credentials_exception()
+        user_id = user.id
+    if revocation_list.is_revoked(user_id, payload.get("jti"), payload.get("iat")):
+        raise credentials_exception()
+    return schemas.Principal(id=user_id, username=username, jti=payload.get("jti"),
+                             expires_at=payload.get("exp"))
+
+
+async def get_current_user(principal: Annotated[schemas.Principal, Depends(get_current_principal)],
+                           db: Session = Depends(get_db)):
+    """The caller's ``models.User``, for routes that need more than the token carries."""
+    user = await get_user_by_username(db=db, username=principal.username)
+    if user is None or user.id != principal.id:
+        raise credentials_exception()
     return user
 
 
-@app.post("/token")
+def conditional_get(table: str):
+    """Dependency for ``table``'s GET routes: sets ETag/Cache-Control and
+    answers a matching If-None-Match with 304 before the handler runs, from
+    the worker's snapshot of the table versions."""
+    cache_control = etags.CACHE_CONTROL[table]
+
+    async def dependency(request: Request, response: Response,
+                         db: Annotated[Session, Depends(get_db)],
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)]):
+        if etags.table_versions.stale():
+            etags.table_versions.update(await dal.get_table_versions(db=db))
+        etag = etags.make_etag(table, etags.table_versions.get(table))
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if etags.if_none_match(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+
+    return dependency
+
+
+@router.post("/token")
 async def login_for_access_token(
+    request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: Annotated[Session, Depends(get_db)]
 ) -> schemas.Token:
-    user = authenticate_user(
-        db, form_data.username, form_data.password)
+    # the server has already taken the address from X-Forwarded-For when the
+    # peer is one of FORWARDED_ALLOW_IPS
+    await throttling.login_throttle.admit(form_data.username, request.client.host if request.client else "")
+    user = await authenticate_user(
+        username=form_data.username, password=form_data.password, db=db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -124,25 +250,180 @@ async def login_for_access_token(
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.user_name}, expires_delta=access_token_expires
+        data={"sub": user.user_name, "uid": user.id}, expires_delta=access_token_expires
     )
+    refresh_token, stored = refresh_tokens.issue(user.id, refresh_tokens.new_family())
+    await dal.start_refresh_family(db=db, user_id=user.id, stored=stored)
 
-    return schemas.Token(access_token=access_token, token_type="bearer")
+    return schemas.Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
 
 
-@app.get("/users", status_code=status.HTTP_200_OK)
+@router.post("/token/refresh")
+async def refresh_access_token(
+    refresh_token: Annotated[str, Form()],
+    db: Annotated[Session, Depends(get_db)]
+) -> schemas.Token:
+    """Trade a refresh token for a new access token and refresh token, with
+    no password check. Each refresh token works once."""
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        user_id, family = refresh_tokens.decode(refresh_token)
+    except InvalidTokenError:
+        raise invalid
+    new_token, stored = refresh_tokens.issue(user_id, family)
+    username = await dal.rotate_refresh_token(db=db, user_id=user_id, family=family,
+                                              old=refresh_tokens.stored_value(family, refresh_token),
+                                              new=stored)
+    if username is None:
+        raise invalid
+    access_token = create_access_token(
+        data={"sub": username, "uid": user_id},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return schemas.Token(access_token=access_token, token_type="bearer", refresh_token=new_token)
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(db: Annotated[Session, Depends(get_db)],
+                 current_user: Annotated[schemas.Principal, Depends(get_current_principal)]):
+    # tokens without a jti predate it and can only be revoked all together
+    await dal.end_session(db=db, user_id=current_user.id, jti=current_user.jti,
+                          expires_at=current_user.expires_at)
+
+
+@router.get("/healthz", status_code=status.HTTP_200_OK)
+async def get_liveness():
+    # no dependencies: a database outage must not get workers restarted
+    return {"status": "ok"}
+
+
+@router.get("/readyz", status_code=status.HTTP_200_OK)
+async def get_readiness(response: Response):
+    checks = await health.readiness.check()
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready" if ready else "not ready", "checks": checks}
+
+
+def render_metrics() -> str:
+    """This worker's metrics in Prometheus text format."""
+    pools = [("sync", database.pool_stats), ("async", database.async_pool_stats)]
+    pools += [(f"replica-{host}", stats) for host, stats
+              in zip(database.POSTGRES_REPLICA_HOSTS, database.replica_pool_stats)]
+    pools += [(f"async-replica-{host}", stats) for host, stats
+              in zip(database.POSTGRES_REPLICA_HOSTS, database.async_replica_pool_stats)]
+    pools = [(name, stats.snapshot()) for name, stats in pools if stats]
+    body = [metrics.registry.render()]
+    for key in ("size", "in_use", "idle", "overflow"):
+        body.append(metrics.render_samples(
+            f"db_pool_{key}", "gauge", f"Connection pool {key.replace('_', ' ')}.",
+            [(f'pool="{name}"', snap[key]) for name, snap in pools]))
+    for key in ("checkouts", "timeouts", "connects", "invalidations", "checkout_wait_seconds"):
+        body.append(metrics.render_samples(
+            f"db_pool_{key}_total", "counter", f"Connection pool {key.replace('_', ' ')}.",
+            [(f'pool="{name}"', snap[key]) for name, snap in pools]))
+    cache = principal_cache.stats()
+    body.append(metrics.render_samples(
+        "principal_cache_requests_total", "counter", "Principal cache lookups.",
+        [('result="hit"', cache["hits"]), ('result="miss"', cache["misses"])]))
+    caches = [(f'cache="{table}"', c.stats()) for table, (c, _) in catalog_cache.CACHES.items()]
+    body.append(metrics.render_samples(
+        "catalog_cache_requests_total", "counter", "Catalog read-through cache lookups.",
+        [(f'{labels},result="{result}"', stats[key]) for labels, stats in caches
+         for result, key in (("hit", "hits"), ("negative_hit", "negative_hits"), ("miss", "misses"))]))
+    body.append(metrics.render_samples(
+        "catalog_cache_hit_ratio", "gauge", "Share of catalog cache lookups served from memory.",
+        [(labels, stats["hit_ratio"]) for labels, stats in caches]))
+    body.append(metrics.render_samples(
+        "catalog_cache_invalidations_total", "counter", "Catalog cache invalidations applied.",
+        [(labels, stats["invalidations"]) for labels, stats in caches]))
+    revoked = revocations.revocation_list.stats()
+    body.append(metrics.render_samples(
+        "token_revocations", "gauge", "Revocations this worker enforces.",
+        [('kind="user"', revoked["users"]), ('kind="token"', revoked["tokens"])]))
+    if revoked["age_seconds"] is not None:
+        body.append(metrics.render_samples(
+            "token_revocations_age_seconds", "gauge", "Seconds since the revocation list was last synced.",
+            [("", revoked["age_seconds"])]))
+    index = search.product_index.stats()
+    body.append(metrics.render_samples(
+        "product_index_products", "gauge", "Products in this worker's autocomplete index.",
+        [("", index["products"])]))
+    if index["age_seconds"] is not None:
+        body.append(metrics.render_samples(
+            "product_index_age_seconds", "gauge", "Seconds since the autocomplete index was last reloaded.",
+            [("", index["age_seconds"])]))
+    replica_stats = replicas.replica_set.stats()
+    body.append(metrics.render_samples(
+        "db_replica_healthy", "gauge", "Whether a read replica is in rotation.",
+        [(f'replica="{r["replica"]}"', int(r["healthy"])) for r in replica_stats]))
+    body.append(metrics.render_samples(
+        "db_replica_lag_seconds", "gauge", "Replication lag at the last health check.",
+        [(f'replica="{r["replica"]}"', r["lag_seconds"]) for r in replica_stats
+         if r["lag_seconds"] is not None]))
+    throttle = throttling.login_throttle.stats()
+    body.append(metrics.render_samples(
+        "login_throttle_requests_total", "counter", "Login attempts checked against the throttle.",
+        [(f'scope="{scope}",result="{result}"', n) for (scope, result), n in sorted(throttle["counts"].items())]))
+    body.append(metrics.render_samples(
+        "login_throttle_buckets", "gauge", "Token buckets held by this worker.",
+        [("", throttle["buckets"])]))
+    hasher = password_hasher.stats()
+    body.append(metrics.render_samples(
+        "password_hash_in_flight", "gauge", "Password hashing calls in flight.",
+        [("", hasher["in_flight"])]))
+    body.append(metrics.render_samples(
+        "password_hash_rejected_total", "counter", "Password hashing calls rejected with 503.",
+        [("", hasher["rejected"])]))
+    return "".join(body)
+
+
+worker_metrics = metrics.WorkerMetrics(metrics.METRICS_DIR, render_metrics) if metrics.METRICS_DIR else None
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    text = render_metrics()
+    if worker_metrics is not None:
+        # rendered here: the registry is only touched from the event loop
+        text = await run_in_threadpool(worker_metrics.collect, text)
+    return PlainTextResponse(text, media_type=metrics.CONTENT_TYPE)
+
+
+@router.get("/metrics/pool", status_code=status.HTTP_200_OK)
+async def get_pool_metrics():
+    pools = [database.pool_stats]
+    if database.async_pool_stats:
+        pools.append(database.async_pool_stats)
+    report = db_pool.pool_report(*pools, *database.replica_pool_stats, *database.async_replica_pool_stats)
+    report["replicas"] = replicas.replica_set.stats()
+    return report
+
+
+@router.get("/users", status_code=status.HTTP_200_OK, response_model=list[schemas.UserOut], response_model_exclude_unset=True)
 async def get_all_users(db: Annotated[Session, Depends(get_db)],
-                        current_user: Annotated[models.User, Depends(get_current_user)]):
-    users = crud.get_users(db=db)
+                        current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                        response: Response,
+                        page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                        filters: Annotated[schemas.UserFilter, Depends()],
+                        expand: Annotated[tuple, Depends(loading.expand_param(models.User))]):
+    users = await dal.get_users(db=db, page=page, filters=filters, expand=expand)
+    set_next_cursor(response, models.User, page, users)
     return users
 
 
-@app.get("/users/{user_id}", status_code=status.HTTP_200_OK)
+@router.get("/users/{user_id}", status_code=status.HTTP_200_OK, response_model=schemas.UserOut, response_model_exclude_unset=True)
 async def get_user(user_id: int,
                    db: Annotated[Session, Depends(get_db)],
-                   current_user: Annotated[models.User, Depends(get_current_user)]):
+                   current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                   expand: Annotated[tuple, Depends(loading.expand_param(models.User))]):
 
-    user = crud.get_user(db=db, user_id=user_id)
+    user = await dal.get_user(db=db, user_id=user_id, expand=expand)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user_id} not found"
@@ -151,18 +432,24 @@ async def get_user(user_id: int,
     return user
 
 
-@app.get("/product_tags", status_code=status.HTTP_200_OK)
+@router.get("/product_tags", status_code=status.HTTP_200_OK, response_model=list[schemas.ProductTagOut],
+         dependencies=[Depends(conditional_get("product_tags"))])
 async def get_all_product_tags(db: Annotated[Session, Depends(get_db)],
-                               current_user: Annotated[models.User, Depends(get_current_user)]):
-    product_tags = crud.get_product_tags(db=db)
+                               current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                               response: Response,
+                               page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                               filters: Annotated[schemas.ProductTagFilter, Depends()]):
+    product_tags = await dal.get_product_tags(db=db, page=page, filters=filters)
+    set_next_cursor(response, models.ProductTag, page, product_tags)
     return product_tags
 
 
-@app.get("/product_tags/{tag_id}", status_code=status.HTTP_200_OK)
-async def get_product_tag(tag_id,
+@router.get("/product_tags/{tag_id}", status_code=status.HTTP_200_OK, response_model=schemas.ProductTagOut,
+         dependencies=[Depends(conditional_get("product_tags"))])
+async def get_product_tag(tag_id: int,
                           db: Annotated[Session, Depends(get_db)],
-                          current_user: Annotated[models.User, Depends(get_current_user)]):
-    product_tag = crud.get_product_tag(db=db, tag_id=tag_id)
+                          current_user: Annotated[schemas.Principal, Depends(get_current_principal)]):
+    product_tag = await dal.get_product_tag(db=db, tag_id=tag_id)
     if not product_tag:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Product tag with id {tag_id} not found"
@@ -170,18 +457,24 @@ async def get_product_tag(tag_id,
     return product_tag
 
 
-@app.get("/companies", status_code=status.HTTP_200_OK)
+@router.get("/companies", status_code=status.HTTP_200_OK, response_model=list[schemas.CompanyOut],
+         dependencies=[Depends(conditional_get("companies"))])
 async def get_all_companies(db: Annotated[Session, Depends(get_db)],
-                            current_user: Annotated[models.User, Depends(get_current_user)]):
-    companies = crud.get_companies(db=db)
+                            current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                            response: Response,
+                            page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                            filters: Annotated[schemas.CompanyFilter, Depends()]):
+    companies = await dal.get_companies(db=db, page=page, filters=filters)
+    set_next_cursor(response, models.Company, page, companies)
     return companies
 
 
-@app.get("/companies/{company_id}", status_code=status.HTTP_200_OK)
+@router.get("/companies/{company_id}", status_code=status.HTTP_200_OK, response_model=schemas.CompanyOut,
+         dependencies=[Depends(conditional_get("companies"))])
 async def get_company(company_id,
                       db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)]):
-    company = crud.get_company(db=db, company_id=company_id)
+                      current_user: Annotated[schemas.Principal, Depends(get_current_principal)]):
+    company = await dal.get_company(db=db, company_id=company_id)
     if not company:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Company with id {company_id} not found"
@@ -189,18 +482,52 @@ async def get_company(company_id,
     return company
 
 
-@app.get("/products", status_code=status.HTTP_200_OK)
+@router.get("/products", status_code=status.HTTP_200_OK, response_model=list[schemas.ProductOut],
+         dependencies=[Depends(conditional_get("products"))])
 async def get_all_products(db: Annotated[Session, Depends(get_db)],
-                           current_user: Annotated[models.User, Depends(get_current_user)]):
-    products = crud.get_products(db=db)
+                           current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                           response: Response,
+                           page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                           filters: Annotated[schemas.ProductFilter, Depends()]):
+    products = await dal.get_products(db=db, page=page, filters=filters)
+    set_next_cursor(response, models.Product, page, products)
+    return products
+
+
+@router.get("/products/search", status_code=status.HTTP_200_OK, response_model=list[schemas.ProductOut],
+         dependencies=[Depends(conditional_get("products"))])
+async def search_products(db: Annotated[Session, Depends(get_db)],
+                          current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                          response: Response,
+                          q: Annotated[str, Query(min_length=1)],
+                          page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                          filters: Annotated[schemas.ProductFilter, Depends()],
+                          match: Literal["substring", "prefix"] = "substring"):
+    products = await dal.search_products(db=db, q=q, match=match, page=page, filters=filters)
+    set_next_cursor(response, models.Product, page, products)
     return products
 
 
-@app.get("/products/{product_id}", status_code=status.HTTP_200_OK)
+@router.get("/products/autocomplete", status_code=status.HTTP_200_OK, response_model=list[schemas.ProductSuggestion])
+async def autocomplete_products(current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                                q: Annotated[str, Query(min_length=1)],
+                                limit: Annotated[int, Query(ge=1, le=search.AUTOCOMPLETE_LIMIT_MAX)] = search.AUTOCOMPLETE_LIMIT_DEFAULT,
+                                product_tag_id: int = None,
+                                company_id: int = None):
+    index = search.product_index
+    if not index.loaded:
+        await run_in_threadpool(index.reload, search.fetch_products)
+    elif index.needs_reload():
+        index.reload_in_background(search.fetch_products)
+    return index.complete(q, limit, product_tag_id=product_tag_id, company_id=company_id)
+
+
+@router.get("/products/{product_id}", status_code=status.HTTP_200_OK, response_model=schemas.ProductOut,
+         dependencies=[Depends(conditional_get("products"))])
 async def get_product(product_id: int,
                       db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)]):
-    product = crud.get_product(db=db, product_id=product_id)
+                      current_user: Annotated[schemas.Principal, Depends(get_current_principal)]):
+    product = await dal.get_product(db=db, product_id=product_id)
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {product_id} not found"
@@ -208,18 +535,44 @@ async def get_product(product_id: int,
     return product
 
 
-@app.get("/invoices", status_code=status.HTTP_200_OK)
+@router.get("/invoices", status_code=status.HTTP_200_OK, response_model=list[schemas.InvoiceOut], response_model_exclude_unset=True)
 async def get_all_invoices(db: Annotated[Session, Depends(get_db)],
-                           current_user: Annotated[models.User, Depends(get_current_user)]):
-    invoices = crud.get_invoices(db=db)
+                           current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                           response: Response,
+                           page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                           filters: Annotated[schemas.InvoiceFilter, Depends()],
+                           expand: Annotated[tuple, Depends(loading.expand_param(models.Invoice))]):
+    invoices = await dal.get_invoices(db=db, page=page, filters=filters, expand=expand)
+    set_next_cursor(response, models.Invoice, page, invoices)
     return invoices
 
 
-@app.get("/invoices/{invoice_id}", status_code=status.HTTP_200_OK)
+@router.get("/analytics/invoices", status_code=status.HTTP_200_OK, response_model=schemas.InvoiceAnalyticsOut)
+async def get_invoice_analytics(db: Annotated[Session, Depends(get_db)],
+                                current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                                company_id: int = None,
+                                product_id: int = None,
+                                top: Annotated[int, Query(ge=1, le=analytics.ANALYTICS_TOP_MAX)] = analytics.ANALYTICS_TOP_DEFAULT):
+    rows = await dal.get_invoice_summary(db=db, company_id=company_id, product_id=product_id)
+    return await run_in_threadpool(analytics.summarize, rows, top)
+
+
+@router.get("/invoices/export", status_code=status.HTTP_200_OK)
+async def export_invoices(request: Request,
+                          current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                          filters: Annotated[schemas.InvoiceFilter, Depends()],
+                          format: Literal["ndjson", "csv"] = "ndjson",
+                          gzip: bool = False):
+    return exports.invoice_export_response(filters=filters, fmt=format, gzip=gzip,
+                                           replica=replicas.read_replica(request))
+
+
+@router.get("/invoices/{invoice_id}", status_code=status.HTTP_200_OK, response_model=schemas.InvoiceOut, response_model_exclude_unset=True)
 async def get_invoice(invoice_id: int,
                       db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)]):
-    invoice = crud.get_invoice(db=db, invoice_id=invoice_id)
+                      current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                      expand: Annotated[tuple, Depends(loading.expand_param(models.Invoice))]):
+    invoice = await dal.get_invoice(db=db, invoice_id=invoice_id, expand=expand)
     if not invoice:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Invoice with id {invoice_id} not found"
@@ -227,18 +580,22 @@ async def get_invoice(invoice_id: int,
     return invoice
 
 
-@app.get("/bank_accounts", status_code=status.HTTP_200_OK)
+@router.get("/bank_accounts", status_code=status.HTTP_200_OK, response_model=list[schemas.BankAccountOut])
 async def get_all_bank_accounts(db: Annotated[Session, Depends(get_db)],
-                                current_user: Annotated[models.User, Depends(get_current_user)]):
-    bank_accounts = crud.get_bank_accounts(db=db)
+                                current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                                response: Response,
+                                page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                                filters: Annotated[schemas.BankAccountFilter, Depends()]):
+    bank_accounts = await dal.get_bank_accounts(db=db, page=page, filters=filters)
+    set_next_cursor(response, models.BankAccount, page, bank_accounts)
     return bank_accounts
 
 
-@app.get("/bank_accounts/{user_id}", status_code=status.HTTP_200_OK)
+@router.get("/bank_accounts/{user_id}", status_code=status.HTTP_200_OK, response_model=schemas.BankAccountOut)
 async def get_bank_account(user_id: int,
                            db: Annotated[Session, Depends(get_db)],
-                           current_user: Annotated[models.User, Depends(get_current_user)]):
-    bank_account = crud.get_bank_account(db=db, user_id=user_id)
+                           current_user: Annotated[schemas.Principal, Depends(get_current_principal)]):
+    bank_account = await dal.get_bank_account(db=db, user_id=user_id)
     if not bank_account:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Bank Account for user with id {user_id} not found"
@@ -246,19 +603,25 @@ async def get_bank_account(user_id: int,
     return bank_account
 
 
-@app.get("/user_bookmarks", status_code=status.HTTP_200_OK)
+@router.get("/user_bookmarks", status_code=status.HTTP_200_OK, response_model=list[schemas.UserBookmarkOut], response_model_exclude_unset=True)
 async def get_all_user_bookmarks(db: Annotated[Session, Depends(get_db)],
-                                 current_user: Annotated[models.User, Depends(get_current_user)]):
-    user_bookmarks = crud.get_bookmarks(db=db)
+                                 current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                                 response: Response,
+                                 page: Annotated[schemas.PageParams, Depends(get_page_params)],
+                                 filters: Annotated[schemas.UserBookmarkFilter, Depends()],
+                                 expand: Annotated[tuple, Depends(loading.expand_param(models.UserBookmark))]):
+    user_bookmarks = await dal.get_bookmarks(db=db, page=page, filters=filters, expand=expand)
+    set_next_cursor(response, models.UserBookmark, page, user_bookmarks)
     return user_bookmarks
 
 
-@app.get("/user_bookmarks/{user_id}", status_code=status.HTTP_200_OK)
+@router.get("/user_bookmarks/{user_id}", status_code=status.HTTP_200_OK, response_model=list[schemas.UserBookmarkOut], response_model_exclude_unset=True)
 async def get_user_bookmark(user_id: int,
                             db: Annotated[Session, Depends(get_db)],
-                            current_user: Annotated[models.User, Depends(get_current_user)]):
+                            current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                            expand: Annotated[tuple, Depends(loading.expand_param(models.UserBookmark))]):
 
-    user_bookmark = crud.get_bookmark(db=db, user_id=user_id)
+    user_bookmark = await dal.get_bookmark(db=db, user_id=user_id, expand=expand)
     if not user_bookmark:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"User bookmark for user with id {user_id} not found"
@@ -266,26 +629,37 @@ async def get_user_bookmark(user_id: int,
     return user_bookmark
 
 
-@app.post("/users/create", status_code=status.HTTP_201_CREATED)
+def user_conflict_detail(user: schemas.UserCreate, e: AlreadyExistsError):
+    if e.constraint and "email" in e.constraint:
+        return f"User with email {user.user_email} already exists"
+    return "User with the same phone, identity code or address already exists"
+
+
+@router.post("/users/create", status_code=status.HTTP_201_CREATED, response_model=schemas.UserOut, response_model_exclude_unset=True)
 async def create_user(db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)],
-                      user: Annotated[schemas.UserCreate, Depends()]):
-    all_users = crud.get_users(db=db)
-    user_emails = [db_user.user_email for db_user in all_users]
-    if user.user_email in user_emails:
+                      current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                      user: schemas.UserCreate):
+    user.password = await password_hasher.hash(user.password)
+    try:
+        created_user = await dal.create_user(db=db, user=user)
+    except AlreadyExistsError as e:
         raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT, detail=f"User with email {user.user_email} already exists"
+            status_code=status.HTTP_409_CONFLICT, detail=user_conflict_detail(user, e)
         )
-    user.password = get_password_hash(user.password)
-    created_user = crud.create_user(db=db, user=user)
     return created_user
 
 
-@app.put("/users/update", status_code=status.HTTP_201_CREATED)
+@router.put("/users/update", status_code=status.HTTP_201_CREATED, response_model=schemas.UserOut, response_model_exclude_unset=True)
 async def update_user(db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)],
-                      user: Annotated[schemas.UserUpdate, Depends()]):
-    updated_user = crud.update_user(db=db, user=user)
+                      current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                      user: schemas.UserUpdate):
+    user.password = await password_hasher.hash(user.password)
+    try:
+        updated_user = await dal.update_user(db=db, user=user)
+    except AlreadyExistsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=user_conflict_detail(user, e)
+        )
     if not updated_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user.id} not found"
@@ -293,79 +667,108 @@ async def update_user(db: Annotated[Session, Depends(get_db)],
     return updated_user
 
 
-@app.post("/product_tags/create", status_code=status.HTTP_201_CREATED)
+@router.post("/product_tags/create", status_code=status.HTTP_201_CREATED, response_model=schemas.ProductTagOut)
 async def create_product_tag(db: Annotated[Session, Depends(get_db)],
-                             current_user: Annotated[models.User, Depends(get_current_user)],
-                             product_tag: Annotated[schemas.ProductTag, Depends()]):
-    product_tags = crud.get_product_tags(db=db)
-    tag_names = [db_p_tag.tag_name for db_p_tag in product_tags] if len(
-        product_tags) > 0 else []
-
-    if product_tag.tag_name in tag_names:
+                             current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                             product_tag: schemas.ProductTag,
+                             upsert: bool = False):
+    if upsert:
+        return await dal.upsert_product_tag(db=db, product_tag=product_tag)
+    try:
+        created_product_tag = await dal.create_product_tag(db=db, product_tag=product_tag)
+    except AlreadyExistsError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=f"Product tag with name {product_tag.tag_name} already exists"
         )
-    created_product_tag = crud.create_product_tag(db=db, user=product_tag)
     return created_product_tag
 
 
-@app.put("/product_tags/update", status_code=status.HTTP_201_CREATED)
+@router.put("/product_tags/update", status_code=status.HTTP_201_CREATED, response_model=schemas.ProductTagOut)
 async def update_product_tag(db: Annotated[Session, Depends(get_db)],
-                             current_user: Annotated[models.User, Depends(get_current_user)],
-                             product_tag: Annotated[schemas.ProductTagUpdate, Depends()]):
+                             current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                             product_tag: schemas.ProductTagUpdate):
 
-    updated_product_tag = crud.update_product_tag(
-        db=db, product_tag=product_tag)
+    try:
+        updated_product_tag = await dal.update_product_tag(
+            db=db, product_tag=product_tag)
+    except AlreadyExistsError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"Product tag with name {product_tag.tag_name} already exists"
+        )
     if not updated_product_tag:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=f"Product Tag with id {updated_product_tag.id} not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Product Tag with id {product_tag.id} not found"
         )
     return updated_product_tag
 
 
-@app.post("/products/create", status_code=status.HTTP_201_CREATED)
+@router.post("/products/create", status_code=status.HTTP_201_CREATED, response_model=schemas.ProductOut)
 async def create_product(db: Annotated[Session, Depends(get_db)],
-                         current_user: Annotated[models.User, Depends(get_current_user)],
-                         product: Annotated[schemas.ProductBase, Depends()]):
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                         product: schemas.ProductBase):
 
-    created_product = crud.create_product(db=db, product=product)
+    created_product = await dal.create_product(db=db, product=product)
     return created_product
 
 
-@app.put("/products/update", status_code=status.HTTP_201_CREATED)
+def check_bulk_size(rows: list):
+    if len(rows) > bulk.BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"At most {bulk.BULK_MAX_ROWS} rows per request"
+        )
+
+
+@router.post("/products/bulk", status_code=status.HTTP_200_OK)
+async def bulk_create_products(db: Annotated[Session, Depends(get_db)],
+                               current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                               products: Annotated[list[dict], Body()],
+                               chunk_size: Annotated[int, Query(ge=1, le=bulk.BULK_CHUNK_MAX)] = bulk.BULK_CHUNK_SIZE) -> schemas.BulkResult:
+    check_bulk_size(products)
+    valid, errors = bulk.validate_rows(schemas.ProductBase, products)
+    created, db_errors = await dal.bulk_create_products(db=db, products=valid, chunk_size=chunk_size)
+    return schemas.BulkResult(created=created, errors=sorted(errors + db_errors, key=lambda e: e["index"]))
+
+
+@router.put("/products/update", status_code=status.HTTP_201_CREATED, response_model=schemas.ProductOut)
 async def update_product(db: Annotated[Session, Depends(get_db)],
-                         current_user: Annotated[models.User, Depends(get_current_user)],
-                         product: Annotated[schemas.ProductTagUpdate, Depends()]):
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                         product: schemas.ProductUpdate):
 
-    updated_product = crud.update_product(db=db, product=product)
+    updated_product = await dal.update_product(db=db, product=product)
     if not updated_product:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {updated_product.id} not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {product.id} not found"
         )
     return updated_product
 
 
-@app.post("/companies/create", status_code=status.HTTP_201_CREATED)
+@router.post("/companies/create", status_code=status.HTTP_201_CREATED, response_model=schemas.CompanyOut)
 async def create_company(db: Annotated[Session, Depends(get_db)],
-                         current_user: Annotated[models.User, Depends(get_current_user)],
-                         company: Annotated[schemas.CompanyBase, Depends()]):
-    all_companies = crud.get_companies(db=db)
-    company_names = [db_company.company_name for db_company in all_companies] if len(
-        all_companies) > 0 else []
-    if company.company_name in company_names:
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                         company: schemas.CompanyBase,
+                         upsert: bool = False):
+    if upsert:
+        return await dal.upsert_company(db=db, company=company)
+    try:
+        created_company = await dal.create_company(db=db, company=company)
+    except AlreadyExistsError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=f"Company with name {company.company_name} already exists"
         )
-    created_company = crud.create_company(db=db, company=company)
     return created_company
 
 
-@app.put("/companies/update", status_code=status.HTTP_201_CREATED)
+@router.put("/companies/update", status_code=status.HTTP_201_CREATED, response_model=schemas.CompanyOut)
 async def update_company(db: Annotated[Session, Depends(get_db)],
-                         current_user: Annotated[models.User, Depends(get_current_user)],
-                         company: Annotated[schemas.CompanyUpdate, Depends()]):
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                         company: schemas.CompanyUpdate):
 
-    updated_company = crud.update_company(db=db, company=company)
+    try:
+        updated_company = await dal.update_company(db=db, company=company)
+    except AlreadyExistsError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"Company with name {company.company_name} already exists"
+        )
     if not updated_company:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Company with id {company.id} not found"
@@ -373,29 +776,35 @@ async def update_company(db: Annotated[Session, Depends(get_db)],
     return updated_company
 
 
-@app.post("/bank_accounts/create", status_code=status.HTTP_201_CREATED)
+@router.post("/bank_accounts/create", status_code=status.HTTP_201_CREATED, response_model=schemas.BankAccountOut)
 async def create_bank_account(db: Annotated[Session, Depends(get_db)],
-                              current_user: Annotated[models.User, Depends(get_current_user)],
-                              bank_account: Annotated[schemas.BankAccountBase, Depends()]):
-    all_bank_accounts = crud.get_bank_accounts(db=db)
-    bank_account_numbers = [db_bank_account.bank_account_no for db_bank_account in all_bank_accounts] if len(
-        all_bank_accounts) > 0 else []
-    if bank_account.bank_account_no in bank_account_numbers:
+                              current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                              bank_account: schemas.BankAccountBase,
+                              upsert: bool = False):
+    if upsert and bank_account.bank_account_no is not None:
+        return await dal.upsert_bank_account(db=db, bank_account=bank_account)
+    try:
+        created_bank_account = await dal.create_bank_account(
+            db=db, bank_account=bank_account)
+    except AlreadyExistsError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=f"Bank with account number {bank_account.bank_account_no} already exists"
         )
-    created_bank_account = crud.create_bank_account(
-        db=db, bank_account=bank_account)
     return created_bank_account
 
 
-@app.put("/bank_accounts/update", status_code=status.HTTP_201_CREATED)
+@router.put("/bank_accounts/update", status_code=status.HTTP_201_CREATED, response_model=schemas.BankAccountOut)
 async def update_bank_account(db: Annotated[Session, Depends(get_db)],
-                              current_user: Annotated[models.User, Depends(get_current_user)],
-                              bank_account: Annotated[schemas.BankAccountUpdate, Depends()]):
+                              current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                              bank_account: schemas.BankAccountUpdate):
 
-    updated_bank_account = crud.update_bank_account(
-        db=db, bank_account=bank_account)
+    try:
+        updated_bank_account = await dal.update_bank_account(
+            db=db, bank_account=bank_account)
+    except AlreadyExistsError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"Bank with account number {bank_account.bank_account_no} already exists"
+        )
     if not updated_bank_account:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Bank account with id {bank_account.id} not found"
@@ -403,143 +812,259 @@ async def update_bank_account(db: Annotated[Session, Depends(get_db)],
     return updated_bank_account
 
 
-@app.post("/user_bookmarks/create", status_code=status.HTTP_201_CREATED)
+@router.post("/user_bookmarks/create", status_code=status.HTTP_201_CREATED, response_model=schemas.UserBookmarkOut, response_model_exclude_unset=True)
 async def create_user_bookmark(db: Annotated[Session, Depends(get_db)],
-                               current_user: Annotated[models.User, Depends(get_current_user)],
-                               user_bookmark: Annotated[schemas.UserBookMark, Depends()]):
-
-    user_bookmarks = crud.get_bookmark(db=db, user_id=user_bookmark.user_id)
-    bookmark_products = [db_user_bookmark.product_id for db_user_bookmark in user_bookmarks] if len(
-        user_bookmarks) > 0 else []
-    if user_bookmark.product_id in bookmark_products:
+                               current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                               user_bookmark: schemas.UserBookMark):
+    try:
+        created_bookmark = await dal.create_bookmark(db=db, user_bookmark=user_bookmark)
+    except AlreadyExistsError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=f"Bookmark with product id {user_bookmark.product_id} for user with id {user_bookmark.user_id} already exists"
         )
-    created_bookmark = crud.create_bookmark(db=db, user_bookmark=user_bookmark)
     return created_bookmark
 
 
-@app.post("/invoices/create_invoice", status_code=status.HTTP_200_OK)
+@router.post("/invoices/create_invoice", status_code=status.HTTP_200_OK, response_model=schemas.InvoiceOut, response_model_exclude_unset=True)
 async def create_invoice(db: Annotated[Session, Depends(get_db)],
-                         current_user: Annotated[models.User, Depends(get_current_user)],
-                         invoice: Annotated[schemas.Invoice, Depends()]):
-    created_invoice = crud.create_invoice(db=db, invoice=invoice)
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                         invoice: schemas.Invoice):
+    created_invoice = await dal.create_invoice(db=db, invoice=invoice)
     return created_invoice
 
 
-@app.put("/invoices/update_invoice", status_code=status.HTTP_200_OK)
+@router.post("/invoices/bulk", status_code=status.HTTP_200_OK)
+async def bulk_create_invoices(db: Annotated[Session, Depends(get_db)],
+                               current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                               invoices: Annotated[list[dict], Body()],
+                               chunk_size: Annotated[int, Query(ge=1, le=bulk.BULK_CHUNK_MAX)] = bulk.BULK_CHUNK_SIZE) -> schemas.BulkResult:
+    check_bulk_size(invoices)
+    valid, errors = bulk.validate_rows(schemas.Invoice, invoices)
+    created, db_errors = await dal.bulk_create_invoices(db=db, invoices=valid, chunk_size=chunk_size)
+    return schemas.BulkResult(created=created, errors=sorted(errors + db_errors, key=lambda e: e["index"]))
+
+
+@router.post("/invoices/transition", status_code=status.HTTP_200_OK)
+async def transition_invoices(db: Annotated[Session, Depends(get_db)],
+                              current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                              transition: schemas.InvoiceTransition,
+                              chunk_size: Annotated[int, Query(ge=1, le=bulk.BULK_CHUNK_MAX)] = bulk.BULK_CHUNK_SIZE) -> schemas.InvoiceTransitionResult:
+    check_bulk_size(transition.ids)
+    updated, skipped = await dal.transition_invoices(db=db, ids=transition.ids, target=transition.status,
+                                                     chunk_size=chunk_size)
+    return schemas.InvoiceTransitionResult(updated=updated, skipped=skipped)
+
+
+@router.put("/invoices/update_invoice", status_code=status.HTTP_200_OK, response_model=schemas.InvoiceOut, response_model_exclude_unset=True)
 async def update_invoices(db: Annotated[Session, Depends(get_db)],
-                          current_user: Annotated[models.User, Depends(get_current_user)],
-                          invoice: Annotated[schemas.InvoiceUpdate, Depends()]):
-    updated_invoice = crud.update_invoice(db=db, invoice=invoice)
+                          current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                          invoice: schemas.InvoiceUpdate):
+    updated_invoice = await dal.update_invoice(db=db, invoice=invoice)
     if not updated_invoice:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=f"Invoice with id {updated_invoice.id} not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Invoice with id {invoice.id} not found"
         )
     return updated_invoice
 
 
-@app.delete("/users/remove/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/users/remove/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)],
+                      current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
                       user_id: int):
-    user_ = crud.get_user(db=db, user_id=user_id)
+    user_ = await dal.get_user(db=db, user_id=user_id)
     if not user_:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user_id} not found"
         )
 
-    deleted_user = crud.delete_user(db=db, user_id=user_id)
+    deleted_user = await dal.delete_user(db=db, user_id=user_id)
     return deleted_user
 
 
-@app.delete("/products/remove/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/products/remove/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_product(db: Annotated[Session, Depends(get_db)],
-                         current_user: Annotated[models.User, Depends(get_current_user)],
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
                          product_id: int):
-    product_ = crud.get_product(db=db, product_id=product_id)
-    if not product_:
+    # existence is checked by the delete's own query, in its transaction;
+    # the catalog cache could still hold a row that is gone
+    deleted_product = await dal.delete_product(db=db, product_id=product_id)
+    if not deleted_product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {product_id} not found"
         )
-
-    deleted_product = crud.delete_product(db=db, product_id=product_id)
     return deleted_product
 
 
-@app.delete("/companies/remove/{company_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/companies/remove/{company_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_company(db: Annotated[Session, Depends(get_db)],
-                         current_user: Annotated[models.User, Depends(get_current_user)],
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
                          company_id: int):
-    company_ = crud.get_company(db=db, company_id=company_id)
-    if not company_:
+    # existence is checked by the delete's own query, in its transaction;
+    # the catalog cache could still hold a row that is gone
+    deleted_company = await dal.delete_company(db=db, company_id=company_id)
+    if not deleted_company:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Company with id {company_id} not found"
         )
-
-    deleted_company = crud.delete_company(db=db, company_id=company_id)
     return deleted_company
 
 
-@app.delete("/product_tags/remove/{tag_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/product_tags/remove/{tag_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_product_tag(db: Annotated[Session, Depends(get_db)],
-                             current_user: Annotated[models.User, Depends(get_current_user)],
+                             current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
                              tag_id: int):
-    tag_ = crud.get_product_tag(db=db, tag_id=tag_id)
-    if not tag_:
+    # existence is checked by the delete's own query, in its transaction;
+    # the catalog cache could still hold a row that is gone
+    deleted_tag = await dal.delete_product_tag(db=db, tag_id=tag_id)
+    if not deleted_tag:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Product Tag with id {tag_id} not found"
         )
-
-    deleted_tag = crud.delete_product_tag(db=db, tag_id=tag_id)
     return deleted_tag
 
 
-@app.delete("/bookmarks/remove/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)],
-                      user_id: int):
-    user_bookmark = crud.get_bookmark(db, user_id)
-    if not user_bookmark:
+@router.delete("/bookmarks/remove/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_user_bookmark(db: Annotated[Session, Depends(get_db)],
+                               current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                               user_id: int):
+    # every bookmark of the user
+    deleted_bookmarks = await dal.delete_bookmarks(db=db, user_id=user_id)
+    if not deleted_bookmarks:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Bookmark for user with id {user_id} not found"
         )
 
-    deleted_bookmark = crud.delete_bookmark(
-        db=db, bookmark_id=user_bookmark.id)
-    return deleted_bookmark
 
-
-@app.delete("/bank_accounts/remove/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)],
-                      user_id: int):
-    user_bank_account = crud.get_bank_account(db=db, user_id=user_id)
+@router.delete("/bank_accounts/remove/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_bank_account(db: Annotated[Session, Depends(get_db)],
+                              current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                              user_id: int):
+    user_bank_account = await dal.get_bank_account(db=db, user_id=user_id)
     if not user_bank_account:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Bank account for user with id {user_id} not found"
         )
 
-    deleted_bank_account = crud.delete_bank_account(
+    deleted_bank_account = await dal.delete_bank_account(
         db=db, bank_account_id=user_bank_account.id)
     return deleted_bank_account
 
 
-@app.delete("/invoices/remove/{invoice_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(db: Annotated[Session, Depends(get_db)],
-                      current_user: Annotated[models.User, Depends(get_current_user)],
-                      invoice_id: int):
-    invoice_ = crud.get_invoice(db=db, invoice_id=invoice_id)
+@router.delete("/invoices/remove/{invoice_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_invoice(db: Annotated[Session, Depends(get_db)],
+                         current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                         invoice_id: int):
+    invoice_ = await dal.get_invoice(db=db, invoice_id=invoice_id)
     if not invoice_:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Invoice with id {invoice_id} not found"
         )
 
-    deleted_invoice = crud.delete_invoice(db=db, invoice_id=invoice_id)
+    deleted_invoice = await dal.delete_invoice(db=db, invoice_id=invoice_id)
     return deleted_invoice
 
 
+# /batch runs each operation through the handler of the matching route:
+# (op, resource) -> (handler, the parameter it takes the body or path id as)
+BATCH_OPERATIONS = {
+    ("create", "users"): (create_user, "user"),
+    ("update", "users"): (update_user, "user"),
+    ("delete", "users"): (delete_user, "user_id"),
+    ("create", "product_tags"): (create_product_tag, "product_tag"),
+    ("update", "product_tags"): (update_product_tag, "product_tag"),
+    ("delete", "product_tags"): (delete_product_tag, "tag_id"),
+    ("create", "products"): (create_product, "product"),
+    ("update", "products"): (update_product, "product"),
+    ("delete", "products"): (delete_product, "product_id"),
+    ("create", "companies"): (create_company, "company"),
+    ("update", "companies"): (update_company, "company"),
+    ("delete", "companies"): (delete_company, "company_id"),
+    ("create", "bank_accounts"): (create_bank_account, "bank_account"),
+    ("update", "bank_accounts"): (update_bank_account, "bank_account"),
+    ("delete", "bank_accounts"): (delete_bank_account, "user_id"),
+    ("create", "user_bookmarks"): (create_user_bookmark, "user_bookmark"),
+    ("delete", "user_bookmarks"): (delete_user_bookmark, "user_id"),
+    ("create", "invoices"): (create_invoice, "invoice"),
+    ("update", "invoices"): (update_invoices, "invoice"),
+    ("delete", "invoices"): (delete_invoice, "invoice_id"),
+}
+_batch_routes = {route.endpoint: route for route in router.routes}
+
+
+async def run_batch_operation(db, current_user: schemas.Principal, index: int,
+                              operation: schemas.BatchOperation) -> schemas.BatchOperationResult:
+    target = BATCH_OPERATIONS.get((operation.op, operation.resource))
+    if target is None:
+        return schemas.BatchOperationResult(index=index, status=status.HTTP_400_BAD_REQUEST,
+                                            detail=f"{operation.resource} cannot be {operation.op}d")
+    handler, param = target
+    route = _batch_routes[handler]
+    try:
+        if operation.op == "delete":
+            if operation.id is None:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="id is required")
+            value = operation.id
+        else:
+            schema = inspect.signature(handler).parameters[param].annotation
+            value = schema.model_validate(operation.data or {})
+        result = await handler(db=db, current_user=current_user, **{param: value})
+        body = None
+        if route.response_model is not None and result is not None:
+            # serialized now: later commits in the batch expire the instance
+            body = route.response_model.model_validate(result).model_dump(
+                mode="json", exclude_unset=route.response_model_exclude_unset)
+    except ValidationError as e:
+        return schemas.BatchOperationResult(index=index, status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                            detail=e.errors(include_url=False))
+    except HTTPException as e:
+        return schemas.BatchOperationResult(index=index, status=e.status_code, detail=e.detail)
+    except IntegrityError as e:
+        # e.g. a foreign key to a row that does not exist; asyncpg's own
+        # error is the cause of the adapted one
+        error = e.orig.__cause__ or e.orig
+        return schemas.BatchOperationResult(index=index, status=status.HTTP_409_CONFLICT,
+                                            detail=str(error).strip().splitlines()[0])
+    except Exception:
+        # reported like the others, so the results before it are not lost
+        logger.exception("batch operation %s (%s %s) failed", index, operation.op, operation.resource)
+        return schemas.BatchOperationResult(index=index, status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                            detail="Internal Server Error")
+    return schemas.BatchOperationResult(index=index, status=route.status_code, body=body)
+
+
+@router.post("/batch", status_code=status.HTTP_200_OK)
+async def run_batch(db: Annotated[Session, Depends(get_db)],
+                    current_user: Annotated[schemas.Principal, Depends(get_current_principal)],
+                    operations: list[schemas.BatchOperation],
+                    atomic: bool = True) -> schemas.BatchResult:
+    if len(operations) > bulk.BATCH_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {bulk.BATCH_MAX_OPERATIONS} operations per request"
+        )
+    if atomic:
+        db.info["defer_commit"] = True
+    results = []
+    for index, operation in enumerate(operations):
+        result = await run_batch_operation(db, current_user, index, operation)
+        results.append(result)
+        if result.status >= 400:
+            await dal.end_batch(db=db, commit=False)
+            if atomic:
+                # nothing was applied; report only the operation that failed
+                return schemas.BatchResult(committed=False, results=[result])
+    if atomic:
+        await dal.end_batch(db=db, commit=True)
+    return schemas.BatchResult(committed=True, results=results)
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app=app,
                 host="0.0.0.0",
-                port=APP_PORT)
+                port=APP_PORT,
+                timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
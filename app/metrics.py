@@ -0,0 +1,305 @@
+import asyncio
+import glob
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Every gunicorn worker keeps its own registry. With METRICS_DIR set each one
+# also writes its samples there and /metrics merges them, so any worker's
+# scrape reports the whole pod. Use a directory per pod (an emptyDir);
+# gunicorn.conf.py empties it on start and drops the files of exited workers.
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+# Seconds between a worker's writes: how stale the other workers' samples can be
+METRICS_WRITE_INTERVAL = float(os.getenv("METRICS_WRITE_INTERVAL", "5"))
+# Gauges whose worker values add up to the pod's; other gauges are reported
+# per worker with a "worker" label. Counters and histograms are always summed.
+SUMMED_GAUGES = frozenset({
+    "http_requests_in_flight", "db_pool_size", "db_pool_in_use", "db_pool_idle", "db_pool_overflow",
+    "login_throttle_buckets", "password_hash_in_flight",
+})
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str):
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class RouteMetrics:
+    """Everything recorded for one route, allocated once up front."""
+    __slots__ = ("labels", "latency", "statuses", "db_statements", "db_seconds")
+
+    def __init__(self, method: str, path: str):
+        self.labels = f'method="{method}",route="{path}"'
+        self.latency = Histogram()
+        self.statuses = {}
+        self.db_statements = 0
+        self.db_seconds = 0.0
+
+
+class RequestDB:
+    __slots__ = ("statements", "seconds", "started")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.started = 0.0
+
+
+_request_db: ContextVar = ContextVar("request_db", default=None)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.routes = {}
+        self.unmatched = RouteMetrics("ANY", "unmatched")
+        self.in_flight = 0
+
+    # Routes define __eq__ and are not hashable; they live as long as the
+    # app, so their id() is a stable key.
+    def _add(self, route) -> RouteMetrics:
+        methods = getattr(route, "methods", None) or {"ANY"}
+        metrics = self.routes[id(route)] = RouteMetrics(",".join(sorted(methods)), route.path)
+        return metrics
+
+    def bind(self, app):
+        for route in app.routes:
+            self._add(route)
+
+    def for_route(self, route) -> RouteMetrics:
+        if route is None:
+            return self.unmatched
+        return self.routes.get(id(route)) or self._add(route)
+
+    def render(self) -> str:
+        routes = [self.unmatched, *self.routes.values()]
+        lines = ["# HELP http_requests_in_flight Requests currently being served.",
+                 "# TYPE http_requests_in_flight gauge",
+                 f"http_requests_in_flight {self.in_flight}",
+                 "# HELP http_request_duration_seconds Request latency by route.",
+                 "# TYPE http_request_duration_seconds histogram"]
+        for m in routes:
+            if m.latency.count:
+                lines.extend(m.latency.render("http_request_duration_seconds", m.labels))
+        lines += ["# HELP http_responses_total Responses by route and status code.",
+                  "# TYPE http_responses_total counter"]
+        for m in routes:
+            lines.extend(f'http_responses_total{{{m.labels},status="{code}"}} {n}'
+                         for code, n in m.statuses.items())
+        lines += ["# HELP http_db_statements_total SQL statements executed by route.",
+                  "# TYPE http_db_statements_total counter"]
+        lines.extend(f"http_db_statements_total{{{m.labels}}} {m.db_statements}"
+                     for m in routes if m.latency.count)
+        lines += ["# HELP http_db_seconds_total Time spent executing SQL by route.",
+                  "# TYPE http_db_seconds_total counter"]
+        lines.extend(f"http_db_seconds_total{{{m.labels}}} {m.db_seconds}"
+                     for m in routes if m.latency.count)
+        return "\n".join(lines) + "\n"
+
+
+def render_samples(name: str, kind: str, help_text: str, samples) -> str:
+    """Render ``(labels, value)`` samples of one metric family."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}"
+                 for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware; the route is read from the scope after routing."""
+
+    def __init__(self, app, registry: MetricsRegistry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        db = RequestDB()
+        token = _request_db.set(db)
+        registry = self.registry
+        registry.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            registry.in_flight -= 1
+            _request_db.reset(token)
+            m = registry.for_route(scope.get("route"))
+            m.latency.observe(elapsed)
+            m.statuses[status_code] = m.statuses.get(status_code, 0) + 1
+            m.db_statements += db.statements
+            m.db_seconds += db.seconds
+
+
+def instrument_engine(engine):
+    """Count statements and DB time of ``engine`` against the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db = _request_db.get()
+        if db is not None:
+            db.started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db = _request_db.get()
+        if db is not None:
+            db.statements += 1
+            db.seconds += time.perf_counter() - db.started
+
+
+def parse(text: str) -> list:
+    """Metric families of a text exposition as ``(name, help, type, samples)``.
+
+    Samples are ``(sample_name, labels, value)``; label values may contain
+    braces (route templates), so the label set ends at the last one.
+    """
+    families = []
+    helps = {}
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name, _, help_text = line[7:].partition(" ")
+            helps[name] = help_text
+        elif line.startswith("# TYPE "):
+            name, _, kind = line[7:].partition(" ")
+            families.append((name, helps.get(name, ""), kind, []))
+        elif line and not line.startswith("#") and families:
+            series, _, value = line.rpartition(" ")
+            name, brace, labels = series.partition("{")
+            families[-1][3].append((name, labels[:labels.rfind("}")] if brace else "", float(value)))
+    return families
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def merge(texts: dict) -> str:
+    """Merge the expositions of several workers, keyed by worker id."""
+    families = {}
+    for worker, text in texts.items():
+        for name, help_text, kind, samples in parse(text):
+            _, _, _, merged = families.setdefault(name, (name, help_text, kind, {}))
+            summed = kind != "gauge" or name in SUMMED_GAUGES
+            for sample, labels, value in samples:
+                if not summed:
+                    labels = f'{labels},worker="{worker}"' if labels else f'worker="{worker}"'
+                key = (sample, labels)
+                merged[key] = merged.get(key, 0.0) + value
+    lines = []
+    for name, help_text, kind, merged in families.values():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines.extend(f"{sample}{{{labels}}} {_format(value)}" if labels else f"{sample} {_format(value)}"
+                     for (sample, labels), value in merged.items())
+    return "\n".join(lines) + "\n"
+
+
+def worker_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{pid}.prom")
+
+
+def remove_worker(directory: str, pid: int):
+    try:
+        os.remove(worker_path(directory, pid))
+    except FileNotFoundError:
+        pass
+
+
+class WorkerMetrics:
+    """This worker's share of a pod-wide /metrics.
+
+    Every METRICS_WRITE_INTERVAL the worker's exposition is written to
+    ``directory``; a scrape merges the fresh one of the worker serving it
+    with the last written by the others. Not written on a scrape, where the
+    scrape itself would show as in flight in the others' reports. Counters of a worker that exits
+    leave the sums, which Prometheus' rate() treats as a reset.
+    """
+
+    def __init__(self, directory: str, render, interval: float = METRICS_WRITE_INTERVAL):
+        self.directory = directory
+        self.render = render
+        self.interval = interval
+        self._task = None
+
+    def write(self, text: str = None):
+        path = worker_path(self.directory, os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render() if text is None else text)
+        # readers never see a half-written file
+        os.replace(tmp, path)
+
+    def collect(self, own: str) -> str:
+        """Merge ``own``, this worker's current exposition, with the others'."""
+        texts = {}
+        for path in glob.glob(os.path.join(self.directory, "*.prom")):
+            pid = os.path.basename(path)[:-len(".prom")]
+            try:
+                with open(path) as f:
+                    texts[pid] = f.read()
+            except FileNotFoundError:
+                # the worker exited in between
+                continue
+        # instead of its own, possibly older, file
+        texts[str(os.getpid())] = own
+        return merge(texts)
+
+    async def _run(self):
+        while True:
+            try:
+                self.write()
+            except OSError:
+                logger.warning("metrics: could not write to %s", self.directory, exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        remove_worker(self.directory, os.getpid())
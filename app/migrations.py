@@ -0,0 +1,153 @@
+import logging
+from datetime import datetime
+from sqlalchemy import and_, func, insert, inspect, select, text
+import analytics
+import models
+
+
+# Versioned schema changes, applied in order by "python migrations.py
+# upgrade" as a deploy step of its own; the app never issues DDL. Append new
+# versions, never edit applied ones. The baseline builds from the current
+# models, so on a fresh database later versions find their changes already
+# made and must be idempotent (IF NOT EXISTS, checkfirst=True).
+
+# pg_advisory_lock key held while migrating, so concurrent runs (one per
+# pod) apply each version once
+MIGRATIONS_LOCK_ID = 7201
+
+logger = logging.getLogger(__name__)
+
+_versions = models.SchemaMigration.__table__
+
+
+def _baseline(conn):
+    """Every table, on databases the app used to create_all at startup too."""
+    models.Base.metadata.create_all(conn)
+
+
+def _missing_indexes(conn):
+    """Indexes declared on tables that already existed, which create_all
+    skipped. Unique ones are left to version 3, which checks for duplicates
+    first."""
+    models.PG_TRGM(models.Base.metadata, conn)
+    for table in models.Base.metadata.tables.values():
+        for index in table.indexes:
+            if not index.unique:
+                index.create(conn, checkfirst=True)
+
+
+class DuplicateKeysError(Exception):
+    pass
+
+
+# Natural keys that the 409 mapping and the ON CONFLICT upserts in crud.py
+# rely on: (table, columns, name of the index created when none covers them)
+UNIQUE_KEYS = [
+    ("companies", ("company_name",), "uq_companies_company_name"),
+    ("product_tags", ("tag_name",), "uq_product_tags_tag_name"),
+    ("bank_accounts", ("bank_account_no",), "uq_bank_accounts_bank_account_no"),
+    ("user_bookmarks", ("user_id", "product_id"), "uq_user_bookmarks_user_id_product_id"),
+]
+
+
+def _is_unique(conn, table: str, columns: tuple) -> bool:
+    inspector = inspect(conn)
+    keys = [tuple(c["column_names"]) for c in inspector.get_unique_constraints(table)]
+    keys += [tuple(i["column_names"]) for i in inspector.get_indexes(table) if i["unique"]]
+    return columns in keys
+
+
+def _unique_keys(conn):
+    """Unique indexes on the natural keys of tables created before they were
+    declared. Duplicates are not merged: they are listed and the migration
+    stops, since other rows may point at either copy."""
+    for table_name, columns, name in UNIQUE_KEYS:
+        if _is_unique(conn, table_name, columns):
+            continue
+        table = models.Base.metadata.tables[table_name]
+        key = [table.c[column] for column in columns]
+        duplicates = conn.execute(
+            select(*key, func.count()).where(and_(*(c.is_not(None) for c in key)))
+            .group_by(*key).having(func.count() > 1).limit(10)).all()
+        if duplicates:
+            raise DuplicateKeysError(
+                f"{table_name} ({', '.join(columns)}) has duplicates, e.g. "
+                + "; ".join(f"{tuple(row[:-1])} x{row[-1]}" for row in duplicates)
+                + ". Merge or rename them, then run the upgrade again.")
+        conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table_name} ({', '.join(columns)})"))
+
+
+def _invoice_summary(conn):
+    """Fill invoice_summary on databases that had invoices before it existed;
+    the app only maintains it by deltas."""
+    analytics.refill(conn)
+
+
+# (version, name, apply(connection))
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "indexes missing from existing tables", _missing_indexes),
+    (3, "unique natural keys", _unique_keys),
+    (4, "invoice summary backfill", _invoice_summary),
+]
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Highest applied version, or None on a database that has never migrated."""
+    if not inspect(conn).has_table(_versions.name):
+        return None
+    return conn.execute(select(_versions.c.version).order_by(_versions.c.version.desc())).scalar()
+
+
+def upgrade(engine, target: int = HEAD) -> list:
+    """Apply the versions after the current one up to ``target``, each in
+    its own transaction; returns the versions applied."""
+    applied = []
+    with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            conn.commit()
+        try:
+            with conn.begin():
+                _versions.create(conn, checkfirst=True)
+            for version, name, apply in MIGRATIONS:
+                if version > target:
+                    break
+                with conn.begin():
+                    if version <= (current_version(conn) or 0):
+                        continue
+                    logger.info("migrating to %s: %s", version, name)
+                    apply(conn)
+                    conn.execute(insert(_versions).values(version=version, name=name,
+                                                          applied_at=datetime.now()))
+                applied.append(version)
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+                conn.commit()
+    return applied
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import database
+
+    parser = argparse.ArgumentParser(description="Apply or inspect schema migrations.")
+    parser.add_argument("command", choices=["upgrade", "current", "check"],
+                        help="check exits with status 1 unless the database is at the latest version")
+    parser.add_argument("--target", type=int, default=HEAD, help="version to upgrade to")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "upgrade":
+        applied = upgrade(database.engine, args.target)
+        print(f"applied {applied}" if applied else "already up to date")
+    else:
+        with database.engine.connect() as conn:
+            version = current_version(conn)
+        print(f"at {version}, latest {HEAD}")
+        if args.command == "check" and version != HEAD:
+            sys.exit(1)
@@ -1,10 +1,12 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, \
-    String, Float, DateTime, Select
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, \
+    String, Float, DateTime, Select, Index, DDL, event
 from sqlalchemy.orm import relationship
 from database import Base
 
 
-
+# product name search (search.py) is served by a trigram index
+PG_TRGM = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+event.listen(Base.metadata, "before_create", PG_TRGM)
 
 
 
@@ -12,7 +14,7 @@ class User(Base):
     __tablename__ = "users"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_name = Column(String, name="user_name")
+    user_name = Column(String, name="user_name", index=True)
     user_phone = Column(String, name="user_phone", unique=True)
     user_identity_code = Column(String, name="user_id_code", unique=True)
     user_email = Column(String, name="user_email", unique=True)
@@ -30,20 +32,29 @@ class User(Base):
     user_is_company = Column(Boolean, name="user_is_company", default=False)
     user_company_id = Column(Integer, ForeignKey("companies.id"), name="user_company_id", nullable=True)
     
-    bookmarks = relationship("UserBookmark", back_populates="user")
-    user_bank_account = relationship("BankAccount", back_populates="user")
+    bookmarks = relationship("UserBookmark", back_populates="user", foreign_keys="UserBookmark.user_id")
+    user_bank_account = relationship("BankAccount", back_populates="user", foreign_keys="BankAccount.user_id", uselist=False)
     invoice = relationship("Invoice", back_populates="user")
-    company = relationship("Company", back_populates="user")
+    company = relationship("Company", foreign_keys=[user_company_id])
+
+    __table_args__ = (
+        Index("ix_users_user_company_id_id", "user_company_id", "id"),
+        Index("ix_users_date_created_id", "date_created", "id"),
+    )
     
 class ProductTag(Base):
     __tablename__ = 'product_tags'
     
     id = Column(Integer, name="id", primary_key=True, index=True)
-    tag_name = Column(String, name="tag_name")
+    tag_name = Column(String, name="tag_name", unique=True)
     create_date = Column(DateTime, name="create_date")
     update_date = Column(DateTime, name="update_date")
     
     product = relationship("Product", back_populates="product_tag")
+
+    __table_args__ = (
+        Index("ix_product_tags_create_date_id", "create_date", "id"),
+    )
     
 
 
@@ -52,8 +63,8 @@ class Product(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     product_name = Column(String, name="product_name")
-    product_tag_id = Column(String, ForeignKey('product_tags.id'), name="product_tag_id")
-    product_price = Float(String, name="product_price")
+    product_tag_id = Column(Integer, ForeignKey('product_tags.id'), name="product_tag_id")
+    product_price = Column(Float, name="product_price")
     company_id = Column(Integer, ForeignKey("companies.id"), name="company_id")
     create_date = Column(DateTime, name="create_date")
     update_date = Column(DateTime, name="update_date")
@@ -61,15 +72,23 @@ class Product(Base):
     product_tag = relationship("ProductTag", back_populates="product")
     bookmarks = relationship("UserBookmark", back_populates="product")
     invoice = relationship("Invoice", back_populates="product")
+
+    __table_args__ = (
+        Index("ix_products_company_id_id", "company_id", "id"),
+        Index("ix_products_product_tag_id_id", "product_tag_id", "id"),
+        Index("ix_products_create_date_id", "create_date", "id"),
+        Index("ix_products_product_name_trgm", "product_name", postgresql_using="gin",
+              postgresql_ops={"product_name": "gin_trgm_ops"}),
+    )
     
     
 class BankAccount(Base):
     __tablename__ = "bank_accounts"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.'), name="user_id")
+    user_id = Column(Integer, ForeignKey('users.id'), name="user_id")
     bank_name = Column(String, name="bank_name", nullable=False)
-    bank_account_no = Column(String, name="bank_account_no", nullable=True)
+    bank_account_no = Column(String, name="bank_account_no", nullable=True, unique=True)
     bank_phone_number = Column(String, name="bank_phone_number", nullable=True)
     bank_address = Column(String, name="bank_address", nullable=True)
     bank_city = Column(String, name="bank_city", nullable=True)
@@ -78,7 +97,12 @@ class BankAccount(Base):
     create_date = Column(DateTime, name="create_date")
     update_date = Column(DateTime, name="update_date")
     
-    user = relationship("User", back_populates="user_bank_account")
+    user = relationship("User", back_populates="user_bank_account", foreign_keys=[user_id])
+
+    __table_args__ = (
+        Index("ix_bank_accounts_user_id_id", "user_id", "id"),
+        Index("ix_bank_accounts_create_date_id", "create_date", "id"),
+    )
 
 
 
@@ -86,7 +110,7 @@ class Company(Base):
     __tablename__ = "companies"
     
     id = Column(Integer, primary_key=True, name="id", index=True)
-    company_name = Column(String, name="company_name", nullable=False, )
+    company_name = Column(String, name="company_name", nullable=False, unique=True)
     company_address = Column(String, name="company_address", nullable=True)
     company_phone = Column(String, name="company_phone", nullable=True)
     create_date = Column(DateTime, name="create_date")
@@ -94,7 +118,12 @@ class Company(Base):
     user_id = Column(Integer, ForeignKey('users.id'), name="user_id", nullable=True)
     
     invoice = relationship("Invoice", back_populates="company")
-    user = relationship("User", back_populates="company")
+    user = relationship("User", foreign_keys=[user_id])
+
+    __table_args__ = (
+        Index("ix_companies_user_id_id", "user_id", "id"),
+        Index("ix_companies_create_date_id", "create_date", "id"),
+    )
 
 
 
@@ -107,8 +136,15 @@ class UserBookmark(Base):
     is_favorite = Column(Boolean, name="is_important", default=False)
     create_date = Column(DateTime, name="create_date")
     
-    user = relationship("User", back_populates="bookmarks")
+    user = relationship("User", back_populates="bookmarks", foreign_keys=[user_id])
     product = relationship("Product", back_populates="bookmarks")
+
+    __table_args__ = (
+        Index("ix_user_bookmarks_user_id_id", "user_id", "id"),
+        Index("uq_user_bookmarks_user_id_product_id", "user_id", "product_id", unique=True),
+        Index("ix_user_bookmarks_product_id_id", "product_id", "id"),
+        Index("ix_user_bookmarks_create_date_id", "create_date", "id"),
+    )
     
 
 
@@ -127,5 +163,71 @@ class Invoice(Base):
     product = relationship("Product", back_populates="invoice")
     user = relationship("User", back_populates="invoice")
     company = relationship("Company", back_populates="invoice")
-    
-    
\ No newline at end of file
+
+    __table_args__ = (
+        Index("ix_invoices_company_id_id", "company_id", "id"),
+        Index("ix_invoices_user_id_id", "user_id", "id"),
+        Index("ix_invoices_product_id_id", "product_id", "id"),
+        Index("ix_invoices_status_id", "status", "id"),
+        Index("ix_invoices_create_date_id", "create_date", "id"),
+    )
+
+
+class TableVersion(Base):
+    """Change counter per table, bumped in the writing transaction (etags.py)."""
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class InvoiceSummary(Base):
+    """Invoice counts per (company, product, status, lead time), kept up to
+    date in the writing transaction (analytics.py)."""
+    __tablename__ = "invoice_summary"
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, name="company_id")
+    product_id = Column(Integer, name="product_id")
+    status = Column(String, name="status")
+    # whole hours from create_date to deliver_date, NULL until delivered
+    lead_hours = Column(Integer, name="lead_hours")
+    invoice_count = Column(BigInteger, name="invoice_count", nullable=False, default=0)
+
+    __table_args__ = (
+        Index("uq_invoice_summary_key", "company_id", "product_id", "status", "lead_hours",
+              unique=True, postgresql_nulls_not_distinct=True),
+    )
+
+
+class TokenRevocation(Base):
+    """Access tokens revoked before they expire (revocations.py): one token
+    by ``jti``, or with no ``jti`` every token of the user issued before
+    ``revoked_at``. Times are epoch seconds, like the tokens' claims."""
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, name="user_id", nullable=False)
+    jti = Column(String, name="jti")
+    revoked_at = Column(Float, name="revoked_at", nullable=False, index=True)
+    # once every token it covers has expired the row can go
+    expires_at = Column(Float, name="expires_at", nullable=False, index=True)
+
+
+class RateLimitBucket(Base):
+    """Token buckets of the shared login throttle (throttling.py)."""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, name="tokens", nullable=False)
+    # epoch seconds by the database clock
+    updated_at = Column(Float, name="updated_at", nullable=False, index=True)
+
+
+class SchemaMigration(Base):
+    """Schema versions applied by migrations.py."""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, name="name", nullable=False)
+    applied_at = Column(DateTime, name="applied_at", nullable=False)
@@ -0,0 +1,106 @@
+import base64
+import json
+import os
+from datetime import datetime
+from fastapi import HTTPException, status
+from sqlalchemy import or_, select, tuple_
+import models
+
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Tables without a create_date column sort and filter on this one instead
+DATE_COLUMNS = {models.User: models.User.date_created}
+
+
+def date_column(model):
+    return DATE_COLUMNS.get(model, getattr(model, "create_date", None))
+
+
+def _sort_columns(model, sort: str):
+    if sort.lstrip("-") == "create_date":
+        return (date_column(model), model.id)
+    return (model.id,)
+
+
+def encode_cursor(sort: str, values) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps({"s": sort, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(sort: str, cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if data["s"] != sort:
+            raise ValueError("cursor was issued for a different sort")
+        values = data["v"]
+        by_date = sort.lstrip("-") == "create_date"
+        if not isinstance(values, list) or len(values) != (2 if by_date else 1):
+            raise ValueError("cursor has the wrong number of values")
+        if type(values[-1]) is not int:
+            raise ValueError("cursor id is not an integer")
+        # rows without a date carry a null one
+        if by_date and values[0] is not None:
+            values[0] = datetime.fromisoformat(values[0])
+        return values
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+def apply_filters(stmt, model, filters=None):
+    """Restrict ``stmt`` by a schemas.*Filter.
+
+    ``created_after``/``created_before`` bound the model's date column and
+    every other set field must equal the column of the same name.
+    """
+    for name, value in (filters.model_dump(exclude_none=True) if filters else {}).items():
+        if name == "created_after":
+            stmt = stmt.where(date_column(model) >= value)
+        elif name == "created_before":
+            stmt = stmt.where(date_column(model) < value)
+        else:
+            stmt = stmt.where(getattr(model, name) == value)
+    return stmt
+
+
+def _after(columns, values, descending: bool):
+    """Rows past the cursor ``values`` in page_query's order.
+
+    Rows without a date sort last ascending and first descending (Postgres'
+    defaults, which the (date, id) indexes serve); a row comparison never
+    matches them, so they are added or skipped explicitly.
+    """
+    if len(columns) == 1:
+        return columns[0] < values[0] if descending else columns[0] > values[0]
+    date, id_ = columns
+    last_date, last_id = values
+    if last_date is None:
+        undated = date.is_(None) & (id_ < last_id if descending else id_ > last_id)
+        return or_(undated, date.is_not(None)) if descending else undated
+    key, last = tuple_(date, id_), tuple_(last_date, last_id)
+    return key < last if descending else or_(key > last, date.is_(None))
+
+
+def page_query(model, page, filters=None):
+    stmt = apply_filters(select(model), model, filters)
+    columns = _sort_columns(model, page.sort)
+    descending = page.sort.startswith("-")
+    if page.cursor:
+        stmt = stmt.where(_after(columns, decode_cursor(page.sort, page.cursor), descending))
+    order = [c.desc() if descending else c.asc() for c in columns]
+    if len(order) > 1:
+        order[0] = order[0].nulls_first() if descending else order[0].nulls_last()
+    return stmt.order_by(*order).limit(page.limit)
+
+
+def next_cursor(model, page, items):
+    if len(items) < page.limit:
+        return None
+    last = items[-1]
+    columns = _sort_columns(model, page.sort)
+    return encode_cursor(page.sort, [getattr(last, c.key) for c in columns])
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+
+
+class PrincipalCache:
+    """TTL + LRU cache of resolved users, keyed by the JWT ``sub`` claim.
+
+    Cached users are detached from their session, so only column attributes
+    are safe to read from them. Invalidation is per process; the TTL bounds
+    how long another worker can serve a stale entry.
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+
+    def set(self, key: str, user):
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries),
+                    "hits": self.hits,
+                    "misses": self.misses}
+
+
+principal_cache = PrincipalCache()
+
+
+def invalidate_on_commit(session, *keys: str):
+    """Drop ``keys`` from the principal cache once ``session`` (sync or async)
+    commits; dropped earlier, a concurrent request could cache the old row again."""
+    session.info.setdefault("principal_cache_invalidations", set()).update(keys)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    keys = session.info.pop("principal_cache_invalidations", None)
+    if keys:
+        principal_cache.invalidate(*keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("principal_cache_invalidations", None)
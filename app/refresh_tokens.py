@@ -0,0 +1,43 @@
+import hashlib
+import secrets
+from datetime import datetime, timedelta, timezone
+from jwt.exceptions import InvalidTokenError
+import jwt_keys
+
+
+# Refresh tokens are JWTs for this audience, signed by the same key ring as
+# access tokens; jwt_keys.decode() without it rejects them, so they never
+# pass as access tokens.
+REFRESH_AUDIENCE = "refresh"
+
+
+def new_family() -> str:
+    """Id shared by a login's refresh token and every token rotated from it."""
+    return secrets.token_urlsafe(9)
+
+
+def issue(user_id: int, family: str) -> tuple:
+    """A new refresh token and the value to store in ``users.last_login_token``."""
+    now = datetime.now(timezone.utc)
+    token = jwt_keys.encode({"sub": str(user_id), "aud": REFRESH_AUDIENCE, "fam": family,
+                             "jti": secrets.token_urlsafe(12), "iat": now,
+                             "exp": now + timedelta(days=jwt_keys.REFRESH_TOKEN_EXPIRE_DAYS)})
+    return token, stored_value(family, token)
+
+
+def stored_value(family: str, token: str) -> str:
+    # a plain digest is enough: the token is long and random, unlike a password
+    return f"{family}:{hashlib.sha256(token.encode()).hexdigest()}"
+
+
+def decode(token: str) -> tuple:
+    """``(user_id, family)`` of a refresh token we signed; raises InvalidTokenError."""
+    claims = jwt_keys.decode(token, audience=REFRESH_AUDIENCE)
+    try:
+        return int(claims["sub"]), claims["fam"]
+    except (KeyError, ValueError) as e:
+        raise InvalidTokenError("malformed refresh token") from e
+
+
+def same_family(stored: str, family: str) -> bool:
+    return stored is not None and stored.split(":", 1)[0] == family
@@ -0,0 +1,137 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+import database
+
+
+# Replicas further behind the primary than this are not read from
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+# After a write, the client reads from the primary for this long; it should
+# exceed DB_REPLICA_MAX_LAG plus one check interval
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+
+# Cookie and header carrying the "read from the primary until" epoch seconds
+PRIMARY_UNTIL_COOKIE = "primary_until"
+PRIMARY_UNTIL_HEADER = "X-Primary-Until"
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# NULL on a primary, 0 while WAL replay is caught up, otherwise the age of
+# the last replayed commit
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN NULL "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+logger = logging.getLogger(__name__)
+
+
+class Replica:
+    def __init__(self, name: str, engine, check_engine):
+        self.name = name
+        # what sessions bind to (the async engine's sync_engine in async mode)
+        self.engine = engine
+        self.check_engine = check_engine
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+
+
+class ReplicaSet:
+    """Round-robin over the replicas that passed their last health check."""
+
+    def __init__(self, replicas: list):
+        self.replicas = replicas
+        self._next = itertools.count()
+        self._task = None
+
+    def pick(self):
+        """A healthy replica's engine, or None to use the primary."""
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)].engine
+
+    def check(self, replica: Replica):
+        try:
+            with replica.check_engine.connect() as conn:
+                lag = conn.execute(LAG_QUERY).scalar()
+            replica.lag = float(lag) if lag is not None else None
+            # a NULL lag means the server is not in recovery, i.e. not a replica
+            healthy = replica.lag is not None and replica.lag <= DB_REPLICA_MAX_LAG
+        except Exception:
+            logger.warning("replica %s failed its health check", replica.name, exc_info=True)
+            healthy = False
+        if healthy != replica.healthy:
+            logger.warning("replica %s is now %s", replica.name, "healthy" if healthy else "out of rotation")
+        replica.healthy = healthy
+        replica.checked_at = time.time()
+
+    def check_all(self):
+        for replica in self.replicas:
+            self.check(replica)
+
+    async def _run(self):
+        while True:
+            await run_in_threadpool(self.check_all)
+            await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+    def start(self):
+        if self.replicas and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> list:
+        return [{"replica": r.name, "healthy": r.healthy, "lag_seconds": r.lag,
+                 "checked_at": r.checked_at} for r in self.replicas]
+
+
+def _replicas() -> list:
+    hosts = database.POSTGRES_REPLICA_HOSTS
+    if database.DB_MODE == "async":
+        engines = [e.sync_engine for e in database.async_replica_engines]
+    else:
+        engines = database.replica_engines
+    return [Replica(host, engine, check) for host, engine, check
+            in zip(hosts, engines, database.replica_engines)]
+
+
+replica_set = ReplicaSet(_replicas())
+
+
+def primary_until(request) -> float:
+    value = request.headers.get(PRIMARY_UNTIL_HEADER) or request.cookies.get(PRIMARY_UNTIL_COOKIE)
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+def read_replica(request):
+    """Engine to read from for ``request``, or None for the primary.
+
+    Only read requests use replicas, and not while the client is inside its
+    read-your-writes window.
+    """
+    if request.method not in READ_METHODS or primary_until(request) > time.time():
+        return None
+    return replica_set.pick()
+
+
+def start_read_your_writes(response):
+    """Pin the client's reads to the primary for the next few seconds."""
+    if not replica_set.replicas:
+        return
+    until = f"{time.time() + DB_READ_YOUR_WRITES_SECONDS:.3f}"
+    response.set_cookie(PRIMARY_UNTIL_COOKIE, until, max_age=int(DB_READ_YOUR_WRITES_SECONDS) + 1,
+                        httponly=True, samesite="lax")
+    response.headers[PRIMARY_UNTIL_HEADER] = until
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import catalog_cache
+import jwt_keys
+import models
+
+
+# "stateless" trusts the user id in the token and only checks it against
+# the revocation list; "lookup" loads the user on every request
+AUTH_MODE = os.getenv("AUTH_MODE", "stateless")
+TOKEN_REVOCATION_SYNC_INTERVAL = float(os.getenv("TOKEN_REVOCATION_SYNC_INTERVAL", "5"))
+# Each sync re-reads this many seconds before the last one, for
+# transactions that committed after it ran
+TOKEN_REVOCATION_SYNC_OVERLAP = 60
+TOKEN_REVOCATION_PURGE_INTERVAL = 600
+TOKEN_REVOCATIONS_NAMESPACE = "token_revocations"
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationList:
+    """Revocations of tokens that have not expired yet, private to this process.
+
+    Revocations made here apply on commit and reach the other workers through
+    the catalog cache bus; the periodic sync from the table catches whatever
+    the bus missed. Both paths apply the same entries, so repeats are harmless.
+    """
+
+    def __init__(self, interval: float = TOKEN_REVOCATION_SYNC_INTERVAL):
+        self.interval = interval
+        # user id -> (tokens issued before this are revoked, row expiry)
+        self._users = {}
+        # jti -> row expiry
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._since = None
+        self._purged_at = None
+        self._task = None
+        self.synced_at = None
+
+    @property
+    def fresh(self) -> bool:
+        """Synced recently enough to stand in for a lookup of the user."""
+        return self.synced_at is not None and time.monotonic() - self.synced_at < 3 * self.interval
+
+    def apply(self, entries):
+        """Apply ``[user_id, jti, revoked_at, expires_at]`` entries."""
+        with self._lock:
+            for user_id, jti, revoked_at, expires_at in entries:
+                if jti is not None:
+                    self._tokens[jti] = expires_at
+                elif revoked_at > self._users.get(user_id, (float("-inf"),))[0]:
+                    self._users[user_id] = (revoked_at, expires_at)
+
+    def prune(self, now: float):
+        with self._lock:
+            self._users = {k: v for k, v in self._users.items() if v[1] > now}
+            self._tokens = {k: v for k, v in self._tokens.items() if v > now}
+
+    def is_revoked(self, user_id: int, jti: str = None, issued_at: float = None) -> bool:
+        if jti is not None and jti in self._tokens:
+            return True
+        revoked = self._users.get(user_id)
+        return revoked is not None and (issued_at is None or issued_at < revoked[0])
+
+    def sync(self):
+        import crud
+        import database
+        started = time.time()
+        with database.SessionLocal() as db:
+            if self._purged_at is None or started - self._purged_at >= TOKEN_REVOCATION_PURGE_INTERVAL:
+                crud.purge_token_revocations(db, now=started)
+                self._purged_at = started
+            rows = crud.get_token_revocations(db, since=self._since, now=started)
+        self.apply(rows)
+        self.prune(started)
+        self._since = started - TOKEN_REVOCATION_SYNC_OVERLAP
+        self.synced_at = time.monotonic()
+
+    async def _run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.sync)
+            except Exception:
+                # stale lists fall back to looking the user up
+                logger.exception("token revocations: sync failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"users": len(self._users),
+                "tokens": len(self._tokens),
+                "age_seconds": round(time.monotonic() - self.synced_at, 3) if self.synced_at else None}
+
+
+revocation_list = RevocationList()
+catalog_cache.bus.subscribe(TOKEN_REVOCATIONS_NAMESPACE, revocation_list.apply)
+
+
+def revoke(session, user_id: int, jti: str = None, expires_at: float = None):
+    """Revoke token ``jti``, or every token of ``user_id`` issued so far,
+    when ``session`` (sync or async) commits."""
+    now = time.time()
+    if expires_at is None:
+        expires_at = now + jwt_keys.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    session.add(models.TokenRevocation(user_id=user_id, jti=jti, revoked_at=now, expires_at=expires_at))
+    session.info.setdefault("token_revocations", []).append([user_id, jti, now, expires_at])
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    entries = session.info.pop("token_revocations", None)
+    if entries:
+        catalog_cache.bus.publish(TOKEN_REVOCATIONS_NAMESPACE, entries)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("token_revocations", None)
@@ -1,5 +1,7 @@
-from typing import Union
-from pydantic import BaseModel
+from datetime import datetime
+from typing import ClassVar, Literal, Union
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from pagination import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
 
 
 class BankAccountBase(BaseModel):
@@ -44,7 +46,7 @@ class CompanyUpdate(CompanyBase):
 
 class ProductBase(BaseModel):
     product_name: str
-    product_price: Union[str, float, int]
+    product_price: float
     product_tag_id: int
     company_id: int
 
@@ -83,10 +85,269 @@ class InvoiceUpdate(Invoice):
     id: int
 
 
+class BulkCreated(BaseModel):
+    index: int
+    id: int
+
+
+class BulkError(BaseModel):
+    index: int
+    detail: Union[str, list]
+
+
+class BulkResult(BaseModel):
+    created: list[BulkCreated]
+    errors: list[BulkError]
+
+
+class InvoiceTransition(BaseModel):
+    ids: list[int]
+    status: Literal["shipped", "delivered"]
+
+
+class InvoiceSkipped(BaseModel):
+    id: int
+    detail: str
+
+
+class InvoiceTransitionResult(BaseModel):
+    updated: list[int]
+    skipped: list[InvoiceSkipped]
+
+
+class BatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    resource: Literal["users", "product_tags", "products", "companies",
+                      "bank_accounts", "user_bookmarks", "invoices"]
+    # the request body of the matching create/update route
+    data: Union[dict, None] = None
+    # the path id of the matching delete route
+    id: Union[int, None] = None
+
+
+class BatchOperationResult(BaseModel):
+    index: int
+    status: int
+    body: Union[dict, None] = None
+    detail: Union[str, list, None] = None
+
+
+class BatchResult(BaseModel):
+    committed: bool
+    results: list[BatchOperationResult]
+
+
+class ORMModel(BaseModel):
+    """Response schema read straight from ORM attributes."""
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ExpandableModel(ORMModel):
+    """Response schema whose ``relationships`` are only included when they
+    were eager loaded (see loading.py), so serializing never lazy loads."""
+    relationships: ClassVar[tuple] = ()
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _loaded_relationships(cls, data, handler):
+        state = getattr(data, "_sa_instance_state", None)
+        if state is None:
+            return handler(data)
+        # Validate from the instance dict, where relationships that weren't
+        # loaded are simply absent; only expired or unset columns need getattr.
+        loaded = state.dict
+        missing = cls.model_fields.keys() - loaded.keys() - set(cls.relationships)
+        if missing:
+            loaded = {**loaded, **{name: getattr(data, name) for name in missing}}
+        return handler(loaded)
+
+
+class ProductTagOut(ORMModel):
+    id: int
+    tag_name: Union[str, None]
+    create_date: Union[datetime, None]
+    update_date: Union[datetime, None]
+
+
+class CompanyOut(ORMModel):
+    id: int
+    company_name: str
+    company_address: Union[str, None]
+    company_phone: Union[str, None]
+    user_id: Union[int, None]
+    create_date: Union[datetime, None]
+    update_date: Union[datetime, None]
+
+
+class ProductOut(ORMModel):
+    id: int
+    product_name: Union[str, None]
+    product_tag_id: Union[int, None]
+    product_price: Union[float, None]
+    company_id: Union[int, None]
+    create_date: Union[datetime, None]
+    update_date: Union[datetime, None]
+
+
+class ProductSuggestion(BaseModel):
+    id: int
+    product_name: str
+    product_tag_id: Union[int, None]
+    company_id: Union[int, None]
+
+
+class BankAccountOut(ORMModel):
+    id: int
+    user_id: Union[int, None]
+    bank_name: str
+    bank_account_no: Union[str, None]
+    bank_phone_number: Union[str, None]
+    bank_address: Union[str, None]
+    bank_city: Union[str, None]
+    bank_province: Union[str, None]
+    bank_card_no: Union[str, None]
+    create_date: Union[datetime, None]
+    update_date: Union[datetime, None]
+
+
+class UserBookmarkOut(ExpandableModel):
+    relationships: ClassVar[tuple] = ("product", "user")
+
+    id: int
+    user_id: Union[int, None]
+    product_id: Union[int, None]
+    is_favorite: Union[bool, None]
+    create_date: Union[datetime, None]
+    product: Union[ProductOut, None] = None
+    user: Union["UserOut", None] = None
+
+
+class UserOut(ExpandableModel):
+    """Public view of a user: no password hash and no login/reset tokens."""
+    relationships: ClassVar[tuple] = ("company", "user_bank_account", "bookmarks")
+
+    id: int
+    user_name: Union[str, None]
+    user_phone: Union[str, None]
+    user_identity_code: Union[str, None]
+    user_email: Union[str, None]
+    user_address: Union[str, None]
+    user_is_company: Union[bool, None]
+    user_company_id: Union[int, None]
+    user_bookmark_id: Union[int, None]
+    user_bank_account_id: Union[int, None]
+    last_login: Union[datetime, None]
+    date_created: Union[datetime, None]
+    date_updated: Union[datetime, None]
+    company: Union[CompanyOut, None] = None
+    user_bank_account: Union[BankAccountOut, None] = None
+    bookmarks: Union[list[UserBookmarkOut], None] = None
+
+
+class InvoiceOut(ExpandableModel):
+    relationships: ClassVar[tuple] = ("product", "user", "company")
+
+    id: int
+    product_id: Union[int, None]
+    user_id: Union[int, None]
+    company_id: Union[int, None]
+    status: Union[str, None]
+    create_date: Union[datetime, None]
+    deliver_date: Union[datetime, None]
+    product: Union[ProductOut, None] = None
+    user: Union[UserOut, None] = None
+    company: Union[CompanyOut, None] = None
+
+
+UserBookmarkOut.model_rebuild()
+
+
+class CompanyVolume(BaseModel):
+    company_id: Union[int, None]
+    invoices: int
+    by_status: dict[str, int]
+
+
+class ProductVolume(BaseModel):
+    product_id: Union[int, None]
+    invoices: int
+    by_status: dict[str, int]
+
+
+class LeadTimeStats(BaseModel):
+    delivered: int
+    p50_hours: Union[int, None]
+    p90_hours: Union[int, None]
+    p95_hours: Union[int, None]
+    p99_hours: Union[int, None]
+    max_hours: Union[int, None]
+
+
+class InvoiceAnalyticsOut(BaseModel):
+    total: int
+    by_status: dict[str, int]
+    companies: list[CompanyVolume]
+    products: list[ProductVolume]
+    lead_time: LeadTimeStats
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
 
 
 class TokenData(BaseModel):
-    username: str | None = None
\ No newline at end of file
+    username: str | None = None
+
+
+class Principal(BaseModel):
+    """The authenticated user as far as the access token tells."""
+    id: int
+    username: str
+    jti: str | None = None
+    expires_at: float | None = None
+
+
+class PageParams(BaseModel):
+    limit: int = Field(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX)
+    cursor: Union[str, None] = None
+    sort: Literal["id", "-id", "create_date", "-create_date"] = "id"
+
+
+class DateRangeFilter(BaseModel):
+    created_after: Union[datetime, None] = None
+    created_before: Union[datetime, None] = None
+
+
+class UserFilter(DateRangeFilter):
+    user_company_id: Union[int, None] = None
+
+
+class ProductTagFilter(DateRangeFilter):
+    pass
+
+
+class CompanyFilter(DateRangeFilter):
+    user_id: Union[int, None] = None
+
+
+class ProductFilter(DateRangeFilter):
+    company_id: Union[int, None] = None
+    product_tag_id: Union[int, None] = None
+
+
+class InvoiceFilter(DateRangeFilter):
+    company_id: Union[int, None] = None
+    user_id: Union[int, None] = None
+    product_id: Union[int, None] = None
+    status: Union[str, None] = None
+
+
+class BankAccountFilter(DateRangeFilter):
+    user_id: Union[int, None] = None
+
+
+class UserBookmarkFilter(DateRangeFilter):
+    user_id: Union[int, None] = None
+    product_id: Union[int, None] = None
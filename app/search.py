@@ -0,0 +1,210 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import catalog_cache
+import models
+
+
+AUTOCOMPLETE_LIMIT_DEFAULT = int(os.getenv("AUTOCOMPLETE_LIMIT_DEFAULT", "10"))
+AUTOCOMPLETE_LIMIT_MAX = int(os.getenv("AUTOCOMPLETE_LIMIT_MAX", "50"))
+# Backstop for writes the index was not told about (e.g. another worker
+# with CATALOG_CACHE_BUS=local): the whole index is reloaded this often.
+PRODUCT_INDEX_MAX_AGE = float(os.getenv("PRODUCT_INDEX_MAX_AGE", "300"))
+# Larger change sets are not relayed entry by entry; workers reload instead
+PRODUCT_INDEX_PUBLISH_MAX = 50
+PRODUCT_INDEX_NAMESPACE = "product_index"
+
+logger = logging.getLogger(__name__)
+
+
+def like_pattern(q: str, match: str) -> str:
+    q = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{q}%" if match == "prefix" else f"%{q}%"
+
+
+def _word_keys(name: str):
+    """One key per word start, so "pho" completes "Smart Phone Stand"."""
+    folded = name.casefold()
+    words = folded.split()
+    start = 0
+    for word in words:
+        start = folded.index(word, start)
+        yield folded[start:]
+        start += len(word)
+
+
+class ProductIndex:
+    """Sorted word-prefix keys of every product name, private to this process.
+
+    Lookups are a bisect plus a short scan and updates an insort, so both
+    run under one lock; only a full reload builds a new list.
+    """
+
+    def __init__(self, max_age: float = PRODUCT_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._keys = []
+        self._items = {}
+        self._lock = threading.Lock()
+        self._reloading = threading.Lock()
+        self.loaded_at = None
+        self.stale = True
+        self.generation = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def needs_reload(self) -> bool:
+        return self.stale or time.monotonic() - self.loaded_at >= self.max_age
+
+    def load(self, rows, generation: int = None):
+        """Replace the index with ``rows`` of ``(id, name, tag_id, company_id)``.
+
+        Rows read before a change that arrived meanwhile (``generation``
+        moved on) are installed but leave the index stale.
+        """
+        items = {row[0]: tuple(row[1:]) for row in rows}
+        keys = sorted((key, id_) for id_, (name, *_) in items.items() if name
+                      for key in _word_keys(name))
+        with self._lock:
+            self._keys, self._items = keys, items
+            self.loaded_at = time.monotonic()
+            self.stale = generation is not None and generation != self.generation
+
+    def apply(self, entries):
+        """Apply ``[id, name, tag_id, company_id]`` entries; a None name
+        deletes. ``entries`` None marks the whole index stale."""
+        with self._lock:
+            self.generation += 1
+            if entries is None:
+                self.stale = True
+                return
+            keys, items = self._keys, self._items
+            for id_, *values in entries:
+                old = items.pop(id_, None)
+                if old and old[0]:
+                    for key in _word_keys(old[0]):
+                        del keys[bisect_left(keys, (key, id_))]
+                if values[0] is not None:
+                    items[id_] = tuple(values)
+                    for key in _word_keys(values[0]):
+                        insort(keys, (key, id_))
+
+    def complete(self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT_DEFAULT,
+                 product_tag_id: int = None, company_id: int = None) -> list:
+        prefix = prefix.casefold()
+        with self._lock:
+            return self._complete(prefix, limit, product_tag_id, company_id)
+
+    def _complete(self, prefix, limit, product_tag_id, company_id):
+        keys, items = self._keys, self._items
+        found = {}
+        for i in range(bisect_left(keys, (prefix,)), len(keys)):
+            key, id_ = keys[i]
+            if not key.startswith(prefix):
+                break
+            if id_ in found:
+                continue
+            item = items.get(id_)
+            if item is None or (product_tag_id is not None and item[1] != product_tag_id) \
+                    or (company_id is not None and item[2] != company_id):
+                continue
+            found[id_] = {"id": id_, "product_name": item[0],
+                          "product_tag_id": item[1], "company_id": item[2]}
+            if len(found) == limit:
+                break
+        return list(found.values())
+
+    def reload(self, fetch):
+        """Reload from ``fetch()`` unless another reload is running.
+
+        Before the first load there is nothing to serve, so callers wait for
+        the running load instead.
+        """
+        first = not self.loaded
+        if not self._reloading.acquire(blocking=first):
+            return
+        try:
+            if first and self.loaded:
+                return
+            generation = self.generation
+            self.load(fetch(), generation)
+        finally:
+            self._reloading.release()
+
+    def reload_in_background(self, fetch):
+        if self._reloading.locked():
+            return
+
+        def run():
+            try:
+                self.reload(fetch)
+            except Exception:
+                logger.exception("product index: reload failed")
+
+        threading.Thread(target=run, name="product-index-reload", daemon=True).start()
+
+    def stats(self) -> dict:
+        return {"products": len(self._items),
+                "keys": len(self._keys),
+                "age_seconds": round(time.monotonic() - self.loaded_at, 3) if self.loaded else None,
+                "stale": self.stale}
+
+
+product_index = ProductIndex()
+catalog_cache.bus.subscribe(PRODUCT_INDEX_NAMESPACE, product_index.apply)
+
+
+def fetch_products():
+    import crud
+    import database
+    with database.SessionLocal() as db:
+        return crud.get_product_index_rows(db)
+
+
+def mark_reload(session: Session):
+    """Have every worker reload the index once ``session`` commits."""
+    session.info["product_index_changes"] = None
+
+
+# Same hooks as the catalog cache: flushed products are relayed entry by
+# entry after commit, set-based statements make every worker reload.
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    changes = session.info.setdefault("product_index_changes", {})
+    if changes is None:
+        return
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, models.Product):
+            changes[obj.id] = [obj.id, obj.product_name, obj.product_tag_id, obj.company_id]
+    for obj in session.deleted:
+        if isinstance(obj, models.Product):
+            changes[obj.id] = [obj.id, None, None, None]
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed(orm_execute_state):
+    state = orm_execute_state
+    if (state.is_insert or state.is_update or state.is_delete) and state.bind_mapper is not None \
+            and state.bind_mapper.local_table is models.Product.__table__:
+        mark_reload(state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    if "product_index_changes" not in session.info:
+        return
+    changes = session.info.pop("product_index_changes")
+    if changes is None or len(changes) > PRODUCT_INDEX_PUBLISH_MAX:
+        catalog_cache.bus.publish(PRODUCT_INDEX_NAMESPACE, None)
+    elif changes:
+        catalog_cache.bus.publish(PRODUCT_INDEX_NAMESPACE, list(changes.values()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("product_index_changes", None)
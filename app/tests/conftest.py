@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import crud
+import migrations
+import schemas
+from database import RoutingSession
+from hashing import PasswordHasher
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    import database
+    import dal
+    import main
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db", connect_args={"check_same_thread": False})
+    migrations.upgrade(engine)
+    session_factory = sessionmaker(class_=RoutingSession, autoflush=False, bind=engine)
+    # the autocomplete index reloads through it after product writes
+    monkeypatch.setattr(database, "SessionLocal", session_factory)
+    monkeypatch.setattr(main, "password_hasher", PasswordHasher(workers=0))
+
+    def get_db():
+        with session_factory() as db:
+            yield db
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    main.app.dependency_overrides[main.get_current_principal] = lambda: schemas.Principal(id=1, username="admin")
+    yield TestClient(main.app), dal
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def seeded(client):
+    """The client, over one row of every table plus a second, shipped invoice."""
+    import database
+    with database.SessionLocal() as db:
+        user = crud.create_user(db, schemas.UserCreate(
+            username="alice", password="secret", user_phone="1", user_identity_code="1",
+            user_email="alice@example.com", user_address="1 Main St"))
+        company = crud.create_company(db, schemas.CompanyBase(
+            company_name="Acme", company_address="1 Main St", company_phone="1", user_id=user.id))
+        tag = crud.create_product_tag(db, schemas.ProductTag(tag_name="chairs"))
+        product = crud.create_product(db, schemas.ProductBase(
+            product_name="chair", product_price=9.5, product_tag_id=tag.id, company_id=company.id))
+        crud.create_bank_account(db, schemas.BankAccountBase(
+            bank_name="Bank", bank_account_no="1", bank_phone_number=None, bank_address=None,
+            bank_city=None, bank_province=None, bank_card_no=None, user_id=user.id))
+        crud.create_bookmark(db, schemas.UserBookMark(id=0, user_id=user.id, product_id=product.id,
+                                                      is_favorite=True))
+        for status in ("approved", "shipped"):
+            crud.create_invoice(db, schemas.Invoice(product_id=product.id, user_id=user.id,
+                                                    company_id=company.id, status=status))
+    return client
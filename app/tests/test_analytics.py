@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+import analytics
+import crud
+import migrations
+import schemas
+from database import RoutingSession
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    migrations.upgrade(engine)
+    with RoutingSession(bind=engine) as session:
+        yield session
+
+
+def summary(db):
+    return sorted(db.execute(analytics.summary_query()).all(), key=repr)
+
+
+def test_lead_hours_rounds_down_and_is_none_until_delivered():
+    created = datetime(2024, 1, 1)
+    assert analytics.lead_hours(created, None) is None
+    assert analytics.lead_hours(created, created + timedelta(hours=5, minutes=59)) == 5
+    assert analytics.lead_hours(created, created - timedelta(hours=1)) == 0
+
+
+def test_summarize_counts_volumes_and_lead_time_percentiles():
+    rows = [(1, 10, "approved", None, 3),
+            (1, 10, "delivered", 24, 2),
+            (1, 11, "delivered", 48, 1),
+            (2, 12, "shipped", None, 4),
+            (2, 12, "delivered", 2, 5),
+            (3, 13, None, None, 1)]
+    summary = analytics.summarize(rows, top=2)
+
+    assert summary["total"] == 16
+    assert summary["by_status"] == {"approved": 3, "delivered": 8, "shipped": 4, "unknown": 1}
+    assert summary["companies"] == [
+        {"company_id": 2, "invoices": 9, "by_status": {"delivered": 5, "shipped": 4}},
+        {"company_id": 1, "invoices": 6, "by_status": {"approved": 3, "delivered": 3}},
+    ]
+    assert [p["product_id"] for p in summary["products"]] == [12, 10]
+
+    lead_times = np.repeat([24, 48, 2], [2, 1, 5])
+    expected = np.percentile(lead_times, analytics.PERCENTILES, method="inverted_cdf")
+    lead_time = summary["lead_time"]
+    assert lead_time["delivered"] == 8
+    assert [lead_time[f"p{q}_hours"] for q in analytics.PERCENTILES] == expected.tolist()
+    assert lead_time["max_hours"] == 48
+
+
+def test_summarize_empty():
+    summary = analytics.summarize([])
+    assert summary["total"] == 0
+    assert summary["companies"] == []
+    assert summary["lead_time"]["delivered"] == 0
+    assert summary["lead_time"]["p99_hours"] is None
+
+
+def test_lead_time_ignores_rows_that_went_negative():
+    # deltas on invoices written before the summary was backfilled
+    rows = [(1, 10, "delivered", 3, 2), (1, 10, "delivered", 7, -5), (1, 10, "delivered", 9, 0)]
+    lead_time = analytics.summarize(rows)["lead_time"]
+    assert lead_time["delivered"] == 2
+    assert lead_time["p99_hours"] == lead_time["max_hours"] == 3
+
+
+def test_invoice_writes_keep_the_summary_current(db):
+    first = crud.create_invoice(db, schemas.Invoice(product_id=2, user_id=3, company_id=1))
+    crud.create_invoice(db, schemas.Invoice(product_id=2, user_id=3, company_id=1))
+    assert summary(db) == [(1, 2, "approved", None, 2)]
+
+    crud.update_invoice(db, schemas.InvoiceUpdate(id=first.id, product_id=4, user_id=3, company_id=1))
+    assert summary(db) == [(1, 2, "approved", None, 1), (1, 4, "approved", None, 1)]
+
+    assert crud.transition_invoices(db, [first.id], "shipped") == ([first.id], [])
+    assert summary(db) == [(1, 2, "approved", None, 1), (1, 4, "shipped", None, 1)]
+
+    crud.transition_invoices(db, [first.id], "delivered")
+    assert summary(db) == [(1, 2, "approved", None, 1), (1, 4, "delivered", 0, 1)]
+
+    crud.delete_invoice(db, first.id)
+    assert summary(db) == [(1, 2, "approved", None, 1)]
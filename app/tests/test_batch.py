@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import create_engine, func, select
+import crud
+import migrations
+import models
+import schemas
+from database import RoutingSession
+
+
+def count_tags(db):
+    return db.scalar(select(func.count()).select_from(models.ProductTag))
+
+
+def test_deferred_commits_share_one_transaction(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    migrations.upgrade(engine)
+    with RoutingSession(bind=engine) as db:
+        db.info["defer_commit"] = True
+        tag = crud.create_product_tag(db, schemas.ProductTag(tag_name="chairs"))
+        assert tag.id is not None
+        crud.create_product_tag(db, schemas.ProductTag(tag_name="tables"))
+        crud.end_batch(db, commit=False)
+        assert count_tags(db) == 0
+        assert "defer_commit" not in db.info
+
+        db.info["defer_commit"] = True
+        crud.create_product_tag(db, schemas.ProductTag(tag_name="chairs"))
+        crud.end_batch(db, commit=True)
+    with RoutingSession(bind=engine) as db:
+        assert count_tags(db) == 1
+
+
+def test_json_prices_are_stored_as_numbers():
+    product = schemas.ProductBase.model_validate(
+        {"product_name": "chair", "product_price": "9.5", "product_tag_id": 1, "company_id": 1})
+    assert product.product_price == 9.5
+
+
+USER = {"username": "alice", "password": "secret", "user_phone": "1", "user_identity_code": "1",
+        "user_email": "alice@example.com", "user_address": "1 Main St"}
+COMPANY = {"company_name": "Acme", "company_address": "1 Main St", "company_phone": "1", "user_id": 1}
+PRODUCT = {"product_name": "chair", "product_price": 9.5, "product_tag_id": 1, "company_id": 1}
+BANK_ACCOUNT = {"bank_name": "Bank", "bank_account_no": "1", "bank_phone_number": None, "bank_address": None,
+                "bank_city": None, "bank_province": None, "bank_card_no": None, "user_id": 1}
+INVOICE = {"product_id": 1, "user_id": 1, "company_id": 1}
+
+EVERY_OPERATION = [
+    ("create", "users", USER),
+    ("create", "companies", COMPANY),
+    ("create", "product_tags", {"tag_name": "chairs"}),
+    ("create", "products", PRODUCT),
+    ("create", "bank_accounts", BANK_ACCOUNT),
+    ("create", "user_bookmarks", {"id": 1, "user_id": 1, "product_id": 1, "is_favorite": True}),
+    ("create", "invoices", INVOICE),
+    ("update", "users", {**USER, "id": 1, "username": "alice2", "confirm_password": "secret"}),
+    ("update", "companies", {**COMPANY, "id": 1, "company_name": "Acme 2"}),
+    ("update", "product_tags", {"id": 1, "tag_name": "seats"}),
+    ("update", "products", {**PRODUCT, "id": 1, "product_price": 10}),
+    ("update", "bank_accounts", {**BANK_ACCOUNT, "id": "1", "bank_name": "Bank 2"}),
+    ("update", "invoices", {**INVOICE, "id": 1, "status": "shipped"}),
+    ("delete", "invoices", 1),
+    ("delete", "user_bookmarks", 1),
+    ("delete", "bank_accounts", 1),
+    ("delete", "products", 1),
+    ("delete", "product_tags", 1),
+    ("delete", "companies", 1),
+    ("delete", "users", 1),
+]
+
+
+def as_operation(op, resource, payload):
+    if op == "delete":
+        return {"op": op, "resource": resource, "id": payload}
+    return {"op": op, "resource": resource, "data": payload}
+
+
+@pytest.mark.parametrize("atomic", [True, False])
+def test_batch_runs_every_operation(client, atomic):
+    import main
+    client, _ = client
+    assert {(op, resource) for op, resource, _ in EVERY_OPERATION} == set(main.BATCH_OPERATIONS)
+    response = client.post("/batch", params={"atomic": atomic},
+                           json=[as_operation(*operation) for operation in EVERY_OPERATION])
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert result["committed"]
+    assert [(r["index"], r["status"], r["detail"]) for r in result["results"]] == \
+        [(index, 204 if op == "delete" else 200 if resource == "invoices" else 201, None)
+         for index, (op, resource, _) in enumerate(EVERY_OPERATION)]
+    assert result["results"][10]["body"]["product_price"] == 10.0
+    assert client.get("/products/1").status_code == 404
+
+
+def test_atomic_batch_rolls_back_on_failure(client):
+    client, _ = client
+    response = client.post("/batch", json=[as_operation("create", "product_tags", {"tag_name": "chairs"}),
+                                           as_operation("delete", "companies", 1)])
+    assert response.json() == {"committed": False, "results": [
+        {"index": 1, "status": 404, "body": None, "detail": "Company with id 1 not found"}]}
+    assert client.get("/product_tags").json() == []
+
+
+def test_unexpected_errors_are_reported_per_operation(client, monkeypatch):
+    client, dal = client
+
+    async def broken(**kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(dal, "create_company", broken)
+    operations = [as_operation("create", "product_tags", {"tag_name": "chairs"}),
+                  as_operation("create", "companies", COMPANY),
+                  as_operation("create", "product_tags", {"tag_name": "tables"})]
+    result = client.post("/batch", params={"atomic": False}, json=operations).json()
+    assert [r["status"] for r in result["results"]] == [201, 500, 201]
+    assert len(client.get("/product_tags").json()) == 2
+
+    operations[0]["data"]["tag_name"] = "desks"
+    result = client.post("/batch", json=operations).json()
+    assert result == {"committed": False, "results": [
+        {"index": 1, "status": 500, "body": None, "detail": "Internal Server Error"}]}
+    assert len(client.get("/product_tags").json()) == 2
@@ -0,0 +1,198 @@
+from types import SimpleNamespace
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import event, func, select
+import analytics
+import bulk
+import crud
+import models
+import schemas
+from bulk import validate_rows, _copy_value
+
+
+@pytest.fixture
+def foreign_keys(seeded):
+    """The seeded client over a SQLite that enforces foreign keys like Postgres."""
+    import database
+    engine = database.SessionLocal.kw["bind"]
+    event.listen(engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+    engine.dispose()
+    return seeded
+
+
+@pytest.fixture
+def chunks(monkeypatch):
+    """The size of every INSERT bulk_insert runs, in order."""
+    sizes = []
+    insert_chunk = bulk._insert_chunk
+
+    def recording(db, model, chunk):
+        sizes.append(len(chunk))
+        return insert_chunk(db, model, chunk)
+
+    monkeypatch.setattr(bulk, "_insert_chunk", recording)
+    return sizes
+
+
+def count(model):
+    import database
+    with database.SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(model))
+
+
+def test_validate_rows_reports_bad_rows_by_index():
+    rows = [{"product_id": 1, "user_id": 1, "company_id": 1},
+            {"product_id": "not a number", "user_id": 1, "company_id": 1},
+            {"product_id": 2, "user_id": 1, "company_id": 1, "status": "shipped"}]
+    valid, errors = validate_rows(schemas.Invoice, rows)
+    assert [index for index, _ in valid] == [0, 2]
+    assert valid[1][1].status == "shipped"
+    assert [e["index"] for e in errors] == [1]
+    assert errors[0]["detail"][0]["loc"] == ("product_id",)
+
+
+def test_copy_value_escapes_text_format():
+    assert _copy_value(None) == "\\N"
+    assert _copy_value("a\tb\\c\nd") == "a\\tb\\\\c\\nd"
+    assert _copy_value(9.5) == "9.5"
+
+
+def test_invoice_transitions_only_move_forward():
+    with pytest.raises(ValidationError):
+        schemas.InvoiceTransition(ids=[1], status="approved")
+    assert crud.INVOICE_PREVIOUS_STATUS == {"shipped": "approved", "delivered": "shipped"}
+
+
+def test_bulk_products_report_every_row_by_index(foreign_keys, chunks):
+    client, _ = foreign_keys
+    product = {"product_name": "desk", "product_price": 20, "product_tag_id": 1, "company_id": 1}
+    rows = [product,
+            product | {"product_price": "free"},
+            product | {"company_id": 999},
+            product | {"product_name": "lamp"},
+            product | {"product_name": "stool"}]
+    response = client.post("/products/bulk", params={"chunk_size": 2}, json=rows)
+    assert response.status_code == 200
+    body = response.json()
+
+    # the first chunk hits the foreign key and is retried row by row
+    assert chunks == [2, 1, 1, 2]
+    assert [c["index"] for c in body["created"]] == [0, 3, 4]
+    assert len({c["id"] for c in body["created"]}) == 3
+    assert [e["index"] for e in body["errors"]] == [1, 2]
+    assert body["errors"][0]["detail"][0]["loc"] == ["product_price"]
+    assert "FOREIGN KEY" in body["errors"][1]["detail"]
+    assert count(models.Product) == 4
+    names = {c["id"]: client.get(f"/products/{c['id']}").json()["product_name"] for c in body["created"]}
+    assert sorted(names.values()) == ["desk", "lamp", "stool"]
+
+
+def test_bulk_invoices_count_only_the_created_rows(foreign_keys, chunks):
+    client, _ = foreign_keys
+    invoice = {"product_id": 1, "user_id": 1, "company_id": 1}
+    rows = [invoice,
+            invoice | {"user_id": 999},
+            invoice | {"status": "shipped"},
+            {"product_id": 1},
+            invoice]
+    response = client.post("/invoices/bulk", params={"chunk_size": 3}, json=rows)
+    assert response.status_code == 200
+    body = response.json()
+
+    assert chunks == [3, 1, 1, 1, 1]
+    assert [c["index"] for c in body["created"]] == [0, 2, 4]
+    assert [e["index"] for e in body["errors"]] == [1, 3]
+    assert count(models.Invoice) == 5
+    import database
+    with database.SessionLocal() as db:
+        assert sorted(db.execute(analytics.summary_query()).all(), key=repr) == [
+            (1, 1, "approved", None, 3), (1, 1, "shipped", None, 2)]
+
+
+class CopyCursor:
+    """The part of a psycopg2 cursor the COPY path uses."""
+
+    def __init__(self):
+        self.statements, self.copied = [], None
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+    def copy_expert(self, sql, buf):
+        self.statements.append(sql)
+        self.copied = buf.read()
+
+    def fetchall(self):
+        return [(7,), (8,)]
+
+    def close(self):
+        pass
+
+
+class CopySession:
+    """A session whose connection's DBAPI connection hands out ``cursor``."""
+
+    def __init__(self, cursor):
+        self.cursor = lambda: cursor
+
+    def connection(self):
+        return SimpleNamespace(connection=self)
+
+
+def test_copy_stages_rows_in_input_order():
+    cursor = CopyCursor()
+    rows = [(4, {"tag_name": "a\tb"}), (9, {"tag_name": None})]
+
+    assert bulk._copy_chunk(CopySession(cursor), models.ProductTag, rows) == [7, 8]
+    # ordinals, not the payload indexes, keep the RETURNING order
+    assert cursor.copied == "0\ta\\tb\n1\t\\N\n"
+    create, truncate, copy, insert = cursor.statements
+    assert create.startswith("CREATE TEMP TABLE IF NOT EXISTS _bulk_product_tags ON COMMIT DROP")
+    assert truncate == "TRUNCATE _bulk_product_tags"
+    assert copy == "COPY _bulk_product_tags (_ord, tag_name) FROM STDIN"
+    assert insert.endswith("ORDER BY _ord RETURNING id")
+
+
+def deliver_dates(ids):
+    import database
+    with database.SessionLocal() as db:
+        return dict(db.execute(select(models.Invoice.id, models.Invoice.deliver_date).where(
+            models.Invoice.id.in_(ids))).all())
+
+
+def test_transition_reports_what_it_skipped(seeded):
+    client, _ = seeded
+    # invoice 1 is approved, 2 already shipped
+    response = client.post("/invoices/transition", json={"ids": [1, 2, 999, 1], "status": "shipped"})
+    assert response.status_code == 200
+    assert response.json() == {"updated": [1], "skipped": [
+        {"id": 2, "detail": "Invoice is shipped, not approved"},
+        {"id": 999, "detail": "Invoice not found"}]}
+    assert deliver_dates([1, 2]) == {1: None, 2: None}
+
+    response = client.post("/invoices/transition", json={"ids": [1, 2], "status": "delivered"})
+    assert response.json() == {"updated": [1, 2], "skipped": []}
+    assert all(deliver_dates([1, 2]).values())
+
+    response = client.post("/invoices/transition", json={"ids": [1], "status": "shipped"})
+    assert response.json()["skipped"] == [{"id": 1, "detail": "Invoice is delivered, not approved"}]
+
+
+def test_transition_splits_large_id_lists(seeded, monkeypatch):
+    import database
+    with database.SessionLocal() as db:
+        ids = [crud.create_invoice(db, schemas.Invoice(product_id=1, user_id=1, company_id=1)).id
+               for _ in range(4)]
+    chunks = []
+    transition_chunk = crud._transition_chunk
+
+    def recording(db, chunk, target, now):
+        chunks.append(list(chunk))
+        return transition_chunk(db, chunk, target, now)
+
+    monkeypatch.setattr(crud, "_transition_chunk", recording)
+    with database.SessionLocal() as db:
+        updated, skipped = crud.transition_invoices(db, [1, *ids, 999], "shipped", chunk_size=2)
+    assert chunks == [[1, ids[0]], ids[1:3], [ids[3], 999]]
+    assert updated == [1, *ids]
+    assert skipped == [{"id": 999, "detail": "Invoice not found"}]
@@ -0,0 +1,83 @@
+from sqlalchemy import text
+from catalog_cache import LocalBackend, LocalBus, ReadThroughCache
+
+
+def make_cache(**kwargs):
+    return ReadThroughCache("products", LocalBus(), backend=LocalBackend(maxsize=2), **kwargs)
+
+
+def test_hits_misses_and_negative_entries():
+    cache = make_cache()
+    found, _, generation = cache.lookup(1)
+    assert not found
+    cache.store(1, "chair", generation)
+    cache.store(2, None, generation)
+    assert cache.lookup(1)[:2] == (True, "chair")
+    assert cache.lookup(2)[:2] == (True, None)
+    stats = cache.stats()
+    assert (stats["hits"], stats["negative_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_invalidation_wins_over_a_concurrent_load():
+    cache = make_cache()
+    _, _, generation = cache.lookup(1)
+    cache.invalidate([1])
+    cache.store(1, "stale", generation)
+    assert not cache.lookup(1)[0]
+
+
+def test_negative_entries_use_their_own_ttl():
+    cache = make_cache(negative_ttl=0)
+    cache.store(1, None, cache.generation)
+    assert not cache.lookup(1)[0]
+
+
+def test_backend_is_a_bounded_lru():
+    backend = LocalBackend(maxsize=2)
+    for key in (1, 2):
+        backend.set(key, key, 60)
+    backend.get(1)
+    backend.set(3, 3, 60)
+    assert backend.get(2) is None and backend.get(1) == 1
+
+
+def test_entries_read_at_an_older_table_version_miss():
+    cache = ReadThroughCache("t", LocalBus())
+    cache.store(1, "chair", cache.generation, version=3)
+    assert cache.lookup(1, version=3)[:2] == (True, "chair")
+    assert not cache.lookup(1, version=4)[0]
+    cache.store(2, None, cache.generation, version=3)
+    assert not cache.lookup(2, version=4)[0]
+
+
+def test_a_write_elsewhere_is_never_served_under_its_new_etag(seeded):
+    import database
+    import etags
+    client, _ = seeded
+    first = client.get("/products/1")
+    assert first.status_code == 200
+    # another worker deletes the product; this one's invalidation never arrives
+    with database.SessionLocal.kw["bind"].begin() as conn:
+        conn.execute(text("DELETE FROM user_bookmarks"))
+        conn.execute(text("DELETE FROM invoices"))
+        conn.execute(text("DELETE FROM products WHERE id = 1"))
+        conn.execute(text("UPDATE table_versions SET version = version + 1 WHERE name = 'products'"))
+    # this worker's next poll of the table versions
+    etags.table_versions.expire()
+    response = client.get("/products/1", headers={"If-None-Match": first.headers["etag"]})
+    assert response.status_code == 404
+
+
+def test_deleting_a_row_gone_elsewhere_is_a_404(seeded):
+    import database
+    client, _ = seeded
+    assert client.get("/products/1").status_code == 200
+    assert client.get("/product_tags/1").status_code == 200
+    with database.SessionLocal.kw["bind"].begin() as conn:
+        conn.execute(text("DELETE FROM user_bookmarks"))
+        conn.execute(text("DELETE FROM invoices"))
+        conn.execute(text("DELETE FROM products"))
+        conn.execute(text("DELETE FROM product_tags"))
+    for path in ("/products/remove/1", "/product_tags/remove/1", "/companies/remove/2"):
+        assert client.delete(path).status_code == 404, path
+    assert client.delete("/companies/remove/1").status_code == 204
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import pytest
+from sqlalchemy import create_engine
+import async_crud
+import crud
+import dal
+import migrations
+import schemas
+from database import RoutingSession
+
+
+@pytest.fixture
+def mode(monkeypatch):
+    """Switch DB_MODE for dal; the dispatch is cached per name."""
+
+    def switch(value):
+        monkeypatch.setattr(dal, "DB_MODE", value)
+        dal.__getattr__.cache_clear()
+
+    yield switch
+    dal.__getattr__.cache_clear()
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    migrations.upgrade(engine)
+    with RoutingSession(bind=engine) as session:
+        yield session
+
+
+def test_sync_mode_runs_crud_in_the_threadpool(mode, db, monkeypatch):
+    mode("sync")
+    threads = []
+    get_product_tags = crud.get_product_tags
+
+    def recording(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return get_product_tags(*args, **kwargs)
+
+    monkeypatch.setattr(crud, "get_product_tags", recording)
+    crud.create_product_tag(db, schemas.ProductTag(tag_name="chairs"))
+    tags = asyncio.run(dal.get_product_tags(db=db))
+    assert [tag.tag_name for tag in tags] == ["chairs"]
+    assert threads and threads[0] is not threading.main_thread()
+    assert dal.get_product_tags is dal.get_product_tags
+
+
+def test_async_mode_uses_async_crud(mode):
+    mode("async")
+    assert dal.get_product_tags is async_crud.get_product_tags
+    assert dal.create_user is async_crud.create_user
+
+
+class FakeAsyncSession:
+    """The part of AsyncSession the run_sync fallback relies on."""
+
+    def __init__(self, session):
+        self.session = session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return fn(self.session, *args, **kwargs)
+
+
+def test_async_crud_runs_sync_only_functions_through_run_sync(mode, db):
+    mode("async")
+    assert "get_table_versions" not in vars(async_crud)
+    crud.create_product_tag(db, schemas.ProductTag(tag_name="chairs"))
+    versions = asyncio.run(dal.get_table_versions(db=FakeAsyncSession(db)))
+    assert versions and versions == crud.get_table_versions(db)
+    with pytest.raises(AttributeError):
+        async_crud.no_such_function
@@ -0,0 +1,22 @@
+from db_pool import connections_per_worker, fixed_connections, pool_size_for, max_replicas
+
+
+def test_connections_are_split_across_workers_and_replicas():
+    assert connections_per_worker(max_connections=100, reserved=10, replicas=3, workers=4, fixed=0) == 7
+    assert connections_per_worker(max_connections=10, reserved=10, replicas=1, workers=1, fixed=0) == 1
+
+
+def test_connections_outside_the_request_pool_come_off_its_share():
+    assert fixed_connections(mode="sync", bus="local", sync_pool_size=2) == 0
+    assert fixed_connections(mode="async", bus="postgres", sync_pool_size=2) == 3
+    assert connections_per_worker(max_connections=100, reserved=10, replicas=3, workers=4, fixed=3) == 4
+    assert max_replicas(pool_size=3, max_overflow=1, max_connections=100, reserved=10, workers=4, fixed=3) == 3
+
+
+def test_pool_size_for_keeps_a_quarter_as_overflow():
+    assert pool_size_for(8) == (6, 2)
+    assert pool_size_for(1) == (1, 0)
+
+
+def test_max_replicas():
+    assert max_replicas(pool_size=6, max_overflow=2, max_connections=100, reserved=10, workers=4, fixed=0) == 2
@@ -0,0 +1,20 @@
+from etags import TableVersions, if_none_match, make_etag
+
+
+def test_if_none_match_uses_weak_comparison():
+    etag = make_etag("products", 3)
+    assert if_none_match('"products-3"', etag)
+    assert if_none_match('W/"products-3", "products-2"', etag)
+    assert if_none_match("*", etag)
+    assert not if_none_match('"products-2"', etag)
+    assert not if_none_match(None, etag)
+
+
+def test_table_versions_go_stale_and_expire():
+    versions = TableVersions(poll=60)
+    assert versions.stale()
+    versions.update({"products": 4})
+    assert not versions.stale()
+    assert versions.get("products") == 4 and versions.get("companies") == 0
+    versions.expire()
+    assert versions.stale()
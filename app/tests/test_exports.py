@@ -0,0 +1,53 @@
+import gzip
+import json
+from datetime import datetime
+import pytest
+import exports
+
+
+ROWS = [(1, 2, 3, 4, "paid", datetime(2024, 1, 2, 3, 4, 5), None),
+        (2, 2, 3, 4, 'says "hi", twice', datetime(2024, 1, 3), datetime(2024, 1, 4))]
+HEADER = ["id", "product_id", "user_id", "company_id", "status", "create_date", "deliver_date"]
+
+
+def test_ndjson_writes_one_object_per_row():
+    lines = exports._ndjson(HEADER, ROWS).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": 1, "product_id": 2, "user_id": 3, "company_id": 4, "status": "paid",
+         "create_date": "2024-01-02T03:04:05", "deliver_date": None},
+        {"id": 2, "product_id": 2, "user_id": 3, "company_id": 4, "status": 'says "hi", twice',
+         "create_date": "2024-01-03T00:00:00", "deliver_date": "2024-01-04T00:00:00"}]
+
+
+def test_csv_quotes_values_and_leaves_nulls_empty():
+    assert exports._csv(ROWS) == ('1,2,3,4,paid,2024-01-02T03:04:05,\r\n'
+                                  '2,2,3,4,"says ""hi"", twice",2024-01-03T00:00:00,2024-01-04T00:00:00\r\n')
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_gzip_output_is_one_stream_across_batches(fmt):
+    plain, compressed = exports._Encoder(fmt, gzip=False), exports._Encoder(fmt, gzip=True)
+    chunks = [plain.start(), plain.batch(ROWS[:1]), plain.batch(ROWS[1:]), plain.finish()]
+    gzipped = [compressed.start(), compressed.batch(ROWS[:1]), compressed.batch(ROWS[1:]), compressed.finish()]
+    assert gzip.decompress(b"".join(gzipped)) == b"".join(chunks)
+    assert b"".join(chunks).startswith(b"id,product_id" if fmt == "csv" else b'{"id":1')
+
+
+@pytest.mark.parametrize("gzipped", [False, True])
+def test_export_negotiates_format_and_encoding(seeded, gzipped):
+    client, _ = seeded
+    response = client.get("/invoices/export", params={"gzip": gzipped})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="invoices.ndjson"'
+    assert response.headers.get("content-encoding") == ("gzip" if gzipped else None)
+    # the client has already undone the gzip encoding
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [1, 2]
+
+    response = client.get("/invoices/export", params={"format": "csv", "gzip": gzipped, "status": "shipped"})
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="invoices.csv"'
+    header, *rows = response.text.splitlines()
+    assert header == ",".join(HEADER)
+    assert [row.split(",")[4] for row in rows] == ["shipped"]
+
+    assert client.get("/invoices/export", params={"format": "xml"}).status_code == 422
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+import hashing
+from hashing import PasswordHasher, BCRYPT_ROUNDS, cpu_quota
+
+
+def test_hash_and_verify():
+    hasher = PasswordHasher(workers=0)
+    hashed = asyncio.run(hasher.hash("Hassan"))
+    assert asyncio.run(hasher.verify("Hassan", hashed)) == (True, None)
+    assert asyncio.run(hasher.verify("wrong", hashed)) == (False, None)
+
+
+def test_low_cost_hash_is_rehashed_on_verify():
+    hasher = PasswordHasher(workers=0)
+    legacy = bcrypt.using(rounds=4).hash("Hassan")
+    verified, new_hash = asyncio.run(hasher.verify("Hassan", legacy))
+    assert verified
+    assert new_hash and f"${BCRYPT_ROUNDS:02d}$" in new_hash
+
+
+def test_saturated_hasher_returns_503():
+    hasher = PasswordHasher(workers=0, queue_depth=0)
+    hasher.in_flight = hasher.capacity
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(hasher.hash("Hassan"))
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers["Retry-After"] == "1"
+    assert hasher.rejected == 1
+
+
+def test_pool_size_follows_the_cgroup_quota(tmp_path, monkeypatch):
+    assert cpu_quota(str(tmp_path)) is None
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert cpu_quota(str(tmp_path)) is None
+    (tmp_path / "cpu.max").write_text("400000 100000\n")
+    assert cpu_quota(str(tmp_path)) == 4
+
+    monkeypatch.setattr(hashing, "cpu_quota", lambda: 4.0)
+    assert hashing.default_workers(web_concurrency=2) == 2
+    assert hashing.default_workers(web_concurrency=8) == 1
+    monkeypatch.setattr(hashing, "cpu_quota", lambda: None)
+    assert hashing.default_workers(web_concurrency=2) == 1
+
+
+def test_pool_processes_are_not_forked_from_the_worker():
+    hasher = PasswordHasher(workers=1)
+    try:
+        hashed = asyncio.run(hasher.hash("Hassan"))
+        assert asyncio.run(hasher.verify("Hassan", hashed)) == (True, None)
+        assert hasher._executor._mp_context.get_start_method() == "forkserver"
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,23 @@
+import asyncio
+from sqlalchemy import create_engine
+import health
+import migrations
+from search import ProductIndex
+
+
+def test_readiness_waits_for_warm_up_and_a_migrated_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    readiness = health.Readiness(engine, index=ProductIndex(), fetch=list, warm=2)
+    assert not any(asyncio.run(readiness.check()).values())
+
+    migrations.upgrade(engine, target=1)
+    asyncio.run(readiness.run())
+    checks = asyncio.run(readiness.check())
+    assert checks == {"warm": True, "schema": False, "product_index": True, "database": True}
+
+    migrations.upgrade(engine)
+    readiness = health.Readiness(engine, index=ProductIndex(), fetch=list, warm=2)
+    asyncio.run(readiness.run())
+    assert all(asyncio.run(readiness.check()).values())
+    # warm-up left the connections open in the pool
+    assert engine.pool.checkedin() == 2
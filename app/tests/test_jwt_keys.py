@@ -0,0 +1,83 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+import jwt
+import pytest
+from jwt.exceptions import InvalidTokenError
+import jwt_keys
+from jwt_keys import Key, KeyRing
+
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def secret(name: str) -> str:
+    return name.ljust(32, "-")
+
+
+def keys_json(*keys) -> str:
+    return json.dumps({"keys": [key.to_dict() for key in keys]})
+
+
+def test_signs_with_the_newest_active_key_and_verifies_the_rest():
+    old = Key("old", secret("s1"), not_before=NOW - timedelta(days=1),
+              not_after=NOW + timedelta(hours=1))
+    new = Key("new", secret("s2"), not_before=NOW - timedelta(minutes=1))
+    future = Key("future", secret("s3"), not_before=NOW + timedelta(minutes=5))
+    ring = KeyRing(inline=keys_json(old, new, future), path="", legacy_secret="")
+    assert ring.signing_key(NOW).kid == "new"
+    assert ring.signing_key(NOW + timedelta(minutes=5)).kid == "future"
+    assert ring.verification_key("old", NOW) == old
+    assert ring.verification_key("old", NOW + timedelta(hours=1)) is None
+    assert ring.verification_key("unknown", NOW) is None
+
+
+def test_tokens_carry_the_kid_and_round_trip(monkeypatch):
+    ring = KeyRing(inline=keys_json(Key("k1", secret("k1"))), path="", legacy_secret=secret("legacy"))
+    monkeypatch.setattr(jwt_keys, "key_ring", ring)
+    token = jwt_keys.encode({"sub": "alice"})
+    assert jwt.get_unverified_header(token)["kid"] in ("k1", jwt_keys.LEGACY_KID)
+    assert jwt_keys.decode(token)["sub"] == "alice"
+    # tokens minted before key ids existed
+    assert jwt_keys.decode(jwt.encode({"sub": "bob"}, secret("legacy"), algorithm="HS256"))["sub"] == "bob"
+    with pytest.raises(InvalidTokenError):
+        jwt_keys.decode(jwt.encode({"sub": "eve"}, secret("k1"), algorithm="HS256", headers={"kid": "k2"}))
+    with pytest.raises(InvalidTokenError):
+        jwt_keys.decode(jwt.encode({"sub": "eve"}, secret("wrong"), algorithm="HS256", headers={"kid": "k1"}))
+
+
+def test_keys_file_is_reloaded_when_it_changes(tmp_path):
+    path = tmp_path / "keys.json"
+    path.write_text(keys_json(Key("k1", secret("s1"))))
+    ring = KeyRing(inline="", path=str(path), legacy_secret="", reload_interval=0)
+    assert set(ring.keys) == {"k1"}
+    path.write_text(keys_json(Key("k1", secret("s1")), Key("k2", secret("s2"))))
+    os.utime(path, (0, 1))
+    assert ring.verification_key("k2") is not None
+    path.write_text("not json")
+    os.utime(path, (0, 2))
+    # a broken file keeps the keys already loaded
+    assert ring.verification_key("k2") is not None
+
+
+def test_rotate_schedules_the_switch_and_retires_old_keys():
+    current = Key("k1", secret("s1"))
+    expired = Key("k0", secret("s0"), not_after=NOW - timedelta(seconds=1))
+    rotated = jwt_keys.rotate([expired, current], NOW, timedelta(minutes=5), timedelta(hours=1))
+    assert [key.kid for key in rotated[:-1]] == ["k1"]
+    assert rotated[0].not_after == NOW + timedelta(minutes=5, hours=1)
+    ring = KeyRing(inline=keys_json(*rotated), path="", legacy_secret="")
+    assert ring.signing_key(NOW).kid == "k1"
+    assert ring.signing_key(NOW + timedelta(minutes=5)).kid == rotated[-1].kid
+
+
+def test_malformed_kids_are_unknown_keys():
+    ring = KeyRing(inline="", path="", legacy_secret=secret("legacy"))
+    for kid in (["k1"], {"k1": 1}, 1):
+        assert ring.verification_key(kid, NOW) is None
+    assert ring.verification_key(None, NOW).kid == jwt_keys.LEGACY_KID
+
+
+def test_key_times_accept_a_z_suffix():
+    keys = jwt_keys.parse_keys('{"keys": [{"kid": "k1", "secret": "s", "not_before": "2024-01-01T00:00:00Z"}]}')
+    assert keys[0].not_before == NOW
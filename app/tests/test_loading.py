@@ -0,0 +1,51 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from loading import parse_expand, query_budget
+import models
+
+
+def test_parse_expand_resolves_profiles_and_drops_duplicates():
+    assert parse_expand(models.Invoice, None) == ()
+    assert parse_expand(models.Invoice, "company, summary") == ("company", "product")
+
+
+def test_parse_expand_rejects_unknown_relationships():
+    with pytest.raises(HTTPException) as e:
+        parse_expand(models.UserBookmark, "company")
+    assert e.value.status_code == 400
+
+
+def test_query_budget_counts_collection_loads_only():
+    assert query_budget(models.Invoice, ("product", "user", "company")) == 1
+    assert query_budget(models.User, parse_expand(models.User, "full")) == 2
+
+
+@pytest.mark.parametrize("path, model, expand", [
+    ("/users", models.User, "full"),
+    ("/users/1", models.User, "full"),
+    ("/invoices", models.Invoice, "full"),
+    ("/invoices/1", models.Invoice, "summary"),
+    ("/user_bookmarks", models.UserBookmark, "full"),
+    ("/invoices", models.Invoice, None),
+])
+def test_requests_run_their_query_budget(seeded, path, model, expand):
+    import database
+    client, _ = seeded
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = database.SessionLocal.kw["bind"]
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get(path, params={"expand": expand} if expand else {})
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    item = body[0] if isinstance(body, list) else body
+    for name in parse_expand(model, expand):
+        assert name in item, name
+    assert len(statements) == query_budget(model, parse_expand(model, expand)), statements
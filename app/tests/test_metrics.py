@@ -0,0 +1,62 @@
+import os
+from metrics import Histogram, MetricsRegistry, WorkerMetrics, merge, remove_worker, render_samples, worker_path
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        h.observe(value)
+    lines = list(h.render("latency", 'route="/x"'))
+    assert lines[:3] == ['latency_bucket{route="/x",le="0.1"} 2',
+                         'latency_bucket{route="/x",le="1.0"} 3',
+                         'latency_bucket{route="/x",le="+Inf"} 4']
+    assert lines[-1] == 'latency_count{route="/x"} 4'
+
+
+def test_registry_renders_only_routes_that_were_hit():
+    registry = MetricsRegistry()
+    m = registry.unmatched
+    m.latency.observe(0.01)
+    m.statuses[404] = 1
+    m.db_statements = 2
+    text = registry.render()
+    assert 'http_responses_total{method="ANY",route="unmatched",status="404"} 1' in text
+    assert 'http_db_statements_total{method="ANY",route="unmatched"} 2' in text
+
+
+def test_render_samples_without_labels():
+    assert render_samples("up", "gauge", "Up.", [("", 1)]) == "# HELP up Up.\n# TYPE up gauge\nup 1\n"
+
+
+WORKER = """# HELP http_requests_in_flight Requests currently being served.
+# TYPE http_requests_in_flight gauge
+http_requests_in_flight {in_flight}
+# HELP http_responses_total Responses by route and status code.
+# TYPE http_responses_total counter
+http_responses_total{{method="GET",route="/users/{{user_id}}",status="200"}} {ok}
+# HELP product_index_products Products in this worker's autocomplete index.
+# TYPE product_index_products gauge
+product_index_products 10
+"""
+
+
+def test_merge_sums_counters_and_labels_per_worker_gauges():
+    text = merge({"11": WORKER.format(in_flight=2, ok=5), "12": WORKER.format(in_flight=1, ok=0.5)})
+    assert "http_requests_in_flight 3\n" in text
+    assert 'http_responses_total{method="GET",route="/users/{user_id}",status="200"} 5.5\n' in text
+    assert 'product_index_products{worker="11"} 10\n' in text
+    assert 'product_index_products{worker="12"} 10\n' in text
+    assert text.count("# TYPE http_responses_total counter") == 1
+
+
+def test_workers_see_each_others_samples(tmp_path):
+    first = WorkerMetrics(str(tmp_path), lambda: WORKER.format(in_flight=4, ok=3))
+    first.write()
+    os.replace(worker_path(tmp_path, os.getpid()), worker_path(tmp_path, 1))
+    second = WorkerMetrics(str(tmp_path), None)
+    text = second.collect(WORKER.format(in_flight=1, ok=1))
+    assert "http_requests_in_flight 5\n" in text
+    assert 'status="200"} 4\n' in text
+
+    remove_worker(str(tmp_path), 1)
+    assert "http_requests_in_flight 1\n" in second.collect(WORKER.format(in_flight=1, ok=1))
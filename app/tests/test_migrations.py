@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, insert, inspect, text
+from sqlalchemy.exc import IntegrityError
+import analytics
+import migrations
+import models
+
+
+def test_upgrade_applies_each_version_once():
+    engine = create_engine("sqlite://")
+    assert migrations.upgrade(engine, target=1) == [1]
+    assert set(models.Base.metadata.tables) <= set(inspect(engine).get_table_names())
+    assert migrations.upgrade(engine) == list(range(2, migrations.HEAD + 1))
+    assert migrations.upgrade(engine) == []
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.HEAD
+
+
+def test_versions_are_consecutive():
+    assert [version for version, _, _ in migrations.MIGRATIONS] == list(range(1, migrations.HEAD + 1))
+
+
+def legacy_database():
+    """The natural-key tables as they were before uniqueness was declared, at version 2."""
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        for ddl in ("CREATE TABLE companies (id INTEGER PRIMARY KEY, company_name VARCHAR)",
+                    "CREATE TABLE product_tags (id INTEGER PRIMARY KEY, tag_name VARCHAR)",
+                    "CREATE TABLE bank_accounts (id INTEGER PRIMARY KEY, bank_account_no VARCHAR)",
+                    "CREATE TABLE user_bookmarks (id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER)"):
+            conn.execute(text(ddl))
+        models.SchemaMigration.__table__.create(conn)
+        models.Invoice.__table__.create(conn)
+        models.InvoiceSummary.__table__.create(conn)
+        conn.execute(text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (1, 'baseline', CURRENT_TIMESTAMP), (2, 'indexes', CURRENT_TIMESTAMP)"))
+        conn.execute(text("INSERT INTO bank_accounts (bank_account_no) VALUES (NULL), (NULL)"))
+    return engine
+
+
+def test_unique_keys_are_backfilled_unless_there_are_duplicates():
+    engine = legacy_database()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO companies (company_name) VALUES ('Acme'), ('Acme'), ('Other')"))
+    with pytest.raises(migrations.DuplicateKeysError, match=r"companies \(company_name\).*'Acme'.* x2"):
+        migrations.upgrade(engine)
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == 2
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE companies SET company_name = 'Acme 2' WHERE id = 2"))
+    assert migrations.upgrade(engine, target=3) == [3]
+    for table, columns, _ in migrations.UNIQUE_KEYS:
+        assert {"column_names": list(columns), "unique": 1} in [
+            {"column_names": i["column_names"], "unique": i["unique"]} for i in inspect(engine).get_indexes(table)]
+    with engine.begin() as conn, pytest.raises(IntegrityError):
+        conn.execute(text("INSERT INTO companies (company_name) VALUES ('Acme')"))
+
+
+def test_invoice_summary_is_backfilled():
+    engine = create_engine("sqlite://")
+    migrations.upgrade(engine, target=3)
+    created = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Invoice), [
+            {"company_id": 1, "product_id": 2, "user_id": 3, "status": "approved", "create_date": created,
+             "deliver_date": None},
+            {"company_id": 1, "product_id": 2, "user_id": 3, "status": "approved", "create_date": created,
+             "deliver_date": None},
+            {"company_id": 1, "product_id": 2, "user_id": 3, "status": "delivered", "create_date": created,
+             "deliver_date": created + timedelta(hours=5, minutes=30)},
+            # delivered "before" it was created counts as 0 hours
+            {"company_id": 1, "product_id": 2, "user_id": 3, "status": "delivered", "create_date": created,
+             "deliver_date": created - timedelta(hours=1)},
+        ])
+    assert migrations.upgrade(engine) == [4]
+    with engine.connect() as conn:
+        assert sorted(conn.execute(analytics.summary_query()).all(), key=repr) == [
+            (1, 2, "approved", None, 2), (1, 2, "delivered", 0, 1), (1, 2, "delivered", 5, 1)]
@@ -0,0 +1,73 @@
+import base64
+import json
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+import crud
+import migrations
+import models
+import schemas
+from pagination import encode_cursor, decode_cursor, next_cursor, page_query
+
+
+def test_cursor_round_trip():
+    created = datetime(2024, 1, 20, 8, 30)
+    cursor = encode_cursor("-create_date", [created, 42])
+    assert decode_cursor("-create_date", cursor) == [created, 42]
+
+
+def test_cursor_for_other_sort_is_rejected():
+    cursor = encode_cursor("id", [42])
+    with pytest.raises(HTTPException) as exc_info:
+        decode_cursor("create_date", cursor)
+    assert exc_info.value.status_code == 400
+
+
+def test_page_query_seeks_past_cursor():
+    page = schemas.PageParams(limit=10, cursor=encode_cursor("id", [42]))
+    filters = schemas.InvoiceFilter(company_id=3)
+    sql = str(page_query(models.Invoice, page, filters))
+    assert "invoices.company_id = " in sql
+    assert "invoices.id > " in sql
+    assert "ORDER BY invoices.id ASC" in sql
+
+
+@pytest.mark.parametrize("sort, data", [
+    ("id", {"id": "x"}),
+    ("id", [42]),
+    ("id", {"s": "id", "v": ["42"]}),
+    ("id", {"s": "id", "v": [True]}),
+    ("id", {"s": "id", "v": 42}),
+    ("create_date", {"s": "create_date", "v": [20240101, 42]}),
+    ("create_date", {"s": "create_date", "v": ["2024-01-01"]}),
+])
+def test_malformed_cursors_are_rejected(sort, data):
+    cursor = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+    with pytest.raises(HTTPException) as exc_info:
+        decode_cursor(sort, cursor)
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.parametrize("sort", ["create_date", "-create_date"])
+def test_rows_without_a_date_are_paged_once(sort):
+    engine = create_engine("sqlite://")
+    migrations.upgrade(engine)
+    start = datetime(2024, 1, 1)
+    dates = [start, None, start + timedelta(days=1), None, start, None, start + timedelta(days=2)]
+    with Session(engine) as db:
+        db.execute(insert(models.ProductTag), [{"tag_name": f"tag{i}", "create_date": d} for i, d in enumerate(dates)])
+        db.commit()
+        seen, cursor = [], None
+        while True:
+            page = schemas.PageParams(limit=2, cursor=cursor, sort=sort)
+            tags = crud.get_product_tags(db, page)
+            seen += [(tag.create_date, tag.id) for tag in tags]
+            cursor = next_cursor(models.ProductTag, page, tags)
+            if not cursor:
+                break
+    dated = sorted((d, i) for d, i in seen if d)
+    undated = sorted((d, i) for d, i in seen if not d)
+    expected = dated + undated if sort == "create_date" else undated[::-1] + dated[::-1]
+    assert seen == expected and len(seen) == len(dates)
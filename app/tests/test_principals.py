@@ -0,0 +1,61 @@
+import time
+from sqlalchemy import create_engine
+import crud
+import migrations
+import schemas
+from database import RoutingSession
+from principals import PrincipalCache, principal_cache
+
+
+def test_principal_cache_hit_and_miss():
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    assert cache.get("hassan") is None
+    cache.set("hassan", "user")
+    assert cache.get("hassan") == "user"
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_principal_cache_evicts_least_recently_used():
+    cache = PrincipalCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_principal_cache_expires_entries():
+    cache = PrincipalCache(maxsize=10, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_principal_cache_invalidate():
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    cache.set("old_name", 1)
+    cache.invalidate("old_name", "new_name")
+    assert cache.get("old_name") is None
+
+
+def test_deleted_users_leave_the_cache_on_commit_only(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    migrations.upgrade(engine)
+    with RoutingSession(bind=engine) as db:
+        user = crud.create_user(db, schemas.UserCreate(
+            username="alice", password="x", user_email="alice@example.com", user_address="1 Main St",
+            user_identity_code="1", user_phone="1"))
+        principal_cache.set("alice", user)
+
+        # a /batch transaction that is rolled back keeps the user
+        db.info["defer_commit"] = True
+        crud.delete_user(db, user.id)
+        assert principal_cache.get("alice") is user
+        crud.end_batch(db, commit=False)
+        assert principal_cache.get("alice") is user
+
+        assert crud.delete_user(db, user.id)
+        assert principal_cache.get("alice") is None
+        assert crud.delete_user(db, user.id) is None
@@ -0,0 +1,34 @@
+import pytest
+from jwt.exceptions import InvalidTokenError
+import jwt_keys
+import refresh_tokens
+from jwt_keys import KeyRing
+
+
+@pytest.fixture(autouse=True)
+def key_ring(monkeypatch):
+    ring = KeyRing(inline="", path="", legacy_secret="k" * 32)
+    monkeypatch.setattr(jwt_keys, "key_ring", ring)
+
+
+def test_refresh_tokens_round_trip_and_are_stored_hashed():
+    family = refresh_tokens.new_family()
+    token, stored = refresh_tokens.issue(42, family)
+    assert refresh_tokens.decode(token) == (42, family)
+    assert token not in stored
+    assert stored == refresh_tokens.stored_value(family, token)
+    assert refresh_tokens.same_family(stored, family)
+    assert not refresh_tokens.same_family(stored, refresh_tokens.new_family())
+    assert not refresh_tokens.same_family(None, family)
+    rotated, rotated_stored = refresh_tokens.issue(42, family)
+    assert rotated_stored != stored and refresh_tokens.same_family(rotated_stored, family)
+
+
+def test_refresh_and_access_tokens_are_not_interchangeable():
+    token, _ = refresh_tokens.issue(42, refresh_tokens.new_family())
+    with pytest.raises(InvalidTokenError):
+        jwt_keys.decode(token)
+    with pytest.raises(InvalidTokenError):
+        refresh_tokens.decode(jwt_keys.encode({"sub": "alice", "uid": 42}))
+    with pytest.raises(InvalidTokenError):
+        refresh_tokens.decode(jwt_keys.encode({"sub": "alice", "aud": refresh_tokens.REFRESH_AUDIENCE}))
@@ -0,0 +1,30 @@
+import time
+from types import SimpleNamespace
+import replicas
+from replicas import Replica, ReplicaSet
+
+
+def request(method="GET", headers=None, cookies=None):
+    return SimpleNamespace(method=method, headers=headers or {}, cookies=cookies or {})
+
+
+def test_pick_round_robins_over_healthy_replicas_and_falls_back_to_primary():
+    a, b = Replica("a", "engine-a", None), Replica("b", "engine-b", None)
+    replica_set = ReplicaSet([a, b])
+    assert replica_set.pick() is None
+    a.healthy = b.healthy = True
+    assert {replica_set.pick(), replica_set.pick()} == {"engine-a", "engine-b"}
+    b.healthy = False
+    assert replica_set.pick() == "engine-a"
+
+
+def test_writes_and_pinned_clients_read_from_the_primary(monkeypatch):
+    replica = Replica("a", "engine-a", None)
+    replica.healthy = True
+    monkeypatch.setattr(replicas, "replica_set", ReplicaSet([replica]))
+    assert replicas.read_replica(request()) == "engine-a"
+    assert replicas.read_replica(request("POST")) is None
+    pinned = str(time.time() + 5)
+    assert replicas.read_replica(request(headers={"X-Primary-Until": pinned})) is None
+    assert replicas.read_replica(request(cookies={"primary_until": pinned})) is None
+    assert replicas.read_replica(request(cookies={"primary_until": "garbage"})) == "engine-a"
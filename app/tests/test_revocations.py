@@ -0,0 +1,45 @@
+import time
+from sqlalchemy.orm import Session
+import catalog_cache
+import models
+import revocations
+from revocations import RevocationList
+
+
+def test_user_revocation_covers_tokens_issued_before_it():
+    revocation_list = RevocationList()
+    revocation_list.apply([[1, None, 100.0, 2000.0]])
+    assert revocation_list.is_revoked(1, "a", 99.5)
+    assert not revocation_list.is_revoked(1, "b", 100.5)
+    assert not revocation_list.is_revoked(2, "a", 99.5)
+    # an older revocation delivered late does not move the cutoff back
+    revocation_list.apply([[1, None, 50.0, 2000.0]])
+    assert revocation_list.is_revoked(1, "a", 99.5)
+
+
+def test_token_revocation_and_prune():
+    revocation_list = RevocationList()
+    revocation_list.apply([[1, "a", 100.0, 200.0], [2, None, 100.0, 300.0]])
+    assert revocation_list.is_revoked(1, "a", 150.0)
+    assert not revocation_list.is_revoked(1, "b", 150.0)
+    revocation_list.prune(250.0)
+    assert revocation_list.stats()["tokens"] == 0
+    assert revocation_list.is_revoked(2, "c", 50.0)
+    assert not revocation_list.fresh
+
+
+def test_revocations_are_published_on_commit_only(monkeypatch):
+    delivered = []
+    bus = catalog_cache.LocalBus()
+    bus.subscribe(revocations.TOKEN_REVOCATIONS_NAMESPACE, delivered.append)
+    monkeypatch.setattr(catalog_cache, "bus", bus)
+    session = Session()
+    revocations.revoke(session, 7)
+    assert isinstance(next(iter(session.new)), models.TokenRevocation)
+    session.rollback()
+    assert delivered == []
+    revocations.revoke(session, 7, jti="a", expires_at=time.time() + 60)
+    revocations._publish_committed(session)
+    [[entry]] = delivered
+    assert entry[:2] == [7, "a"]
+    assert "token_revocations" not in session.info
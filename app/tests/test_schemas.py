@@ -0,0 +1,22 @@
+from datetime import datetime
+import models
+import schemas
+
+
+def test_user_out_never_exposes_credentials():
+    user = models.User(id=1, user_name="alice", user_password="hash",
+                       last_login_token="token", last_fp_req_token="reset")
+    dumped = schemas.UserOut.model_validate(user).model_dump()
+    assert dumped["user_name"] == "alice"
+    assert not {"user_password", "last_login_token", "last_fp_req_token"} & dumped.keys()
+
+
+def test_only_loaded_relationships_are_serialized():
+    invoice = models.Invoice(id=1, product_id=2, status="shipped", create_date=datetime(2024, 1, 1))
+    dumped = schemas.InvoiceOut.model_validate(invoice).model_dump(exclude_unset=True)
+    assert dumped["product_id"] == 2
+    assert "product" not in dumped
+
+    invoice.product = models.Product(id=2, product_name="chair")
+    dumped = schemas.InvoiceOut.model_validate(invoice).model_dump(exclude_unset=True)
+    assert dumped["product"]["product_name"] == "chair"
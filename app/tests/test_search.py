@@ -0,0 +1,44 @@
+from search import ProductIndex, like_pattern
+
+
+def test_like_pattern_escapes_wildcards():
+    assert like_pattern("50%_off", "substring") == "%50\\%\\_off%"
+    assert like_pattern("a\\b", "prefix") == "a\\\\b%"
+
+
+def test_complete_matches_word_starts_once_per_product():
+    index = ProductIndex()
+    index.load([(1, "Smart Phone Stand", 1, 10),
+                (2, "phone charger", 2, 10),
+                (3, "Phonebook phone", 1, 20),
+                (4, "Desk Lamp", 1, 10)])
+    assert [p["id"] for p in index.complete("PHO")] == [3, 2, 1]
+    assert [p["id"] for p in index.complete("pho", limit=1)] == [3]
+    assert [p["id"] for p in index.complete("pho", product_tag_id=1, company_id=10)] == [1]
+    assert index.complete("lamp") == [{"id": 4, "product_name": "Desk Lamp",
+                                       "product_tag_id": 1, "company_id": 10}]
+    assert index.complete("x") == []
+
+
+def test_apply_updates_and_deletes_incrementally():
+    index = ProductIndex()
+    index.load([(1, "Desk Lamp", 1, 10), (2, "Desk Chair", 1, 10)])
+    index.apply([[1, "Floor Lamp", 1, 10], [2, None, None, None], [3, "Desk Mat", 2, 20]])
+    assert [p["id"] for p in index.complete("desk")] == [3]
+    assert [p["product_name"] for p in index.complete("lamp")] == ["Floor Lamp"]
+    assert not index.stale
+
+
+def test_reload_racing_a_change_stays_stale():
+    index = ProductIndex()
+
+    def fetch():
+        index.apply([[9, "Late Arrival", 1, 1]])
+        return [(1, "Desk Lamp", 1, 10)]
+
+    index.reload(fetch)
+    assert index.loaded and index.stale
+    index.apply(None)
+    index.reload(lambda: [(1, "Desk Lamp", 1, 10), (9, "Late Arrival", 1, 1)])
+    assert not index.needs_reload()
+    assert [p["id"] for p in index.complete("late")] == [9]
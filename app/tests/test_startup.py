@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start of one worker: importing main (measured around 2s) and running
+# the lifespan startup. Raise these only with a reason.
+IMPORT_BUDGET_SECONDS = 4.0
+STARTUP_BUDGET_SECONDS = 1.0
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app):
+    ready = time.perf_counter()
+print(json.dumps({"import": imported - started, "startup": ready - imported,
+                  "heavy": sorted({"pandas", "numpy"} & set(sys.modules))}))
+"""
+
+
+def test_main_starts_fast_without_a_database():
+    # nothing listens on port 1: any connection attempt at import fails it
+    env = dict(os.environ, POSTGRES_HOST="127.0.0.1", POSTGRES_PORT="1", POSTGRES_USER="app",
+               POSTGRES_PASSWORD="app", POSTGRES_DB="app", DB_MODE="sync", CATALOG_CACHE_BUS="local")
+    env.pop("APP_PORT", None)
+    done = subprocess.run([sys.executable, "-c", PROBE], cwd=APP_DIR, env=env,
+                          capture_output=True, text=True, timeout=60)
+    assert done.returncode == 0, done.stderr
+    timings = json.loads(done.stdout.strip().splitlines()[-1])
+    print(f"startup: import {timings['import']:.2f}s, lifespan {timings['startup']:.3f}s")
+    assert timings["heavy"] == []
+    assert timings["import"] < IMPORT_BUDGET_SECONDS
+    assert timings["startup"] < STARTUP_BUDGET_SECONDS
@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from throttling import Limit, LocalBuckets, LoginThrottle
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    buckets = LocalBuckets()
+    limit = Limit(per_minute=60, burst=3)
+    assert [buckets.take("k", limit, now=0.0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("k", limit, now=0.0) == pytest.approx(1.0)
+    assert buckets.take("k", limit, now=0.5) == pytest.approx(0.5)
+    assert buckets.take("k", limit, now=1.0) == 0
+    # refills no further than the burst
+    assert [buckets.take("k", limit, now=100.0) for _ in range(4)][-1] > 0
+
+
+def test_least_recently_used_buckets_are_evicted():
+    buckets = LocalBuckets(max_keys=2)
+    limit = Limit(per_minute=60, burst=1)
+    for key in ("a", "b", "c"):
+        buckets.take(key, limit, now=0.0)
+    assert len(buckets) == 2
+    assert buckets.take("a", limit, now=0.0) == 0
+    assert buckets.take("c", limit, now=0.0) > 0
+
+
+def test_login_throttle_rejects_before_hashing_with_retry_after():
+    throttle = LoginThrottle(LocalBuckets(), {"ip": Limit(60, 3), "username": Limit(60, 2)})
+    assert throttle.check("Alice", "10.0.0.1") == 0
+    assert throttle.check("alice", "10.0.0.1") == 0
+    # the username is exhausted, whatever its case
+    assert throttle.check("ALICE", "10.0.0.1") > 0
+    assert throttle.check("bob", "10.0.0.1") > 0
+    assert throttle.counts == {("ip", "allowed"): 3, ("ip", "rejected"): 1,
+                               ("username", "allowed"): 2, ("username", "rejected"): 1}
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(throttle.admit("carol", "10.0.0.1"))
+    assert raised.value.status_code == 429
+    assert raised.value.headers["Retry-After"] == "1"
+    asyncio.run(throttle.admit("carol", "10.0.0.2"))
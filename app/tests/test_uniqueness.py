@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+import crud
+import migrations
+import schemas
+from database import RoutingSession
+
+
+class PgError(Exception):
+    """Stands in for a driver error carrying a SQLSTATE."""
+
+
+def integrity_error(code, constraint=None, cause=None):
+    orig = PgError("duplicate key value")
+    orig.pgcode = code
+    orig.diag = SimpleNamespace(constraint_name=constraint)
+    orig.__cause__ = cause
+    return IntegrityError("INSERT", {}, orig)
+
+
+def test_unique_violations_name_their_constraint():
+    exists = crud.as_already_exists(integrity_error("23505", "uq_companies_company_name"))
+    assert isinstance(exists, crud.AlreadyExistsError)
+    assert exists.constraint == "uq_companies_company_name"
+
+    # asyncpg: the adapted error carries the code, the one it wraps the name
+    cause = PgError("duplicate key value")
+    cause.constraint_name = "users_user_email_key"
+    assert crud.as_already_exists(integrity_error("23505", cause=cause)).constraint == "users_user_email_key"
+
+    assert crud.as_already_exists(integrity_error("23503", "invoices_user_id_fkey")) is None
+
+
+class FailingSession:
+    def __init__(self, error):
+        self.error = error
+        self.rolled_back = False
+
+    def commit(self):
+        raise self.error
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def test_commit_unique_rolls_back_and_raises():
+    db = FailingSession(integrity_error("23505", "uq_product_tags_tag_name"))
+    with pytest.raises(crud.AlreadyExistsError) as info:
+        crud.commit_unique(db)
+    assert db.rolled_back and isinstance(info.value.__cause__, IntegrityError)
+
+    db = FailingSession(integrity_error("23502"))
+    with pytest.raises(IntegrityError):
+        crud.commit_unique(db)
+    assert db.rolled_back
+
+
+def test_duplicate_creates_conflict(client):
+    client, _ = client
+    import database
+    engine = database.SessionLocal.kw["bind"]
+
+    # SQLite has no SQLSTATE; give its unique violations postgres' code
+    @event.listens_for(engine, "handle_error")
+    def as_postgres(context):
+        if "UNIQUE" in str(context.original_exception):
+            context.original_exception.pgcode = "23505"
+
+    assert client.post("/product_tags/create", json={"tag_name": "chairs"}).status_code == 201
+    response = client.post("/product_tags/create", json={"tag_name": "chairs"})
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Product tag with name chairs already exists"
+    assert client.post("/product_tags/create", params={"upsert": True},
+                       json={"tag_name": "chairs"}).status_code == 201
+
+
+def test_upserts_conflict_on_the_natural_key():
+    company = schemas.CompanyBase(company_name="Acme", company_address="1 Main St", company_phone="1", user_id=1)
+    for stmt, key in ((crud.company_upsert(company), "company_name"),
+                      (crud.product_tag_upsert(schemas.ProductTag(tag_name="chairs")), "tag_name")):
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        assert f"ON CONFLICT ({key}) DO UPDATE" in sql and "RETURNING" in sql
+
+
+def test_upserts_return_the_existing_row():
+    engine = create_engine("sqlite://")
+    migrations.upgrade(engine)
+    with RoutingSession(bind=engine) as db:
+        first = crud.upsert_product_tag(db, schemas.ProductTag(tag_name="chairs"))
+        second = crud.upsert_product_tag(db, schemas.ProductTag(tag_name="chairs"))
+        assert second.id == first.id
+        assert second.update_date >= first.create_date
@@ -0,0 +1,149 @@
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+
+# Login attempts allowed per minute and in a burst, per username and per
+# client address; both are checked before the user is looked up or hashed
+LOGIN_USERNAME_PER_MINUTE = float(os.getenv("LOGIN_USERNAME_PER_MINUTE", "5"))
+LOGIN_USERNAME_BURST = int(os.getenv("LOGIN_USERNAME_BURST", "5"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "60"))
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "30"))
+# "local" keeps the buckets in this process (each worker allows the full
+# rate); "postgres" shares them through the rate_limit_buckets table
+LOGIN_THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "local")
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+
+@dataclass(frozen=True)
+class Limit:
+    per_minute: float
+    burst: int
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60
+
+    @property
+    def refill_seconds(self) -> float:
+        """Time an empty bucket needs to fill up again."""
+        return self.burst / self.rate
+
+
+class LocalBuckets:
+    """Token buckets in a bounded LRU; an evicted bucket starts full again."""
+
+    shared = False
+
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, now: float = None) -> float:
+        """Take a token from ``key``'s bucket: 0 if there was one, else the
+        seconds until there will be."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class PostgresBuckets:
+    """Token buckets shared by every worker, one upsert per check.
+
+    The database clock refills them, so the workers' clocks don't matter.
+    Full buckets are deleted now and then; a missing row counts as full.
+    """
+
+    shared = True
+    PURGE_INTERVAL = 60
+
+    TAKE = text(
+        "INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at) "
+        "VALUES (:key, :burst - 1, EXTRACT(EPOCH FROM clock_timestamp())) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "tokens = LEAST(:burst, b.tokens + (EXCLUDED.updated_at - b.updated_at) * :rate) - 1, "
+        "updated_at = EXCLUDED.updated_at "
+        "WHERE LEAST(:burst, b.tokens + (EXCLUDED.updated_at - b.updated_at) * :rate) >= 1 "
+        "RETURNING tokens")
+    PURGE = text("DELETE FROM rate_limit_buckets "
+                 "WHERE updated_at < EXTRACT(EPOCH FROM clock_timestamp()) - :idle")
+
+    def __init__(self):
+        self._purged_at = float("-inf")
+        self.max_refill_seconds = 0.0
+
+    def take(self, key: str, limit: Limit, now: float = None) -> float:
+        import database
+        self.max_refill_seconds = max(self.max_refill_seconds, limit.refill_seconds)
+        with database.engine.begin() as conn:
+            taken = conn.execute(self.TAKE, {"key": key, "burst": limit.burst, "rate": limit.rate}).first()
+            if time.monotonic() - self._purged_at >= self.PURGE_INTERVAL:
+                self._purged_at = time.monotonic()
+                conn.execute(self.PURGE, {"idle": self.max_refill_seconds})
+        # the remaining fraction of a token is not returned on a miss
+        return 0.0 if taken is not None else 1 / limit.rate
+
+    def __len__(self):
+        return 0
+
+
+BACKENDS = {"local": LocalBuckets, "postgres": PostgresBuckets}
+
+
+class LoginThrottle:
+    """Admission control for /token, checked before any password hashing.
+
+    The address bucket is checked first, so a burst spread over many
+    usernames stops there without touching the username buckets.
+    """
+
+    def __init__(self, backend, limits: dict = None):
+        self.backend = backend
+        self.limits = limits or {"ip": Limit(LOGIN_IP_PER_MINUTE, LOGIN_IP_BURST),
+                                 "username": Limit(LOGIN_USERNAME_PER_MINUTE, LOGIN_USERNAME_BURST)}
+        self.counts = Counter()
+
+    def check(self, username: str, ip: str) -> float:
+        """0 if the attempt may go ahead, else seconds to wait."""
+        for scope, key in (("ip", ip), ("username", username.casefold())):
+            wait = self.backend.take(f"{scope}:{key}", self.limits[scope])
+            if wait:
+                self.counts[scope, "rejected"] += 1
+                return wait
+            self.counts[scope, "allowed"] += 1
+        return 0.0
+
+    async def admit(self, username: str, ip: str):
+        """Raise 429 with Retry-After when ``username`` or ``ip`` is over budget."""
+        if self.backend.shared:
+            wait = await run_in_threadpool(self.check, username, ip)
+        else:
+            wait = self.check(username, ip)
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts, try again later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    def stats(self) -> dict:
+        return {"counts": dict(self.counts), "buckets": len(self.backend)}
+
+
+login_throttle = LoginThrottle(BACKENDS[LOGIN_THROTTLE_BACKEND]())
@@ -0,0 +1,94 @@
+"""Compare DB_MODE=sync and DB_MODE=async against a local Postgres.
+
+Each mode runs in its own subprocess (DB_MODE is read at import time) and
+issues ``--requests`` data-layer calls through ``dal`` with ``--concurrency``
+of them in flight, one session per call, the same way a request would.
+
+    POSTGRES_HOST=localhost POSTGRES_PORT=5432 POSTGRES_USER=... \\
+    POSTGRES_PASSWORD=... POSTGRES_DB=... python benchmarks/bench_db_modes.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def run_worker(requests, concurrency):
+    sys.path.insert(0, APP_DIR)
+    import dal
+    import database
+    import migrations
+
+    migrations.upgrade(database.engine)
+
+    def session():
+        if database.DB_MODE == "async":
+            return database.AsyncSessionLocal()
+        return database.SessionLocal()
+
+    async def close(db):
+        if database.DB_MODE == "async":
+            await db.close()
+        else:
+            db.close()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            db = session()
+            started = time.perf_counter()
+            try:
+                await dal.get_user(db=db, user_id=i % 1000 + 1)
+                await dal.get_product_tags(db=db)
+            finally:
+                await close(db)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {"mode": database.DB_MODE,
+            "requests": requests,
+            "concurrency": concurrency,
+            "rps": round(requests / elapsed, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(run_worker(args.requests, args.concurrency))))
+        return
+
+    for mode in ("sync", "async"):
+        env = dict(os.environ, DB_MODE=mode)
+        out = subprocess.run([sys.executable, __file__, "--worker",
+                              "--requests", str(args.requests),
+                              "--concurrency", str(args.concurrency)],
+                             env=env, check=True, capture_output=True, text=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print("{mode:>5}: {rps:>8} req/s  p50 {p50_ms}ms  p95 {p95_ms}ms  p99 {p99_ms}ms".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Cost of turning a page of ORM rows into a response body.
+
+Compares the old path (no response model: ``jsonable_encoder`` over the
+instance ``__dict__`` and ``JSONResponse``) with the typed path (validate into
+the ``schemas.*Out`` response model and render with ``ORJSONResponse``). Rows
+are built in memory, so no database is needed.
+
+    python benchmarks/bench_serialization.py --rows 10000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+import models
+import schemas
+
+
+def invoices(n):
+    start = datetime(2024, 1, 1)
+    return [models.Invoice(id=i, product_id=i % 50, user_id=i % 700, company_id=i % 20,
+                           status="shipped", create_date=start + timedelta(minutes=i),
+                           deliver_date=None) for i in range(n)]
+
+
+def users(n):
+    return [models.User(id=i, user_name=f"user{i}", user_phone=f"+1555{i:07d}",
+                        user_identity_code=str(i), user_email=f"user{i}@example.com",
+                        user_address=f"{i} Main St", user_password="$2b$12$" + "x" * 53,
+                        last_login_token="t" * 64, user_is_company=False,
+                        date_created=datetime(2024, 1, 1)) for i in range(n)]
+
+
+def before(rows):
+    return JSONResponse(jsonable_encoder(rows)).body
+
+
+def after(rows, field):
+    content = asyncio.run(serialize_response(field=field, response_content=rows, exclude_unset=True))
+    return ORJSONResponse(content).body
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, rows, schema in (("invoices", invoices(args.rows), schemas.InvoiceOut),
+                               ("users", users(args.rows), schemas.UserOut)):
+        field = create_response_field(name="response", type_=list[schema])
+        old = timed(lambda: before(rows), args.repeat)
+        new = timed(lambda: after(rows, field), args.repeat)
+        per_10k = 10000 / args.rows
+        print(f"{name:9s} jsonable_encoder+json: {old * per_10k * 1000:8.1f} ms/10k rows   "
+              f"response model+orjson: {new * per_10k * 1000:8.1f} ms/10k rows   "
+              f"speedup {old / new:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""Load test the API end to end and flag regressions against a baseline.
+
+Seeds the database configured by the ``POSTGRES_*`` variables with
+``--users``/``--products``/``--invoices``... rows, then drives each scenario
+(login, list, by-id and create endpoints) with ``--concurrency`` requests in
+flight. Requests go through the ASGI app in this process, or to a running
+server with ``--url``. Every scenario reports throughput, latency percentiles
+and the SQL statements per request counted by the app's ``/metrics``.
+
+    python benchmarks/load_test.py --seed
+    python benchmarks/load_test.py --save-baseline benchmarks/baselines/local.json
+    python benchmarks/load_test.py --baseline benchmarks/baselines/local.json
+
+With ``--baseline`` the exit status is 1 when a scenario got slower or runs
+more statements per request than the baseline allows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+BENCH_USER = "bench{}"
+BENCH_PASSWORD = "bench-password"
+STATUSES = ("approved", "shipped", "delivered")
+SEED_CHUNK = 5000
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def app_modules():
+    sys.path.insert(0, APP_DIR)
+    # main.py needs these at import; an in-process run never binds the port
+    os.environ.setdefault("APP_PORT", "9090")
+    os.environ.setdefault("JWT_SECRET_KEY", "")
+    # the login scenario hammers /token from one client on purpose
+    for name in ("LOGIN_IP_PER_MINUTE", "LOGIN_IP_BURST", "LOGIN_USERNAME_PER_MINUTE", "LOGIN_USERNAME_BURST"):
+        os.environ.setdefault(name, "1000000")
+    import database
+    import models
+    return database, models
+
+
+# -- seeding ---------------------------------------------------------------
+
+def _chunks(rows):
+    for start in range(0, len(rows), SEED_CHUNK):
+        yield rows[start:start + SEED_CHUNK]
+
+
+def seed(volumes: dict, reset: bool, rng: random.Random):
+    database, models = app_modules()
+    from sqlalchemy import insert, select
+    import analytics
+    import migrations
+    from hashing import pwd_context
+
+    if reset:
+        models.Base.metadata.drop_all(bind=database.engine)
+    migrations.upgrade(database.engine)
+    with database.SessionLocal() as db:
+        if db.scalar(select(models.User.id).where(models.User.user_name == BENCH_USER.format(1))):
+            print("already seeded (pass --reset to start over)")
+            return
+
+    now = datetime.now()
+    hashed = pwd_context.hash(BENCH_PASSWORD)
+    n_users, n_companies = volumes["users"], volumes["companies"]
+    n_tags, n_products = volumes["product_tags"], volumes["products"]
+    words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9)))
+             for _ in range(500)]
+    tables = [
+        (models.User, [{"user_name": BENCH_USER.format(i), "user_password": hashed,
+                        "user_email": f"bench{i}@example.com", "user_phone": f"+1555{i:07d}",
+                        "user_identity_code": f"B{i:010d}", "user_address": f"{i} Bench St",
+                        "date_created": now - timedelta(days=rng.randint(0, 365))}
+                       for i in range(1, n_users + 1)]),
+        (models.Company, [{"company_name": f"bench-company-{i}", "company_address": f"{i} Market St",
+                           "company_phone": f"+1666{i:07d}", "user_id": rng.randint(1, n_users),
+                           "create_date": now, "update_date": now}
+                          for i in range(1, n_companies + 1)]),
+        (models.ProductTag, [{"tag_name": f"bench-tag-{i}", "create_date": now, "update_date": now}
+                             for i in range(1, n_tags + 1)]),
+        (models.Product, [{"product_name": " ".join(rng.choices(words, k=3)),
+                           "product_price": round(rng.uniform(1, 500), 2),
+                           "product_tag_id": rng.randint(1, n_tags),
+                           "company_id": rng.randint(1, n_companies),
+                           "create_date": now, "update_date": now}
+                          for _ in range(n_products)]),
+    ]
+    invoices = []
+    for _ in range(volumes["invoices"]):
+        created = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+        status = rng.choice(STATUSES)
+        invoices.append({"product_id": rng.randint(1, n_products), "user_id": rng.randint(1, n_users),
+                         "company_id": rng.randint(1, n_companies), "status": status,
+                         "create_date": created,
+                         "deliver_date": created + timedelta(hours=rng.randint(2, 240))
+                         if status == "delivered" else None})
+    tables.append((models.Invoice, invoices))
+
+    started = time.perf_counter()
+    with database.engine.begin() as conn:
+        for model, rows in tables:
+            for chunk in _chunks(rows):
+                conn.execute(insert(model), chunk)
+    with database.SessionLocal() as db:
+        analytics.rebuild(db)
+    print("seeded " + ", ".join(f"{len(rows)} {model.__tablename__}" for model, rows in tables)
+          + f" in {time.perf_counter() - started:.1f}s")
+
+
+# -- scenarios -------------------------------------------------------------
+
+def scenarios(volumes: dict):
+    """name -> function(rng) returning ``(method, path, request kwargs)``."""
+    def by_id(path, volume):
+        return lambda rng: ("GET", path.format(rng.randint(1, volumes[volume])), {})
+
+    def listing(path):
+        return lambda rng: ("GET", path, {"params": {"limit": 100}})
+
+    return {
+        "login": lambda rng: ("POST", "/token", {"data": {
+            "username": BENCH_USER.format(rng.randint(1, volumes["users"])), "password": BENCH_PASSWORD}}),
+        "list_users": listing("/users"),
+        "list_companies": listing("/companies"),
+        "list_product_tags": listing("/product_tags"),
+        "list_products": listing("/products"),
+        "list_invoices": listing("/invoices"),
+        "get_user": by_id("/users/{}", "users"),
+        "get_company": by_id("/companies/{}", "companies"),
+        "get_product": by_id("/products/{}", "products"),
+        "get_invoice": by_id("/invoices/{}", "invoices"),
+        "create_company": lambda rng: ("POST", "/companies/create", {"json": {
+            "company_name": f"load-{uuid.uuid4().hex}", "company_address": "1 Load St",
+            "company_phone": "+15550000000", "user_id": rng.randint(1, volumes["users"])}}),
+        "create_product": lambda rng: ("POST", "/products/create", {"json": {
+            "product_name": f"load product {rng.randint(1, 10 ** 6)}", "product_price": 9.5,
+            "product_tag_id": rng.randint(1, volumes["product_tags"]),
+            "company_id": rng.randint(1, volumes["companies"])}}),
+        "create_invoice": lambda rng: ("POST", "/invoices/create_invoice", {"json": {
+            "product_id": rng.randint(1, volumes["products"]), "user_id": rng.randint(1, volumes["users"]),
+            "company_id": rng.randint(1, volumes["companies"])}}),
+    }
+
+
+_SAMPLE = re.compile(r'^(http_responses_total|http_db_statements_total)\{method="[^"]*",route="([^"]*)"[^}]*\} (\S+)$')
+
+
+async def db_counters(client):
+    """``(requests, statements)`` served so far, not counting /metrics itself."""
+    totals = {"http_responses_total": 0.0, "http_db_statements_total": 0.0}
+    for line in (await client.get("/metrics")).text.splitlines():
+        match = _SAMPLE.match(line)
+        if match and match.group(2) != "/metrics":
+            totals[match.group(1)] += float(match.group(3))
+    return totals["http_responses_total"], totals["http_db_statements_total"]
+
+
+async def run_scenario(client, make_request, requests: int, concurrency: int,
+                       headers: dict, rng: random.Random) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        method, path, kwargs = make_request(rng)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, path, headers=headers, **kwargs)
+            latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors += 1
+
+    served_before, statements_before = await db_counters(client)
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    served, statements = await db_counters(client)
+    served -= served_before
+    return {"requests": requests,
+            "errors": errors,
+            "rps": round(requests / elapsed, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "db_statements_per_request": round((statements - statements_before) / served, 2)
+            if served else None}
+
+
+async def run(args, volumes: dict) -> dict:
+    import httpx
+
+    lifespan = None
+    if args.url:
+        transport = None
+        base_url = args.url
+    else:
+        app_modules()
+        import main
+        transport = httpx.ASGITransport(app=main.app)
+        base_url = "http://load-test"
+        # ASGITransport sends no lifespan events
+        lifespan = main.app.router.lifespan_context(main.app)
+        await lifespan.__aenter__()
+
+    rng = random.Random(args.random_seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits,
+                                     timeout=60) as client:
+            login = await client.post("/token", data={"username": BENCH_USER.format(1),
+                                                      "password": BENCH_PASSWORD})
+            login.raise_for_status()
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            available = scenarios(volumes)
+            for name in args.scenarios:
+                requests = args.login_requests if name == "login" else args.requests
+                if args.warmup:
+                    await run_scenario(client, available[name], args.warmup, args.concurrency, headers, rng)
+                results[name] = await run_scenario(client, available[name], requests,
+                                                   args.concurrency, headers, rng)
+                print_result(name, results[name])
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+    return results
+
+
+# -- reporting and baselines -----------------------------------------------
+
+def print_result(name: str, result: dict, flags=()):
+    line = ("{name:<18} {rps:>9} req/s  p50 {p50_ms:>8}ms  p95 {p95_ms:>8}ms  p99 {p99_ms:>8}ms  "
+            "{db_statements_per_request} stmt/req  {errors} errors").format(name=name, **result)
+    print(line + "".join(f"  REGRESSION: {flag}" for flag in flags))
+
+
+def compare(results: dict, baseline: dict, tolerance: float, statement_tolerance: float) -> dict:
+    """scenario -> list of regressions against ``baseline["results"]``."""
+    regressions = {}
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        flags = []
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            flags.append(f"rps {base['rps']} -> {result['rps']}")
+        for key in ("p95_ms", "p99_ms"):
+            if result[key] > base[key] * (1 + tolerance):
+                flags.append(f"{key} {base[key]} -> {result[key]}")
+        before, after = base["db_statements_per_request"], result["db_statements_per_request"]
+        if before is not None and after is not None and after > before + statement_tolerance:
+            flags.append(f"stmt/req {before} -> {after}")
+        if flags:
+            regressions[name] = flags
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(APP_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="\n".join(__doc__.splitlines()[2:]))
+    parser.add_argument("--url", help="test a running server instead of the in-process app")
+    parser.add_argument("--seed", action="store_true", help="seed the database and exit")
+    parser.add_argument("--reset", action="store_true", help="drop all tables before seeding")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--companies", type=int, default=50)
+    parser.add_argument("--product-tags", type=int, default=100)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--invoices", type=int, default=100000)
+    parser.add_argument("--scenarios", default=",".join(scenarios({})),
+                        type=lambda value: value.split(","))
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=100,
+                        help="requests for the login scenario, which is bcrypt bound")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative drop in rps / rise in p95 and p99")
+    parser.add_argument("--statement-tolerance", type=float, default=0.1,
+                        help="allowed rise in statements per request")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(scenarios({}))
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    volumes = {"users": args.users, "companies": args.companies, "product_tags": args.product_tags,
+               "products": args.products, "invoices": args.invoices}
+    if args.seed:
+        seed(volumes, args.reset, random.Random(args.random_seed))
+        return
+
+    results = asyncio.run(run(args, volumes))
+    report = {"commit": git_commit(),
+              "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              "config": {"target": args.url or "in-process",
+                         "db_mode": os.getenv("DB_MODE", "sync"),
+                         "concurrency": args.concurrency,
+                         "requests": args.requests,
+                         "volumes": volumes},
+              "results": results}
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.statement_tolerance)
+        print(f"\ncompared with {args.baseline} (commit {baseline.get('commit')}):")
+        for name, result in results.items():
+            print_result(name, result, regressions.get(name, ()))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()